@@ -1,57 +1,130 @@
 import os
 import io
 import base64
-from typing import Optional
+import hashlib
+from contextlib import nullcontext
+from typing import Optional, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import streamlit as st
 from PIL import Image
-from groq import Groq
 from tenacity import retry, stop_after_attempt, wait_exponential
 
+from disk_cache import DiskCache
+from resources import get_registry
+import telemetry
+
 # Constants
 MAX_RETRIES = 3
 WAIT_MULTIPLIER = 1  # seconds
+MAX_IMAGE_SIDE = 1024  # pixels, longest side sent to the vision model
+JPEG_QUALITY = 85
+DESCRIPTION_CACHE_PATH = os.path.join(".cache", "image_descriptions.sqlite")
+DESCRIPTION_CACHE_MAX_BYTES = 20 * 2**20
 
 class APIKeyError(Exception):
     """Raised when the GROQ API key is missing."""
     pass
 
 def get_api_key() -> str:
-    """Retrieve the GROQ API key from Streamlit secrets or environment variables."""
-    api_key = st.secrets.get("GROQ_API_KEY") or os.getenv("GROQ_API_KEY")
+    """Retrieve the GROQ API key from the environment or, failing that, Streamlit secrets."""
+    # The environment first, so the headless service and batch jobs never touch streamlit
+    api_key = os.getenv("GROQ_API_KEY") or st.secrets.get("GROQ_API_KEY")
     if not api_key:
-        st.error("❌ GROQ API Key is missing. Please set it in your environment or Streamlit secrets.")
+        telemetry.report_error("api_key", "❌ GROQ API Key is missing. Please set it in your environment or Streamlit secrets.")
         raise APIKeyError("Missing GROQ_API_KEY")
     return api_key
 
-def convert_image_to_base64(image_path: str) -> Optional[str]:
-    """Convert a local image to a base64-encoded JPEG data URL."""
+def get_description_cache() -> DiskCache:
+    """Process-wide persistent cache of image descriptions."""
+    return get_registry().get(
+        "description_cache",
+        lambda: DiskCache(DESCRIPTION_CACHE_PATH, max_bytes=DESCRIPTION_CACHE_MAX_BYTES),
+    )
+
+def read_image_bytes(image_input) -> bytes:
+    """Read the raw bytes of a local image path or an uploaded file object."""
+    if hasattr(image_input, "getvalue"):
+        return image_input.getvalue()
+    if hasattr(image_input, "read"):
+        image_input.seek(0)
+        data = image_input.read()
+        image_input.seek(0)
+        return data
+    with open(image_input, "rb") as f:
+        return f.read()
+
+def normalize_url(url: str) -> str:
+    """Normalize a URL so trivially different spellings of the same image share a cache entry."""
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+def image_cache_key(image_input, is_local: bool, model: str,
+                    max_side: int = MAX_IMAGE_SIDE, quality: int = JPEG_QUALITY) -> str:
+    """Content hash for local images, normalized URL for remote ones, scoped to the model and preprocessing."""
+    if is_local:
+        source = "sha256:" + hashlib.sha256(read_image_bytes(image_input)).hexdigest()
+    else:
+        source = "url:" + normalize_url(image_input)
+    return f"{model}|{max_side}|{quality}|{source}"
+
+def preprocess_image(data: bytes, max_side: int = MAX_IMAGE_SIDE, quality: int = JPEG_QUALITY) -> bytes:
+    """Downscale an image so its longest side is at most `max_side` and re-encode it as JPEG."""
+    with Image.open(io.BytesIO(data)) as img:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=quality, optimize=True)
+        return buffer.getvalue()
+
+def convert_image_to_base64(image_path: Union[str, io.IOBase], max_side: int = MAX_IMAGE_SIDE,
+                            quality: int = JPEG_QUALITY) -> Optional[str]:
+    """Convert a local image to a downscaled, base64-encoded JPEG data URL."""
     try:
-        with Image.open(image_path) as img:
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            buffer = io.BytesIO()
-            img.save(buffer, format='JPEG')
-            base64_img = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            return f"data:image/jpeg;base64,{base64_img}"
+        jpeg = preprocess_image(read_image_bytes(image_path), max_side=max_side, quality=quality)
+        base64_img = base64.b64encode(jpeg).decode('utf-8')
+        return f"data:image/jpeg;base64,{base64_img}"
     except Exception as e:
-        st.error(f"❌ Failed to convert image: {e}")
+        telemetry.report_error("describe_image", f"❌ Failed to convert image: {e}")
         return None
 
-@retry(stop=stop_after_attempt(MAX_RETRIES), wait=wait_exponential(multiplier=WAIT_MULTIPLIER))
+@retry(stop=stop_after_attempt(MAX_RETRIES), wait=wait_exponential(multiplier=WAIT_MULTIPLIER),
+       before_sleep=telemetry.count_retries("describe_image"))
 def get_image_description(image_input: str, is_local: bool = False,
-                          model: str = "meta-llama/llama-4-scout-17b-16e-instruct") -> Optional[str]:
+                          model: str = "meta-llama/llama-4-scout-17b-16e-instruct",
+                          max_side: int = MAX_IMAGE_SIDE, quality: int = JPEG_QUALITY,
+                          use_cache: bool = True, show_progress: bool = True) -> Optional[str]:
     """
     Analyze a fashion image and return a descriptive summary.
 
+    Descriptions are cached on disk by image content hash (or normalized URL),
+    so Streamlit reruns don't call the vision model again for the same image.
+
     Args:
-        image_input (str): Path to local image or URL.
+        image_input (str): Path to local image, uploaded file, or URL.
         is_local (bool): Whether the input is a local file path.
         model (str): Model name to use for analysis.
+        max_side (int): Longest side local images are downscaled to before upload.
+        quality (int): JPEG quality used when re-encoding local images.
+        use_cache (bool): Whether to read and write the description cache.
+        show_progress (bool): Show the spinner and status messages (off when run in the background).
 
     Returns:
         Optional[str]: The descriptive summary, or None on failure.
     """
+    cache_key = None
+    if use_cache:
+        try:
+            cache_key = image_cache_key(image_input, is_local, model, max_side=max_side, quality=quality)
+            cached = get_description_cache().get_text(cache_key)
+            if cached is not None:
+                return cached
+        except Exception as e:
+            print(f"Description cache unavailable: {e}")
+            cache_key = None
+
     prompt = (
     "You are a professional fashion analysis assistant. "
     "Your task is to extract **concise and structured metadata** from fashion product images.\n\n"
@@ -76,14 +149,16 @@ def get_image_description(image_input: str, is_local: bool = False,
     "- Be confident, direct, and structured.\n"
      )
 
-    image_url = convert_image_to_base64(image_input) if is_local else image_input
+    with telemetry.span("preprocess_image"):
+        image_url = convert_image_to_base64(image_input, max_side=max_side, quality=quality) if is_local else image_input
     if not image_url:
         return None
 
     try:
-        client = Groq(api_key=get_api_key())
+        client = get_registry().groq_client(get_api_key())
 
-        with st.spinner("🤔 Analyzing image..."):
+        progress = st.spinner("🤔 Analyzing image...") if show_progress else nullcontext()
+        with progress, telemetry.span("llm.describe_image", model=model):
             response = client.chat.completions.create(
                 model=model,
                 temperature=0.3,
@@ -98,14 +173,21 @@ def get_image_description(image_input: str, is_local: bool = False,
                     }
                 ],
             )
+            telemetry.record_usage("describe_image", response)
 
         if response and response.choices:
-            st.success("✅ Image analysis complete!")
-            return response.choices[0].message.content
-
-        st.error("❌ Error during get image description, No response received from the model.")
+            if show_progress:
+                st.success("✅ Image analysis complete!")
+            description = response.choices[0].message.content
+            if cache_key and description:
+                get_description_cache().set(cache_key, description)
+            return description
+
+        report = st.error if show_progress else print
+        report("❌ Error during get image description, No response received from the model.")
         return None
 
     except Exception as e:
-        st.error(f"❌ Error during get image description: {e}")
+        report = st.error if show_progress else print
+        report(f"❌ Error during get image description: {e}")
         return None
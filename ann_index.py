@@ -0,0 +1,157 @@
+import faiss
+import numpy as np
+
+from typing import Dict, Optional, Tuple
+import json
+import os
+
+# Index types supported by VectorStoreManager and their faiss factory strings
+INDEX_TYPES = {
+    "flat": "Flat",
+    "ivf_flat": "IVF{nlist},Flat",
+    "hnsw": "HNSW{hnsw_m}",
+    "ivf_pq": "IVF{nlist},PQ{pq_m}",
+    "ivf_sq8": "IVF{nlist},SQ8",
+    "sq8": "SQ8",
+}
+
+PARAMS_FILE = "index_params.json"
+
+
+def default_nlist(n_vectors: int) -> int:
+    """Rule of thumb for the number of IVF cells: ~4 * sqrt(n), clamped to what can be trained."""
+    return int(max(1, min(4 * np.sqrt(n_vectors), n_vectors // 39)))
+
+
+def build_faiss_index(vectors: np.ndarray, index_type: str = "flat", nlist: Optional[int] = None,
+                      hnsw_m: int = 32, ef_construction: int = 200, pq_m: int = 16,
+                      train_size: int = 100_000) -> faiss.Index:
+    """
+    Build and populate a faiss index of the given type.
+
+    Args:
+        vectors (np.ndarray): float32 matrix of shape (n, d)
+        index_type (str): One of INDEX_TYPES
+        nlist (int): Number of IVF cells (default: derived from n)
+        hnsw_m (int): Neighbours per HNSW node
+        ef_construction (int): HNSW build-time search depth
+        pq_m (int): Number of PQ sub-quantizers (must divide d)
+        train_size (int): Max number of vectors sampled for training
+
+    Returns:
+        faiss.Index: The trained index with all vectors added
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Choose from: {', '.join(INDEX_TYPES)}")
+
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, d = vectors.shape
+    if index_type == "ivf_pq" and d % pq_m:
+        raise ValueError(f"pq_m={pq_m} must divide the vector dimension {d}")
+
+    factory = INDEX_TYPES[index_type].format(nlist=nlist or default_nlist(n), hnsw_m=hnsw_m, pq_m=pq_m)
+    index = faiss.index_factory(d, factory, faiss.METRIC_L2)
+
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = ef_construction
+
+    if not index.is_trained:
+        if n > train_size:
+            sample = np.random.default_rng(0).choice(n, size=train_size, replace=False)
+            index.train(vectors[np.sort(sample)])
+        else:
+            index.train(vectors)
+
+    index.add(vectors)
+    return index
+
+
+def set_search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+    """Set the default nprobe (IVF) / efSearch (HNSW) of an index in place. Unused params are ignored."""
+    if nprobe is not None:
+        ivf = _as_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = nprobe
+    if ef_search is not None:
+        hnsw = _as_hnsw(index)
+        if hnsw is not None:
+            hnsw.hnsw.efSearch = ef_search
+
+
+def search_parameters(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                      mask: Optional[np.ndarray] = None) -> Optional[faiss.SearchParameters]:
+    """
+    Build per-query search parameters, so concurrent callers can use different settings safely.
+
+    Args:
+        nprobe (int): IVF cells to probe
+        ef_search (int): HNSW search depth
+        mask (np.ndarray): Boolean array over index positions; only positions set to True are returned
+    """
+    kwargs = {}
+    if mask is not None:
+        bitmap = np.packbits(np.asarray(mask, dtype=bool), bitorder="little")
+        kwargs["sel"] = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+
+    if _as_ivf(index) is not None and (nprobe is not None or kwargs):
+        params = faiss.SearchParametersIVF(**kwargs)
+        if nprobe is not None:
+            params.nprobe = nprobe
+    elif _as_hnsw(index) is not None and (ef_search is not None or kwargs):
+        params = faiss.SearchParametersHNSW(**kwargs)
+        if ef_search is not None:
+            params.efSearch = ef_search
+    elif kwargs:
+        params = faiss.SearchParameters(**kwargs)
+    else:
+        return None
+
+    if mask is not None:
+        # The selector only points at the bitmap; keep it alive as long as the params
+        params.bitmap = bitmap
+    return params
+
+
+def search(index: faiss.Index, queries: np.ndarray, k: int, nprobe: Optional[int] = None,
+           ef_search: Optional[int] = None, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Search a batch of queries, optionally overriding nprobe/efSearch or restricting results to `mask`."""
+    queries = np.ascontiguousarray(queries, dtype="float32").reshape(-1, index.d)
+    params = search_parameters(index, nprobe=nprobe, ef_search=ef_search, mask=mask)
+    if params is None:
+        return index.search(queries, k)
+    return index.search(queries, k, params=params)
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """Size of the serialized index, a close proxy for its resident memory."""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def save_index_params(path: str, params: Dict) -> None:
+    with open(os.path.join(path, PARAMS_FILE), "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2)
+
+
+def load_index_params(path: str) -> Dict:
+    params_path = os.path.join(path, PARAMS_FILE)
+    if not os.path.exists(params_path):
+        return {"index_type": "flat"}
+    with open(params_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def rebuild_faiss_index(vectors: np.ndarray, params: Dict) -> faiss.Index:
+    """Build an index over `vectors` with the type and build params recorded in `params` (from load_index_params)."""
+    return build_faiss_index(vectors, index_type=params.get("index_type", "flat"), **params.get("build", {}))
+
+
+def _as_ivf(index: faiss.Index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def _as_hnsw(index: faiss.Index):
+    index = faiss.downcast_index(index)
+    return index if isinstance(index, faiss.IndexHNSW) else None
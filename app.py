@@ -1,57 +1,235 @@
 import streamlit as st
 from PIL import Image
-import requests
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
+import hashlib
+import os
 
 from Get_LLM_response import LLMRecommender
-from Get_Ai_Image_Description import get_image_description
+from Get_Ai_Image_Description import get_image_description, normalize_url
+from catalog_store import CatalogStore
+from pipeline import PIPELINE_DEADLINE, RecommendationPipeline
+from resources import get_registry
+from service_client import RECOMMENDER_SERVICE_URL, RecommenderClient
+from visual_search import DEFAULT_IMAGE_INDEX_PATH, VisualSearch, has_image_index
+import telemetry
 
 st.set_page_config(page_title="Fashion Recommender", layout="wide")
 
-# -------- Helper Functions --------
-def get_image_and_description_by_index(image_index: int) -> tuple:
-    dataset = "tomytjandra/h-and-m-fashion-caption"
-    config = "default"
-    split = "train"
-    
-    url = (
-        "https://datasets-server.huggingface.co/rows"
-        f"?dataset={dataset}"
-        f"&config={config}"
-        f"&split={split}"
-        f"&offset={image_index}"
-        f"&limit=1"
-    )
-
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f"Failed to fetch data: {response.status_code}")
-    
-    data = response.json()
-    
-    try:
-        row = data["rows"][0]["row"]
-        image_url = row["image"]["src"]
-        description = row["text"]
-        
-        image_response = requests.get(image_url)
-        image = Image.open(BytesIO(image_response.content))
-        
-        return image, description
-    except (IndexError, KeyError) as e:
-        raise ValueError("Invalid response structure or index out of range") from e
+# Load the embedding model, vector store and API clients once per process, in the background
+registry = get_registry()
+if not RECOMMENDER_SERVICE_URL:
+    registry.warm_up()
+if telemetry.METRICS_PORT:
+    registry.get("metrics_server", telemetry.start_metrics_server)
+
+# Show the per-stage waterfall of the latest requests below the results
+DEBUG_TRACE = os.getenv("DEBUG_TRACE", "0") == "1"
 
+# Match uploaded images against the catalog images directly when an image index is built (see visual_search.py);
+# the vision-LLM description then runs in the background and only refines the results
+IMAGE_INDEX_PATH = os.getenv("IMAGE_INDEX_PATH", DEFAULT_IMAGE_INDEX_PATH)
+# Stream the rephrasing and the LLM rerank, rendering each result as soon as it is picked
+STREAM_RESULTS = os.getenv("STREAM_RESULTS", "1") == "1"
+VISUAL_SEARCH = not RECOMMENDER_SERVICE_URL and has_image_index(IMAGE_INDEX_PATH)
+
+# -------- Helper Functions --------
 def load_image_from_url(url: str):
     try:
-        response = requests.get(url)
+        response = registry.http_session().get(url)
         return Image.open(BytesIO(response.content))
     except Exception:
         return None
 
+def keep_trace(trace: telemetry.Trace):
+    st.session_state.setdefault("traces", {})[trace.name] = trace.to_dict()
+
+def show_trace(trace: dict):
+    """Waterfall of one request: a bar per span, offset by its start time."""
+    total = max(trace["duration"], 1e-6)
+    st.markdown(f"**{trace['name']}** — {trace['duration'] * 1000:.0f} ms")
+    rows = []
+    for span in trace["spans"]:
+        left = 100 * span["start"] / total
+        width = max(0.5, 100 * span["duration"] / total)
+        color = "#e45756" if span["error"] else "#4c78a8"
+        indent = "&nbsp;" * 3 * span["depth"]
+        rows.append(
+            "<div style='display:flex;align-items:center;font-size:12px;line-height:18px'>"
+            f"<div style='width:28%;white-space:nowrap;overflow:hidden'>{indent}{span['name']}</div>"
+            "<div style='width:57%;position:relative;height:12px;background:#f0f2f6'>"
+            f"<div style='position:absolute;left:{left:.2f}%;width:{width:.2f}%;height:12px;background:{color}'></div>"
+            "</div>"
+            f"<div style='width:15%;text-align:right'>{span['duration'] * 1000:.1f} ms</div>"
+            "</div>"
+        )
+    st.markdown("".join(rows), unsafe_allow_html=True)
+    if trace["counters"]:
+        st.caption(", ".join(f"{name}: {value:g}" for name, value in sorted(trace["counters"].items())))
+
+def service_client():
+    """Client for the headless recommendation service, or None to run everything in-process."""
+    if not RECOMMENDER_SERVICE_URL:
+        return None
+    return registry.get("service_client", RecommenderClient)
+
+def describe_image(image_input, is_local: bool):
+    client = service_client()
+    if client is not None:
+        try:
+            return client.describe_image(image_input, is_local=is_local)
+        except Exception as e:
+            st.error(f"❌ Error during get image description: {e}")
+            return None
+
+    with telemetry.trace("describe_image") as trace:
+        description = get_image_description(image_input, is_local=is_local)
+    keep_trace(trace)
+    return description
+
+def image_key(image_input, is_local: bool) -> str:
+    return hashlib.sha256(image_input.getvalue()).hexdigest() if is_local else normalize_url(image_input)
+
+def describe_image_async(image_input, is_local: bool, key: str) -> Future:
+    """Start describing the image in the background, once per image per session."""
+    if is_local:
+        # The worker gets its own copy; the uploaded file is still read by this script run
+        image_input = BytesIO(image_input.getvalue())
+    futures = st.session_state.setdefault("descriptions", {})
+    if key not in futures:
+        executor = registry.get("description_executor",
+                                lambda: ThreadPoolExecutor(max_workers=4, thread_name_prefix="describe"))
+        futures[key] = telemetry.submit(executor, get_image_description, image_input, is_local=is_local,
+                                        show_progress=False)
+    return futures[key]
+
+def ready_description(description_future: Future):
+    """The background description if it finished successfully, else None (the search stays visual-only)."""
+    if not description_future.done() or description_future.exception() is not None:
+        return None
+    return description_future.result()
+
+def visual_recommendations(image: Image.Image, user_query: str = "", image_description: str = None,
+                           n: int = 4, k: int = 30):
+    """Visual search fused with text search on the query and description, then diversified and reranked."""
+    llm_recommender = registry.get("llm_recommender", LLMRecommender)
+    vecdb = llm_recommender.recommendations_object
+    visual_search = registry.get(f"visual_search:{IMAGE_INDEX_PATH}",
+                                 lambda: VisualSearch(IMAGE_INDEX_PATH, text_search=vecdb.search))
+    text = "\n".join(part for part in (user_query, image_description) if part)
+    with telemetry.trace("visual_recommend") as trace:
+        candidates = visual_search.search_fused(image, text, k=k)
+        if text:
+            candidates = vecdb.diversify(text, candidates)
+        if user_query and llm_recommender.reranker is not None:
+            with telemetry.span("local_rerank", candidates=len(candidates)):
+                candidates = llm_recommender.reranker.rerank(user_query, candidates, n)
+    keep_trace(trace)
+    return {"results": [{"id": str(item["id"])} for item in candidates[:n]]}
+
+def process_image_query(image: Image.Image, image_input, is_local: bool):
+    """Image inputs with an image index: search right away, fold in the description when it's ready."""
+    key = image_key(image_input, is_local)
+    description_future = describe_image_async(image_input, is_local, key)
+
+    user_query = st.text_input("Describe what you're looking for with this item (optional):")
+    if st.button("Find Similar Items"):
+        image_description = ready_description(description_future)
+        try:
+            st.session_state.visual_results = (key, visual_recommendations(image, user_query, image_description))
+        except Exception as e:
+            st.error(f"❌ Failed to get recommendations: {e}")
+
+    image_description = ready_description(description_future)
+    if image_description:
+        with st.expander("📝 Analysis Results"):
+            st.markdown(image_description)
+    elif not description_future.done():
+        st.caption("📝 Image analysis is running in the background and will refine the next search.")
+    elif description_future.exception() is not None:
+        st.caption(f"⚠️ Image analysis failed, searching by the image alone: {description_future.exception()}")
+
+    results_key, recommendations = st.session_state.get("visual_results", (None, None))
+    if results_key == key:
+        display_recommendations(recommendations)
+
 def generate_enhanced_query(user_query: str, image_description: str = None):
     final_query = f"{user_query}\nItem Description: {image_description}" if image_description else user_query
-    llm_recommender = LLMRecommender()
-    return llm_recommender.get_recommendations(final_query)
+    client = service_client()
+    if client is not None:
+        user_intent, recommendations, st.session_state.pipeline_path = client.recommend(final_query)
+        return user_intent, recommendations
+
+    llm_recommender = registry.get("llm_recommender", LLMRecommender)
+    with telemetry.trace("recommend") as trace:
+        if PIPELINE_DEADLINE <= 0:
+            user_intent, recommendations = llm_recommender.get_recommendations(final_query)
+        else:
+            # Deadline-aware pipeline: degrades to vector-only results instead of waiting on slow LLM stages
+            pipeline = registry.get("pipeline", lambda: RecommendationPipeline(llm_recommender))
+            result = pipeline.run(final_query)
+            st.session_state.pipeline_path = result.path
+            user_intent, recommendations = result.user_intent, result.recommendations
+    keep_trace(trace)
+    return user_intent, recommendations
+
+def show_item(column, item):
+    img, desc = item
+    with column:
+        st.image(img, use_container_width=True)
+        st.markdown(f"**Description:** {desc}")
+
+def stream_recommendations(user_query: str, image_description: str = None, n: int = 4):
+    """Show the rephrasing token by token and each recommended item as soon as the reranker picks it."""
+    final_query = f"{user_query}\nItem Description: {image_description}" if image_description else user_query
+    llm_recommender = registry.get("llm_recommender", LLMRecommender)
+    pipeline = registry.get("pipeline", lambda: RecommendationPipeline(llm_recommender))
+    catalog = registry.get("catalog_store", CatalogStore)
+
+    st.subheader("📝 Enhanced Query")
+    intent_box = st.empty()
+    st.subheader("🎯 Recommended Items")
+    cols = st.columns(n)
+    pieces, started, pending, result, discarded = [], [], {}, None, None
+
+    def show_ready(wait: bool = False):
+        for slot, (image_index, lookup) in list(pending.items()):
+            if wait or lookup.done():
+                item = lookup.result().get(image_index)
+                if item is None:
+                    cols[slot].warning(f"Failed to load item {image_index}")
+                else:
+                    show_item(cols[slot], item)
+                del pending[slot]
+
+    with telemetry.trace("recommend") as trace:
+        for event, value in pipeline.stream(final_query, n=n):
+            if event == "intent_token":
+                pieces.append(value)
+                intent_box.success("".join(pieces) + " ▌")
+            elif event == "intent_discarded":
+                # The partial rephrasing shown so far won't be used; the raw query is searched instead
+                pieces, discarded = [], "took too long" if value == "deadline" else "failed"
+                intent_box.warning(f"Enhancing the query {discarded}; searching your query as written.")
+            elif event == "intent":
+                if discarded:
+                    intent_box.warning(f"Enhancing the query {discarded}; searching your query as written: {value}")
+                else:
+                    intent_box.success(value)
+            elif event == "item":
+                # Start loading the catalog entry right away; earlier items render while later ids stream in
+                slot = len(started)
+                started.append(value["id"])
+                pending[slot] = (int(value["id"]), telemetry.submit(pipeline.executor, catalog.get_many,
+                                                                    [int(value["id"])]))
+            elif event == "result":
+                result = value
+            show_ready()
+        show_ready(wait=True)
+    keep_trace(trace)
+    if not started:
+        st.error("Unfortunately 🙁, no recommendations were found in our data.")
+    return result
 
 def display_recommendations(recommendations):
     st.subheader("🎯 Recommended Items")
@@ -63,15 +241,19 @@ def display_recommendations(recommendations):
             st.error("Unfortunately 🙁, no recommendations were found in our data.")
             return
 
+        # One batched lookup from the local catalog store; missing ids are fetched concurrently
+        catalog = registry.get("catalog_store", CatalogStore)
+        with telemetry.trace("display") as trace:
+            items = catalog.get_many([int(rec["id"]) for rec in results[:4]])
+        keep_trace(trace)
+
         cols = st.columns(4)
         for idx, rec in enumerate(results[:4]):
-            try:
-                img, desc = get_image_and_description_by_index(int(rec["id"]))
-                with cols[idx % 4]:
-                    st.image(img, use_container_width=True)
-                    st.markdown(f"**Description:** {desc}")
-            except Exception as e:
-                st.warning(f"Failed to load item {rec['id']}: {e}")
+            item = items.get(int(rec["id"]))
+            if item is None:
+                st.warning(f"Failed to load item {rec['id']}")
+                continue
+            show_item(cols[idx % 4], item)
 
 def process_query(user_query: str, image_description: str = None):
     if not user_query:
@@ -79,10 +261,24 @@ def process_query(user_query: str, image_description: str = None):
         return
 
     if st.button("Get Enhanced Query"):
+        if STREAM_RESULTS and PIPELINE_DEADLINE > 0 and service_client() is None:
+            try:
+                result = stream_recommendations(user_query, image_description)
+            except Exception as e:
+                st.error(f"❌ Failed to get recommendations: {e}")
+                return
+            st.session_state.enhanced_query = result.user_intent
+            st.session_state.recommendations = result.recommendations
+            st.session_state.pipeline_path = result.path
+            st.session_state.streamed = True
+            st.caption("Path: " + " → ".join(result.path))
+            return
+
         try:
             enhanced_query, recommendations = generate_enhanced_query(user_query, image_description)
             st.session_state.enhanced_query = enhanced_query
             st.session_state.recommendations = recommendations
+            st.session_state.streamed = False
         except Exception as e:
             st.error(f"❌ Failed to get recommendations: {e}")
             return
@@ -90,11 +286,27 @@ def process_query(user_query: str, image_description: str = None):
     if "enhanced_query" in st.session_state:
         st.subheader("📝 Enhanced Query")
         st.success(st.session_state.enhanced_query)
+        if st.session_state.get("pipeline_path"):
+            st.caption("Path: " + " → ".join(st.session_state.pipeline_path))
 
-        if st.button("Get Recommendations"):
+        # Streamed results were already shown once; keep them on the page across reruns
+        if st.session_state.get("streamed") or st.button("Get Recommendations"):
             display_recommendations(st.session_state.recommendations)
 
 # -------- Streamlit App UI --------
+with st.sidebar:
+    st.caption("⚙️ Resources")
+    for name, info in registry.status().items():
+        icon = {"warm": "🟢", "warming": "🟡", "failed": "🔴"}.get(info["state"], "⚪")
+        st.caption(f"{icon} {name.split(':')[0]}: {info['state']} ({info['load_seconds']}s)")
+        if "error" in info:
+            st.caption(f"↳ {info['error']}")
+    with st.expander("Cache stats"):
+        for name, stats in registry.cache_stats().items():
+            st.caption(f"{name.split(':')[0]}: {stats['hits']} hits / {stats['misses']} misses "
+                       f"({stats['hit_rate']:.0%}), {stats['entries']} entries")
+    st.checkbox("🔍 Show request trace", value=DEBUG_TRACE, key="show_trace")
+
 st.title("🤵 AI Fashion Recommender")
 st.info("""
 **📝 How to Use This App:**
@@ -102,7 +314,8 @@ st.info("""
 1. Upload an image, paste an image URL, or type a fashion-related query.
 2. **After typing your query, press Enter.**
 3. Click **'Get Enhanced Query'** to let AI improve your search.
-4. After the enhanced query appears, click **'Get Recommendations'** to see suggested items.
+4. The enhanced query appears as it is written, followed by each recommended item as soon as it is picked.
+   (With streaming off, click **'Get Recommendations'** once the enhanced query appears.)
 """)
 
 
@@ -118,8 +331,9 @@ if input_method == "Upload Image":
         image = Image.open(uploaded_file)
         st.image(image, caption="Uploaded Image", width=300)
 
-        image_description = get_image_description(uploaded_file, is_local=True)
-        if image_description:
+        if VISUAL_SEARCH:
+            process_image_query(image, uploaded_file, is_local=True)
+        elif image_description := describe_image(uploaded_file, is_local=True):
             st.markdown("### 📝 Analysis Results")
             st.markdown(image_description)
             user_query = st.text_input("Describe what you're looking for with this item:")
@@ -135,9 +349,10 @@ elif input_method == "Image URL":
             st.image(image, caption="Image from URL", width=300)
         else:
             st.error("❌ Error: Unable to load image.")
-        
-        image_description = get_image_description(url, is_local=False)
-        if image_description:
+
+        if VISUAL_SEARCH and image:
+            process_image_query(image, url, is_local=False)
+        elif image_description := describe_image(url, is_local=False):
             st.markdown("### 📝 Analysis Results")
             st.markdown(image_description)
             user_query = st.text_input("Describe what you're looking for with this item:")
@@ -148,3 +363,8 @@ elif input_method == "Image URL":
 elif input_method == "Text Query":
     user_query = st.text_input("Enter your fashion request:")
     process_query(user_query)
+
+if st.session_state.get("show_trace") and st.session_state.get("traces"):
+    with st.expander("🔍 Request trace", expanded=True):
+        for trace in st.session_state.traces.values():
+            show_trace(trace)
@@ -0,0 +1,215 @@
+"""
+Offline batch recommendations over a JSONL file of queries.
+
+Each input line is a JSON object with a "query" and an optional "id":
+
+    {"id": "campaign-1", "query": "linen shirt for a beach wedding"}
+
+Queries are embedded in batches and searched with one faiss call per batch.
+LLM stages (rephrase, rerank) run with bounded concurrency and a client-side
+rate limit. Results are appended to the output file as they finish, so an
+interrupted run picks up where it stopped:
+
+    python batch_recommend.py --input queries.jsonl --output recommendations.jsonl
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Set
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import ann_index
+from bulid_vec_db import VectorStoreManager
+from rate_limit import RateLimiter
+from rerankers import LLMReranker, get_local_reranker
+from resources import DEFAULT_VECTOR_STORE_PATH, get_registry
+
+
+def read_queries(path: str) -> Iterator[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            yield {"id": str(row.get("id", line_number)), "query": row["query"]}
+
+
+def completed_ids(path: str) -> Set[str]:
+    """Ids already written to the output file (a truncated last line is ignored)."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                continue
+    return done
+
+
+def repair_tail(path: str) -> None:
+    """Drop a partially written last line left by an interrupted run, so appends start on a fresh line."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def batched(rows: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BatchRecommender:
+    """
+    Batch counterpart of LLMRecommender.
+
+    Args:
+        vector_store_path (str): Vector store to search
+        rephrase (bool): Rephrase queries with the LLM before embedding
+        llm_rerank (bool): Let the LLM pick the final n from the locally reranked shortlist
+        reranker (str): Local reranker name (see rerankers.get_local_reranker)
+        concurrency (int): Max LLM calls in flight
+        requests_per_second (float): Client-side rate limit for LLM calls
+        diversify (bool): Collapse near-duplicate candidates and keep a diverse subset before reranking
+    """
+    def __init__(self, vector_store_path: str = DEFAULT_VECTOR_STORE_PATH, rephrase: bool = False,
+                 llm_rerank: bool = False, reranker: str = "none", concurrency: int = 4,
+                 requests_per_second: float = 2.0, llm_candidates: int = 10, diversify: bool = True):
+        self.manager = VectorStoreManager()
+        self.vs = get_registry().vector_store(vector_store_path)
+        self.diversifier = get_registry().diversifier(vector_store_path) if diversify else None
+        self.rephraser = None
+        if rephrase:
+            from rephrase_query import QueryRephraser
+            self.rephraser = QueryRephraser()
+        self.reranker = get_local_reranker(reranker)
+        self.llm_reranker = None
+        if llm_rerank:
+            self.llm_reranker = LLMReranker(get_registry().groq_client(),
+                                            attributes=get_registry().catalog_attributes())
+        self.llm_candidates = llm_candidates
+        self.limiter = RateLimiter(requests_per_second)
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _limited(self, fn, *args):
+        self.limiter.acquire()
+        return fn(*args)
+
+    def _rephrase_all(self, queries: List[str]) -> List[str]:
+        if self.rephraser is None:
+            return queries
+        intents = self.pool.map(lambda q: self._limited(self.rephraser.rephrase_query, q), queries)
+        return [intent or query for intent, query in zip(intents, queries)]
+
+    def _finish(self, intent: str, candidates: List[Dict], query_vector: np.ndarray, n: int) -> List[Dict]:
+        if self.diversifier is not None:
+            candidates = self.diversifier.diversify(intent, candidates, query_vector=query_vector)
+        if self.reranker is not None:
+            shortlist = max(n, self.llm_candidates) if self.llm_reranker else n
+            candidates = self.reranker.rerank(intent, candidates, shortlist)
+        if self.llm_reranker is not None:
+            try:
+                return self._limited(self.llm_reranker.rerank, intent, candidates, n) or candidates[:n]
+            except Exception as e:
+                print(f"LLM rerank failed, keeping vector order: {e}")
+        return candidates[:n]
+
+    def recommend_batch(self, rows: List[Dict], n: int = 4, k: int = 30) -> List[Dict]:
+        intents = self._rephrase_all([row["query"] for row in rows])
+
+        # One embedding call and one faiss search for the whole batch
+        matrix = np.asarray(self.manager.embeddings.embed_documents(intents), dtype="float32")
+        _, positions = ann_index.search(self.vs.index, matrix, k, mask=getattr(self.vs, "live_mask", None))
+
+        candidate_lists = [
+            [{"id": doc.metadata.get("image_index"), "content": doc.page_content}
+             for doc in self.manager.documents_at(self.vs, row_positions)]
+            for row_positions in positions
+        ]
+        finished = self.pool.map(lambda args: self._finish(*args, n), zip(intents, candidate_lists, matrix))
+
+        return [
+            {
+                "id": row["id"],
+                "query": row["query"],
+                "user_intent": intent,
+                "results": [{"id": str(item["id"]), "score": item.get("score")} for item in selected],
+            }
+            for row, intent, selected in zip(rows, intents, finished)
+        ]
+
+    def run(self, input_path: str, output_path: str, batch_size: int = 64, n: int = 4, k: int = 30) -> Dict:
+        repair_tail(output_path)
+        done = completed_ids(output_path)
+        pending = (row for row in read_queries(input_path) if row["id"] not in done)
+        if done:
+            print(f"Resuming: {len(done)} queries already in {output_path}")
+
+        started = time.perf_counter()
+        processed = failed = 0
+        with open(output_path, "a", encoding="utf-8") as out:
+            for batch in batched(pending, batch_size):
+                try:
+                    records = self.recommend_batch(batch, n=n, k=k)
+                except Exception as e:
+                    failed += len(batch)
+                    print(f"Batch starting at query {batch[0]['id']} failed: {e}")
+                    continue
+                for record in records:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                processed += len(records)
+                print(f"{processed} queries done, {processed / (time.perf_counter() - started):.1f} queries/sec")
+
+        elapsed = time.perf_counter() - started
+        summary = {
+            "processed": processed,
+            "skipped": len(done),
+            "failed": failed,
+            "seconds": round(elapsed, 2),
+            "queries_per_second": round(processed / elapsed, 2) if elapsed else 0.0,
+        }
+        print(json.dumps(summary))
+        return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute recommendations for a JSONL file of queries.")
+    parser.add_argument("--input", required=True, help="JSONL file with one {\"id\", \"query\"} per line")
+    parser.add_argument("--output", required=True, help="JSONL file results are appended to")
+    parser.add_argument("--vector-store", default=DEFAULT_VECTOR_STORE_PATH)
+    parser.add_argument("--batch-size", type=int, default=64, help="Queries embedded and searched together")
+    parser.add_argument("-k", type=int, default=30, help="Vector candidates per query")
+    parser.add_argument("-n", type=int, default=4, help="Recommendations per query")
+    parser.add_argument("--rephrase", action="store_true", help="Rephrase queries with the LLM first")
+    parser.add_argument("--llm-rerank", action="store_true", help="Let the LLM pick the final items")
+    parser.add_argument("--reranker", default="none", help="Local reranker: cross_encoder, bi_encoder, none")
+    parser.add_argument("--concurrency", type=int, default=4, help="Max LLM calls in flight")
+    parser.add_argument("--rps", type=float, default=2.0, help="Max LLM requests per second")
+    parser.add_argument("--no-diversify", action="store_true", help="Skip near-duplicate collapsing and MMR")
+    args = parser.parse_args()
+
+    recommender = BatchRecommender(
+        vector_store_path=args.vector_store,
+        rephrase=args.rephrase,
+        llm_rerank=args.llm_rerank,
+        reranker=args.reranker,
+        concurrency=args.concurrency,
+        requests_per_second=args.rps,
+        diversify=not args.no_diversify,
+    )
+    recommender.run(args.input, args.output, batch_size=args.batch_size, n=args.n, k=args.k)
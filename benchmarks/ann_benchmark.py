@@ -0,0 +1,141 @@
+"""
+Recall / latency / memory benchmark for the ANN index types in ann_index.py.
+
+Uses the shard checkpoints written by bulid_vec_db.py when available, or a
+synthetic catalog otherwise:
+
+    python -m benchmarks.ann_benchmark --checkpoint-dir vector_store_shards
+    python -m benchmarks.ann_benchmark --synthetic 200000 --output ann.json
+"""
+from typing import Dict, List, Optional
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+import ann_index
+
+# (index_type, build params, query-time sweep)
+DEFAULT_CONFIGS = [
+    ("ivf_flat", {}, [{"nprobe": p} for p in (1, 4, 16, 64)]),
+    ("hnsw", {"hnsw_m": 32}, [{"ef_search": e} for e in (16, 64, 128, 256)]),
+    ("ivf_pq", {"pq_m": 16}, [{"nprobe": p} for p in (4, 16, 64)]),
+    ("ivf_sq8", {}, [{"nprobe": p} for p in (4, 16, 64)]),
+    ("sq8", {}, [{}]),
+]
+
+
+def load_vectors(checkpoint_dir: str) -> np.ndarray:
+    from bulid_vec_db import StreamingIndexBuilder
+
+    # The builder only needs a manager to encode; reading shards does not touch it
+    builder = StreamingIndexBuilder(manager=None, checkpoint_dir=checkpoint_dir)
+    shards = [vectors for vectors, _, _ in builder.iter_shards()]
+    if not shards:
+        raise ValueError(f"No shards found in {checkpoint_dir}")
+    return np.concatenate(shards)
+
+
+def synthetic_vectors(n: int, d: int = 768, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Clustered gaussian vectors, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, d)).astype("float32")
+    assignment = rng.integers(0, clusters, size=n)
+    vectors = centers[assignment] + 0.3 * rng.normal(size=(n, d)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall_at_k(ground_truth: np.ndarray, found: np.ndarray) -> float:
+    k = ground_truth.shape[1]
+    hits = sum(len(set(gt) & set(row[row != -1])) for gt, row in zip(ground_truth, found))
+    return hits / (k * len(ground_truth))
+
+
+def time_queries(index: faiss.Index, queries: np.ndarray, k: int, **search_params) -> Dict:
+    """Run queries one at a time, as the app does, and collect per-query latency."""
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, ids = ann_index.search(index, query[None, :], k, **search_params)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append(ids[0])
+    return {
+        "ids": np.stack(results),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def run_benchmark(vectors: np.ndarray, n_queries: int = 500, k: int = 30,
+                  configs: Optional[List] = None, seed: int = 0) -> List[Dict]:
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[query_rows] + 0.05 * rng.normal(size=(len(query_rows), vectors.shape[1])).astype("float32")
+
+    faiss.omp_set_num_threads(1)  # single-query latency, like one app request
+
+    flat = ann_index.build_faiss_index(vectors, "flat")
+    baseline = time_queries(flat, queries, k)
+    ground_truth = baseline["ids"]
+
+    rows = [{
+        "index_type": "flat",
+        "build_params": {},
+        "search_params": {},
+        "build_s": 0.0,
+        "memory_mb": ann_index.index_memory_bytes(flat) / 2**20,
+        f"recall@{k}": 1.0,
+        "p50_ms": baseline["p50_ms"],
+        "p99_ms": baseline["p99_ms"],
+    }]
+
+    for index_type, build_params, sweep in configs or DEFAULT_CONFIGS:
+        started = time.perf_counter()
+        index = ann_index.build_faiss_index(vectors, index_type, **build_params)
+        build_s = time.perf_counter() - started
+        memory_mb = ann_index.index_memory_bytes(index) / 2**20
+
+        for search_params in sweep:
+            timing = time_queries(index, queries, k, **search_params)
+            rows.append({
+                "index_type": index_type,
+                "build_params": build_params,
+                "search_params": search_params,
+                "build_s": build_s,
+                "memory_mb": memory_mb,
+                f"recall@{k}": recall_at_k(ground_truth, timing["ids"]),
+                "p50_ms": timing["p50_ms"],
+                "p99_ms": timing["p99_ms"],
+            })
+    return rows
+
+
+def print_table(rows: List[Dict], k: int) -> None:
+    print(f"{'index':<10} {'params':<18} {'recall@' + str(k):>10} {'p50 ms':>8} {'p99 ms':>8} {'mem MB':>8} {'build s':>8}")
+    for row in rows:
+        params = ",".join(f"{key}={value}" for key, value in row["search_params"].items()) or "-"
+        print(f"{row['index_type']:<10} {params:<18} {row[f'recall@{k}']:>10.3f} {row['p50_ms']:>8.3f} "
+              f"{row['p99_ms']:>8.3f} {row['memory_mb']:>8.1f} {row['build_s']:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ANN index types against the flat baseline.")
+    parser.add_argument("--checkpoint-dir", default="vector_store_shards")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of shards")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=30)
+    parser.add_argument("--output", default=None, help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.synthetic) if args.synthetic else load_vectors(args.checkpoint_dir)
+    print(f"Benchmarking {len(vectors)} vectors of dimension {vectors.shape[1]}")
+
+    results = run_benchmark(vectors, n_queries=args.queries, k=args.k)
+    print_table(results, args.k)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
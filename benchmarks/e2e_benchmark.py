@@ -0,0 +1,357 @@
+"""
+End-to-end benchmark of the recommendation path, fully local.
+
+Builds a synthetic caption catalog and index, serves LLM calls from a fake
+Groq endpoint (see fake_groq.py) and runs four scenarios: index build, cold
+start (in a fresh process), single-query latency and concurrent-query
+throughput. Per-stage latency percentiles (rephrase, raw_search,
+intent_search, local_rerank, llm_rerank, total) are written as JSON so runs
+from two commits can be compared:
+
+    python -m benchmarks.e2e_benchmark --catalog-size 5000 --output e2e.json
+    python -m benchmarks.e2e_benchmark --compare baseline.json e2e.json
+
+Captions are embedded with a hashing embedder by default, so no model is
+downloaded; pass `--embeddings model` to benchmark the real one.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.fake_groq import FakeGroqServer
+from hybrid_retriever import ATTRIBUTES
+
+STAGES = ("rephrase", "raw_search", "intent_search", "local_rerank", "llm_rerank", "total")
+MATERIALS = ["cotton", "linen", "wool", "denim", "jersey", "satin", "leather", "cashmere", "polyester", "velvet"]
+STYLES = ["relaxed fit", "slim fit", "oversized", "cropped", "high-waisted", "wrap", "ribbed", "quilted",
+          "pleated", "printed", "striped", "embroidered"]
+OCCASIONS = ["the office", "a beach wedding", "weekend walks", "a night out", "the gym", "winter travel",
+             "a summer festival", "lounging at home"]
+
+
+# -------- Synthetic data --------
+def synthetic_catalog(n: int, seed: int = 0) -> List[str]:
+    """Captions in the style of the real catalog, drawn from the hybrid_retriever attribute vocabulary."""
+    rng = random.Random(seed)
+    colors, types, genders = (list(ATTRIBUTES[a]) for a in ("color", "product_type", "gender"))
+    return [
+        f"{rng.choice(STYLES).capitalize()} {rng.choice(colors)} {rng.choice(types)} for {rng.choice(genders)} "
+        f"in soft {rng.choice(MATERIALS)}, with {rng.choice(STYLES)} details. Item {i}."
+        for i in range(n)
+    ]
+
+
+def synthetic_queries(n: int, seed: int = 1) -> List[str]:
+    """Distinct shopper queries, so exact-match caches don't flatter the numbers."""
+    rng = random.Random(seed)
+    colors, types = list(ATTRIBUTES["color"]), list(ATTRIBUTES["product_type"])
+    return [f"{rng.choice(colors)} {rng.choice(MATERIALS)} {rng.choice(types)} for {rng.choice(OCCASIONS)} #{i}"
+            for i in range(n)]
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic bag-of-tokens embeddings: cheap, model-free, and good enough to exercise retrieval."""
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype="float32")
+        for token in text.lower().split():
+            h = zlib.crc32(token.encode("utf-8"))
+            vector[h % self.dimension] += 1.0 if h & 0x80000000 else -1.0
+        vector /= np.linalg.norm(vector) + 1e-12
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+# -------- Setup --------
+def configure_environment(base_url: str, reranker: str, llm_rerank: bool) -> None:
+    """Point the app at the fake endpoint. Must run before the app modules are imported."""
+    os.environ["GROQ_BASE_URL"] = base_url
+    os.environ["GROQ_API_KEY"] = "benchmark"
+    os.environ["RERANKER"] = reranker
+    os.environ["LLM_RERANK"] = "1" if llm_rerank else "0"
+    os.environ["SEMANTIC_CACHE_THRESHOLD"] = "0"
+
+
+def install_embeddings(kind: str) -> None:
+    """Seed the registry so every module gets the benchmark embedder."""
+    if kind != "hashing":
+        return
+    from query_cache import CachedEmbeddings
+    from resources import DEFAULT_EMBEDDING_MODEL, get_registry
+    get_registry().get(f"embeddings:{DEFAULT_EMBEDDING_MODEL}", lambda: CachedEmbeddings(HashingEmbeddings()))
+
+
+def percentiles(seconds: List[float]) -> Dict[str, float]:
+    if not seconds:
+        return {}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# -------- Scenarios --------
+def bench_build(texts: List[str], store_path: str, index_type: str) -> Dict:
+    from bulid_vec_db import VectorStoreManager
+
+    manager = VectorStoreManager()
+    timings = {}
+
+    started = time.perf_counter()
+    vectors = np.asarray(manager.embeddings.embed_documents(texts), dtype="float32")
+    timings["embed_s"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    vs = manager.create_vector_store(vectors, texts, list(range(len(texts))), index_type=index_type)
+    timings["index_s"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    manager.save_vector_store(vs, store_path, index_type=index_type, vectors=vectors)
+    timings["save_s"] = time.perf_counter() - started
+
+    total = sum(timings.values())
+    return {
+        "documents": len(texts),
+        "index_type": index_type,
+        **{name: round(value, 4) for name, value in timings.items()},
+        "total_s": round(total, 4),
+        "documents_per_second": round(len(texts) / total, 1) if total else 0.0,
+    }
+
+
+def cold_start_child(store_path: str, embeddings: str) -> None:
+    """Runs in a fresh interpreter: time imports, store load and the first search, then print them as JSON."""
+    started = time.perf_counter()
+    import Get_LLM_response  # noqa: F401  (pulls in the whole recommendation stack)
+    imported = time.perf_counter()
+
+    install_embeddings(embeddings)
+    from get_vector_recommendetion import recommendations_based_on_vecdb
+    from resources import get_registry
+    get_registry().vector_store(store_path)
+    loaded = time.perf_counter()
+
+    recommendations_based_on_vecdb(store_path).search("black wool jumper", k=30)
+    searched = time.perf_counter()
+
+    print(json.dumps({
+        "import_s": round(imported - started, 4),
+        "load_store_s": round(loaded - imported, 4),
+        "first_search_s": round(searched - loaded, 4),
+    }))
+
+
+def bench_cold_start(store_path: str, embeddings: str, runs: int = 3) -> Dict:
+    command = [sys.executable, "-m", "benchmarks.e2e_benchmark", "--cold-start-child",
+               "--store", store_path, "--embeddings", embeddings]
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run(command, capture_output=True, text=True, check=True, env=os.environ.copy()).stdout
+        wall = time.perf_counter() - started
+        phases = json.loads(output.strip().splitlines()[-1])
+        samples.append({**phases, "process_s": round(wall, 4)})
+    return {
+        "runs": runs,
+        **{name: round(float(np.median([s[name] for s in samples])), 4) for name in samples[0]},
+    }
+
+
+def _collect(results) -> Dict:
+    stages: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    paths: Dict[str, int] = {}
+    degraded = 0
+    for result in results:
+        for stage, seconds in result.timings.items():
+            stages.setdefault(stage, []).append(seconds)
+        for step in result.path:
+            paths[step] = paths.get(step, 0) + 1
+        degraded += result.degraded
+    return {
+        "stages": {stage: percentiles(values) for stage, values in stages.items() if values},
+        "paths": paths,
+        "degraded": degraded,
+    }
+
+
+def bench_single_query(pipeline, queries: List[str], n: int, k: int) -> Dict:
+    results = [pipeline.run(query, n=n, k=k) for query in queries]
+    return {"queries": len(queries), **_collect(results)}
+
+
+def bench_throughput(pipeline, queries: List[str], n: int, k: int, concurrency: int) -> Dict:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda query: pipeline.run(query, n=n, k=k), queries))
+    elapsed = time.perf_counter() - started
+    return {
+        "queries": len(queries),
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "queries_per_second": round(len(queries) / elapsed, 2) if elapsed else 0.0,
+        **_collect(results),
+    }
+
+
+def run_benchmark(args) -> Dict:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="e2e_benchmark_")
+    store_path = os.path.join(workdir, "vector_store")
+
+    fake = FakeGroqServer(latency=args.llm_latency, jitter=args.llm_jitter, error_rate=args.error_rate).start()
+    try:
+        configure_environment(fake.base_url, args.reranker, not args.no_llm_rerank)
+        install_embeddings(args.embeddings)
+        scenarios = {}
+
+        print(f"Building a {args.catalog_size}-item {args.index_type} index in {store_path}")
+        scenarios["build"] = bench_build(synthetic_catalog(args.catalog_size), store_path, args.index_type)
+
+        print("Measuring cold start")
+        scenarios["cold_start"] = bench_cold_start(store_path, args.embeddings, runs=args.cold_runs)
+
+        from Get_LLM_response import LLMRecommender
+        from get_vector_recommendetion import recommendations_based_on_vecdb
+        from pipeline import RecommendationPipeline
+
+        recommender = LLMRecommender()
+        recommender.recommendations_object = recommendations_based_on_vecdb(store_path)
+        pipeline = RecommendationPipeline(recommender, deadline=args.deadline)
+        queries = synthetic_queries(args.queries + args.throughput_queries + args.warmup)
+
+        for query in queries[:args.warmup]:
+            pipeline.run(query, n=args.n, k=args.k)
+        queries = queries[args.warmup:]
+
+        print(f"Running {args.queries} single queries")
+        scenarios["single_query"] = bench_single_query(pipeline, queries[:args.queries], args.n, args.k)
+
+        print(f"Running {args.throughput_queries} queries with concurrency {args.concurrency}")
+        scenarios["throughput"] = bench_throughput(pipeline, queries[args.queries:], args.n, args.k,
+                                                   args.concurrency)
+    finally:
+        fake.stop()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "fake_groq": fake.stats,
+        "scenarios": scenarios,
+    }
+
+
+# -------- Reporting --------
+def print_summary(report: Dict) -> None:
+    scenarios = report["scenarios"]
+    build, cold = scenarios["build"], scenarios["cold_start"]
+    print(f"build: {build['total_s']:.2f}s ({build['documents_per_second']:.0f} docs/s)  "
+          f"cold start: {cold['process_s']:.2f}s (import {cold['import_s']:.2f}s, "
+          f"load {cold['load_store_s']:.2f}s, first search {cold['first_search_s']:.3f}s)")
+    print(f"throughput: {scenarios['throughput']['queries_per_second']:.1f} queries/s "
+          f"at concurrency {scenarios['throughput']['concurrency']}")
+    print(f"{'scenario':<14} {'stage':<14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name in ("single_query", "throughput"):
+        for stage, stats in scenarios[name]["stages"].items():
+            print(f"{name:<14} {stage:<14} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = 0.1) -> int:
+    """Print per-stage p50/p95 changes between two reports; returns the number of regressions above `threshold`."""
+    regressions = 0
+    print(f"{'scenario':<14} {'stage':<14} {'metric':<7} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name in ("single_query", "throughput"):
+        before = baseline["scenarios"].get(name, {}).get("stages", {})
+        after = current["scenarios"].get(name, {}).get("stages", {})
+        for stage in after:
+            if stage not in before:
+                continue
+            for metric in ("p50_ms", "p95_ms"):
+                old, new = before[stage][metric], after[stage][metric]
+                change = (new - old) / old if old else 0.0
+                flag = ""
+                if change > threshold:
+                    regressions += 1
+                    flag = "  REGRESSION"
+                print(f"{name:<14} {stage:<14} {metric:<7} {old:>10.1f} {new:>10.1f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end recommendation benchmark with a local Groq stand-in.")
+    parser.add_argument("--catalog-size", type=int, default=5000)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--embeddings", choices=["hashing", "model"], default="hashing")
+    parser.add_argument("--queries", type=int, default=50, help="Sequential queries for single-query latency")
+    parser.add_argument("--throughput-queries", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--cold-runs", type=int, default=3)
+    parser.add_argument("-k", type=int, default=30)
+    parser.add_argument("-n", type=int, default=4)
+    parser.add_argument("--reranker", default="none", help="Local reranker: cross_encoder, bi_encoder, none")
+    parser.add_argument("--no-llm-rerank", action="store_true")
+    parser.add_argument("--deadline", type=float, default=30.0, help="Pipeline budget in seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Fake Groq mean latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake Groq calls that fail")
+    parser.add_argument("--workdir", default=None, help="Where to build the synthetic store (default: a temp dir)")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this path")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown reported as a regression")
+    parser.add_argument("--cold-start-child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--store", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_start_child:
+        cold_start_child(args.store, args.embeddings)
+        sys.exit(0)
+
+    if args.compare:
+        with open(args.compare[0], "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.compare[1], "r", encoding="utf-8") as f:
+            current = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.threshold) else 0)
+
+    report = run_benchmark(args)
+    print_summary(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
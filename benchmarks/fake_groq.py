@@ -0,0 +1,213 @@
+"""
+Local stand-in for the Groq chat-completions endpoint, for benchmarks.
+
+Answers the three kinds of requests the app makes with canned but
+well-formed responses: query rephrasing (plain text), LLM reranking
+(`{"results": [...]}` built from the ids in the payload) and image
+description (plain text). Streamed requests (`"stream": true`) are
+answered as server-sent events, a few characters per chunk. Latency and
+failures are configurable, so retry and deadline behaviour can be
+measured too. Point the app at it with GROQ_BASE_URL:
+
+    python -m benchmarks.fake_groq --port 8765 --latency 0.4 --error-rate 0.05
+    GROQ_BASE_URL=http://127.0.0.1:8765 GROQ_API_KEY=fake streamlit run app.py
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+COMPLETIONS_PATH = "/openai/v1/chat/completions"
+SELECT_PATTERN = re.compile(r"select the top (\d+)", re.IGNORECASE)
+
+
+class FakeGroqServer:
+    """
+    Threaded HTTP server speaking the OpenAI-compatible chat-completions protocol.
+
+    Args:
+        latency (float): Mean response latency in seconds
+        jitter (float): Uniform +/- jitter added to the latency, in seconds
+        error_rate (float): Fraction of requests answered with `error_status`
+        error_status (int): HTTP status of injected failures (429 and 5xx are retried by the Groq client)
+        seed (int): Seed for the latency / failure draws
+        chunk_interval (float): Delay between streamed chunks, in seconds (`latency` is the time to the first one)
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.3, jitter: float = 0.1,
+                 error_rate: float = 0.0, error_status: int = 503, seed: int = 0, chunk_interval: float = 0.02):
+        self.latency = latency
+        self.chunk_interval = chunk_interval
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "rephrase": 0, "rerank": 0, "describe": 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeGroqServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-groq", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "FakeGroqServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    # -------- Behaviour --------
+    def _draw(self):
+        with self._lock:
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            failed = self._random.random() < self.error_rate
+            self.stats["requests"] += 1
+            self.stats["errors"] += failed
+        return delay, failed
+
+    def _count(self, kind: str) -> None:
+        with self._lock:
+            self.stats[kind] += 1
+
+    def respond(self, request: Dict) -> str:
+        """Message content for a chat-completions request."""
+        messages = request.get("messages", [])
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+
+        if isinstance(user, list):
+            self._count("describe")
+            return ("A relaxed-fit black cotton jumper with a crew neck and ribbed cuffs, "
+                    "suited to casual autumn wear.")
+
+        # Streamed reranks can't use JSON mode, so recognise them by their prompt too
+        if request.get("response_format", {}).get("type") == "json_object" or SELECT_PATTERN.search(system):
+            self._count("rerank")
+            match = SELECT_PATTERN.search(system)
+            n = int(match.group(1)) if match else 4
+            ids = [line.split("|", 1)[0] for line in user.splitlines() if "|" in line]
+            return json.dumps({"results": [{"id": item_id} for item_id in ids[:n]]})
+
+        self._count("rephrase")
+        return f"Looking for {user.strip()}, in a versatile everyday style."
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: Dict) -> None:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, request: Dict, content: str, usage: Dict) -> None:
+                """Server-sent events in HTTP chunks: a few characters per event, usage on the last one."""
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def event(delta: Dict, finish_reason: Optional[str] = None, **extra) -> None:
+                    chunk = {
+                        "id": f"chatcmpl-fake-{time.time_ns()}",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": request.get("model", "fake"),
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                        **extra,
+                    }
+                    self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+                event({"role": "assistant", "content": ""})
+                for start in range(0, len(content), 4):
+                    time.sleep(server.chunk_interval)
+                    event({"content": content[start:start + 4]})
+                event({}, "stop", x_groq={"id": "fake", "usage": usage})
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+
+            def _write_chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.rstrip("/") != COMPLETIONS_PATH:
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+
+                delay, failed = server._draw()
+                time.sleep(delay)
+                if failed:
+                    self._send(server.error_status, {"error": {"message": "Injected failure", "type": "fake_error"}})
+                    return
+
+                content = server.respond(request)
+                prompt_tokens = len(json.dumps(request.get("messages", []))) // 4
+                completion_tokens = len(content) // 4
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }
+                if request.get("stream"):
+                    self._stream(request, content, usage)
+                    return
+                self._send(200, {
+                    "id": f"chatcmpl-fake-{time.time_ns()}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": usage,
+                })
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local fake of the Groq chat-completions API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="Mean latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="+/- jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--chunk-interval", type=float, default=0.02, help="Seconds between streamed chunks")
+    args = parser.parse_args()
+
+    fake = FakeGroqServer(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate, error_status=args.error_status,
+                          chunk_interval=args.chunk_interval)
+    print(f"Fake Groq API listening on {fake.base_url}")
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,126 @@
+"""
+Import-time profile of the app's startup path.
+
+Imports the modules app.py loads before rendering the first page (read from
+app.py's top-level imports, so the list cannot drift) in a fresh interpreter
+under `python -X importtime`, reports the slowest top-level packages, and
+fails when startup exceeds the budget or pulls in a heavy dependency that
+should only load lazily (torch, transformers, datasets, ...). Dependencies
+that startup needs but that are worth watching (langchain_core) are reported
+with their import time without failing the run:
+
+    python -m benchmarks.import_profile
+    python -m benchmarks.import_profile --modules bulid_vec_db --top 30 --output imports.json
+"""
+from typing import Dict, List
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+# Only needed once the model or index is loaded (warm-up thread) or for offline builds
+LAZY_MODULES = ["torch", "transformers", "sentence_transformers", "datasets", "langchain", "langchain_community",
+                "onnxruntime"]
+# Loaded at startup (query_cache, bulid_vec_db), reported so their cost stays visible
+TRACKED_MODULES = ["langchain_core"]
+STARTUP_BUDGET = 1.0  # seconds
+
+
+def app_imports(path: str = APP_PATH) -> List[str]:
+    """app.py's module-level import statements, in order (imports inside functions are lazy and skipped)."""
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+_CHILD = """
+import json, sys, time
+started = time.perf_counter()
+for statement in {imports!r}:
+    exec(statement, {{}})
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    """Rows of `-X importtime` output: module, depth, self and cumulative microseconds."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, raw_name = parts
+        depth = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+        rows.append({
+            "module": raw_name.strip(),
+            "depth": depth,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        })
+    return rows
+
+
+def top_packages(rows: List[Dict], top: int = 20) -> List[Dict]:
+    """Cumulative import time per top-level package, counting each first (depth-0) import once."""
+    packages: Dict[str, int] = {}
+    for row in rows:
+        if row["depth"] == 0:
+            package = row["module"].split(".")[0]
+            packages[package] = packages.get(package, 0) + row["cumulative_us"]
+    ranked = sorted(packages.items(), key=lambda item: -item[1])[:top]
+    return [{"package": package, "ms": round(us / 1000, 1)} for package, us in ranked]
+
+
+def profile(imports: List[str], lazy: List[str] = LAZY_MODULES, tracked: List[str] = TRACKED_MODULES) -> Dict:
+    child = _CHILD.format(imports=imports, lazy=lazy)
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", child],
+                               capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(APP_PATH))
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    rows = parse_importtime(completed.stderr)
+    packages = top_packages(rows, top=len(rows))
+    return {
+        "imports": imports,
+        "seconds": round(result["seconds"], 3),
+        "lazy_modules_loaded": result["loaded"],
+        "tracked_modules": {row["package"]: row["ms"] for row in packages if row["package"] in tracked},
+        "packages": packages,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile import time of the app's startup path.")
+    parser.add_argument("--modules", nargs="+", default=None, help="Modules to import (default: app.py's)")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET, help="Max seconds for all imports")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    imports = [f"import {name}" for name in args.modules] if args.modules else app_imports()
+    report = profile(imports)
+    print(f"{'package':<28} {'ms':>8}")
+    for row in report["packages"][:args.top]:
+        print(f"{row['package']:<28} {row['ms']:>8.1f}")
+    print(f"\nRan {len(imports)} imports in {report['seconds']:.3f}s (budget {args.budget:.1f}s)")
+    for package, ms in report["tracked_modules"].items():
+        print(f"Tracked: {package} imported at startup ({ms:.1f} ms)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    failed = False
+    if report["lazy_modules_loaded"]:
+        print(f"Heavy modules imported at startup: {', '.join(report['lazy_modules_loaded'])}")
+        failed = True
+    if report["seconds"] > args.budget:
+        print("Startup imports exceed the budget")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -1,17 +1,36 @@
-from datasets import load_dataset
 import streamlit as st
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain.docstore.document import Document
-from langchain_community.vectorstores import FAISS
+# langchain_community (and through it torch) and datasets are imported where
+# they're used, so importing this module stays cheap for the app's first page
+from langchain_core.documents import Document
 
-from typing import List, Optional
+import ann_index
+import diversity
+import hybrid_retriever
+import mmap_store
+from resources import get_registry
+from mmap_store import MmapVectorStore
+from index_versions import VersionedStore
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
+import argparse
+import json
+import time
 import os
 
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
 class VectorStoreManager:
-    def __init__(self, model_name: str = "BAAI/bge-base-en-v1.5"):
+    def __init__(self, model_name: str = "BAAI/bge-base-en-v1.5", embeddings=None, backend: Optional[str] = None):
         try:
-            self.embeddings = HuggingFaceEmbeddings(model_name=model_name)
+            # The model is loaded once per process and shared through the resource registry.
+            # `backend` picks torch, onnx or onnx-int8 (default: EMBEDDING_BACKEND)
+            registry = get_registry()
+            self.embeddings = embeddings or (registry.embeddings(model_name, backend) if backend
+                                             else registry.embeddings(model_name))
         except Exception as e:
             raise Exception(f"Failed to initialize embeddings: {e}")
 
@@ -30,45 +49,391 @@ class VectorStoreManager:
 
         return docs
 
-    def build_vector_store(self, texts: List[str], save_path: str) -> Optional[FAISS]:
+    def create_vector_store(self, vectors: np.ndarray, texts: List[str], image_indexes: List[int],
+                            index_type: str = "flat", **index_params) -> "FAISS":
+        """
+        Wrap precomputed vectors in a langchain FAISS store backed by the requested index type.
+
+        Args:
+            vectors (np.ndarray): float32 matrix, one row per text
+            texts (List[str]): Captions, aligned with `vectors`
+            image_indexes (List[int]): Dataset row of each caption
+            index_type (str): One of ann_index.INDEX_TYPES (flat, ivf_flat, hnsw, ivf_pq, ivf_sq8, sq8)
+            **index_params: Build parameters forwarded to ann_index.build_faiss_index
+        """
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        from langchain_community.vectorstores import FAISS
+
+        index = ann_index.build_faiss_index(vectors, index_type=index_type, **index_params)
+
+        docstore, index_to_docstore_id = {}, {}
+        for position, (text, image_index) in enumerate(zip(texts, image_indexes)):
+            doc_id = str(image_index)
+            docstore[doc_id] = Document(page_content=text, metadata={"image_index": image_index})
+            index_to_docstore_id[position] = doc_id
+
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=InMemoryDocstore(docstore),
+            index_to_docstore_id=index_to_docstore_id,
+        )
+
+    def save_vector_store(self, vs: "FAISS", save_path: str, index_type: str = "flat",
+                          nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                          vectors: Optional[np.ndarray] = None, build_params: Optional[Dict] = None) -> None:
+        """
+        Save the store along with its index type, build params and default query-time search params.
+
+        `build_params` are the ann_index.build_faiss_index kwargs the index
+        was built with; compaction and sharding rebuild it with the same ones.
+
+        Besides langchain's pickled docstore, the captions are written in the
+        offset-indexed layout of mmap_store, so the app can load the store
+        memory-mapped without unpickling anything, and indexed for BM25 and
+        attribute filtering (see hybrid_retriever). The raw vectors are kept
+        too, so the store can later be updated incrementally and compacted
+        (see index_versions), along with their near-duplicate clusters (see
+        diversity).
+        """
+        os.makedirs(save_path, exist_ok=True)
+        vs.save_local(save_path)
+        ann_index.save_index_params(save_path, {"index_type": index_type, "nprobe": nprobe, "ef_search": ef_search,
+                                                "build": build_params or {}})
+
+        docs = [vs.docstore.search(vs.index_to_docstore_id[i]) for i in range(vs.index.ntotal)]
+        texts = [doc.page_content for doc in docs]
+        mmap_store.write_metadata(save_path, texts, [doc.metadata.get("image_index", i) for i, doc in enumerate(docs)])
+        hybrid_retriever.build_hybrid_index(save_path, texts)
+
+        if vectors is None:
+            try:
+                vectors = vs.index.reconstruct_n(0, vs.index.ntotal)
+            except RuntimeError:
+                print("Index type can't reconstruct its vectors; incremental updates will need a rebuild")
+        if vectors is not None:
+            mmap_store.write_array(save_path, mmap_store.VECTORS_FILE, np.asarray(vectors, dtype="float32"))
+            diversity.write_clusters(save_path, diversity.build_duplicate_clusters(vs.index, vectors))
+
+    def build_vector_store(self, texts: List[str], save_path: str, index_type: str = "flat",
+                           nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                           **index_params) -> Optional["FAISS"]:
         try:
             documents = self.create_documents(texts)
             if not documents:
                 raise ValueError("No documents created")
-            vs = FAISS.from_documents(documents, self.embeddings)
-            os.makedirs(save_path, exist_ok=True)
-            vs.save_local(save_path)
-            print(f"Vector store built and saved to {save_path}")
+            if index_type == "flat":
+                from langchain_community.vectorstores import FAISS
+                vs = FAISS.from_documents(documents, self.embeddings)
+            else:
+                vectors = np.asarray(self.embeddings.embed_documents([doc.page_content for doc in documents]),
+                                     dtype="float32")
+                vs = self.create_vector_store(
+                    vectors,
+                    [doc.page_content for doc in documents],
+                    [doc.metadata["image_index"] for doc in documents],
+                    index_type=index_type,
+                    **index_params,
+                )
+            self.save_vector_store(vs, save_path, index_type=index_type, nprobe=nprobe, ef_search=ef_search,
+                                   vectors=None if index_type == "flat" else vectors, build_params=index_params)
+            print(f"Vector store ({index_type}) built and saved to {save_path}")
             return vs
         except Exception as e:
             print(f"Error building vector store: {e}")
             return None
 
-    @st.cache_data
-    def load_vector_store(_self, load_path: str) -> Optional[FAISS]:
+    @st.cache_resource
+    def load_vector_store(_self, load_path: str) -> Optional["FAISS"]:
+        from langchain_community.vectorstores import FAISS
         try:
             vs = FAISS.load_local(
                 load_path,
                 _self.embeddings,
                 allow_dangerous_deserialization=True
             )
-            print(f"Vector_database loaded from {load_path}")
+            params = ann_index.load_index_params(load_path)
+            ann_index.set_search_params(vs.index, nprobe=params.get("nprobe"), ef_search=params.get("ef_search"))
+            print(f"Vector_database ({params['index_type']}) loaded from {load_path}")
             return vs
         except Exception as e:
             raise ValueError(f"Error loading Vector_database: {e}")
 
+    def load_mmap_store(self, load_path: str) -> MmapVectorStore:
+        """
+        Load the store memory-mapped (see mmap_store).
 
-if __name__ == "__main__":
-    # 1. Load the dataset
-    dataset = load_dataset("tomytjandra/h-and-m-fashion-caption", split="train")
+        Not cached here: the resource registry holds one store per live
+        version and drops it when a newer version is published, which
+        releases the mapping of the superseded one. Worker processes on the
+        same host share the mapped pages.
+        """
+        try:
+            vs = MmapVectorStore(load_path, embeddings=self.embeddings)
+            print(f"Memory-mapped Vector_database loaded from {load_path}")
+            return vs
+        except Exception as e:
+            raise ValueError(f"Error loading memory-mapped Vector_database: {e}")
+
+    def load(self, load_path: str) -> Union[MmapVectorStore, "FAISS"]:
+        """Load the memory-mapped store when available, falling back to the pickled langchain store."""
+        if mmap_store.is_mmap_store(load_path):
+            return self.load_mmap_store(load_path)
+        return self.load_vector_store(load_path)
+
+    def similarity_search(self, vs: Union[MmapVectorStore, "FAISS"], query: str, k: int = 30,
+                          nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Document]:
+        """
+        Similarity search with per-query nprobe (IVF) / efSearch (HNSW).
+
+        The params only apply to this call, so concurrent requests can pick
+        different points on the recall/latency curve.
+        """
+        if isinstance(vs, MmapVectorStore):
+            return vs.similarity_search(query, k=k, nprobe=nprobe, ef_search=ef_search)
+        if nprobe is None and ef_search is None:
+            return vs.similarity_search(query, k=k)
+
+        query_vector = np.asarray([self.embeddings.embed_query(query)], dtype="float32")
+        _, ids = ann_index.search(vs.index, query_vector, k, nprobe=nprobe, ef_search=ef_search)
+        return self.documents_at(vs, ids[0])
+
+    # -------- Incremental updates --------
+    def versioned_store(self, root: str) -> VersionedStore:
+        return VersionedStore(root, self.embeddings)
+
+    def upsert_items(self, root: str, items: Dict[int, str], publish: bool = True) -> Optional[str]:
+        """
+        Add or update captions by image_index, embedding only new or changed ones.
+
+        Writes a new version under `root` and, with `publish`, makes it live;
+        running app processes switch to it on their next request.
+        """
+        return self.versioned_store(root).upsert(items, publish=publish)
+
+    def delete_items(self, root: str, image_indexes: List[int], publish: bool = True) -> Optional[str]:
+        """Tombstone items by image_index in a new version."""
+        return self.versioned_store(root).delete(image_indexes, publish=publish)
+
+    def compact(self, root: str, background: bool = True) -> Optional[str]:
+        """Rebuild the live version without tombstoned rows (in a background thread by default)."""
+        return self.versioned_store(root).compact(background=background)
+
+    def documents_at(self, vs: Union[MmapVectorStore, "FAISS"], positions) -> List[Document]:
+        """Documents stored at the given index positions (positions of -1 are skipped)."""
+        if isinstance(vs, MmapVectorStore):
+            return [vs.document_at(int(p)) for p in positions if p != -1]
+        return [vs.docstore.search(vs.index_to_docstore_id[int(p)]) for p in positions if p != -1]
+
+
+class StreamingIndexBuilder:
+    """
+    Build the vector store from a streamed dataset in checkpointed shards.
+
+    Rows are read from the dataset in chunks of `shard_size`, encoded in
+    fixed-size batches of `batch_size` on `num_workers` threads, and each
+    finished chunk is written to `checkpoint_dir` as a shard. Re-running an
+    interrupted build skips the shards already on disk.
+    """
+    MANIFEST = "manifest.json"
 
-    # 2. Extract the text column into a list
-    texts = dataset["text"]
+    def __init__(self, manager: VectorStoreManager, checkpoint_dir: str = "vector_store_shards",
+                 shard_size: int = 4096, batch_size: int = 64, num_workers: int = 2):
+        if shard_size <= 0 or batch_size <= 0 or num_workers <= 0:
+            raise ValueError("shard_size, batch_size and num_workers must be positive")
+        self.manager = manager
+        self.checkpoint_dir = checkpoint_dir
+        self.shard_size = shard_size
+        self.batch_size = batch_size
+        self.num_workers = num_workers
 
-    # 3. Build & save the vector store
+    # -------- Checkpoints --------
+    def _manifest_path(self) -> str:
+        return os.path.join(self.checkpoint_dir, self.MANIFEST)
+
+    def load_manifest(self) -> Dict:
+        path = self._manifest_path()
+        if not os.path.exists(path):
+            return {"shards": [], "rows": 0}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest: Dict) -> None:
+        tmp_path = self._manifest_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self._manifest_path())
+
+    def _write_shard(self, shard_id: int, start: int, texts: List[str], vectors: np.ndarray) -> Dict:
+        name = f"shard_{shard_id:05d}"
+        vec_path = os.path.join(self.checkpoint_dir, f"{name}.npy")
+        text_path = os.path.join(self.checkpoint_dir, f"{name}.jsonl")
+
+        # Write to temp files first so a crash never leaves a half-written shard behind
+        with open(vec_path + ".tmp", "wb") as f:
+            np.save(f, vectors)
+        with open(text_path + ".tmp", "w", encoding="utf-8") as f:
+            for offset, text in enumerate(texts):
+                f.write(json.dumps({"image_index": start + offset, "text": text}, ensure_ascii=False) + "\n")
+        os.replace(vec_path + ".tmp", vec_path)
+        os.replace(text_path + ".tmp", text_path)
+
+        return {"name": name, "start": start, "count": len(texts)}
+
+    def iter_shards(self) -> Iterator[Tuple[np.ndarray, List[str], List[int]]]:
+        """Yield (vectors, texts, image_indexes) for every completed shard, in order."""
+        for shard in self.load_manifest()["shards"]:
+            vectors = np.load(os.path.join(self.checkpoint_dir, f"{shard['name']}.npy"))
+            texts, indexes = [], []
+            with open(os.path.join(self.checkpoint_dir, f"{shard['name']}.jsonl"), "r", encoding="utf-8") as f:
+                for line in f:
+                    row = json.loads(line)
+                    texts.append(row["text"])
+                    indexes.append(row["image_index"])
+            yield vectors, texts, indexes
+
+    # -------- Encoding --------
+    def _encode(self, texts: List[str], pool: ThreadPoolExecutor) -> np.ndarray:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        vectors = []
+        for batch_vectors in pool.map(self.manager.embeddings.embed_documents, batches):
+            vectors.extend(batch_vectors)
+        return np.asarray(vectors, dtype="float32")
+
+    def _iter_chunks(self, dataset_name: str, split: str, text_column: str, skip: int) -> Iterator[List[str]]:
+        from datasets import load_dataset
+
+        dataset = load_dataset(dataset_name, split=split, streaming=True)
+        if skip:
+            dataset = dataset.skip(skip)
+
+        chunk = []
+        for row in dataset:
+            chunk.append(row[text_column])
+            if len(chunk) == self.shard_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def encode_dataset(self, dataset_name: str = "tomytjandra/h-and-m-fashion-caption",
+                       split: str = "train", text_column: str = "text") -> Dict:
+        """Stream, encode and checkpoint the dataset. Returns the final manifest."""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        manifest = self.load_manifest()
+        if manifest.get("complete"):
+            print(f"All {manifest['rows']} rows already encoded in {self.checkpoint_dir}")
+            return manifest
+        if manifest["rows"]:
+            print(f"Resuming build after {manifest['rows']} rows ({len(manifest['shards'])} shards)")
+
+        started = time.perf_counter()
+        encoded_now = 0
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            for texts in self._iter_chunks(dataset_name, split, text_column, skip=manifest["rows"]):
+                vectors = self._encode(texts, pool)
+                shard = self._write_shard(len(manifest["shards"]), manifest["rows"], texts, vectors)
+
+                manifest["shards"].append(shard)
+                manifest["rows"] += shard["count"]
+                manifest["dimension"] = int(vectors.shape[1])
+                self._save_manifest(manifest)
+
+                encoded_now += shard["count"]
+                elapsed = time.perf_counter() - started
+                print(f"{shard['name']}: {manifest['rows']} rows total, "
+                      f"{encoded_now / elapsed:.1f} rows/sec")
+
+        manifest["complete"] = True
+        self._save_manifest(manifest)
+        elapsed = time.perf_counter() - started
+        if encoded_now:
+            print(f"Encoded {encoded_now} rows in {elapsed:.1f}s ({encoded_now / elapsed:.1f} rows/sec)")
+        return manifest
+
+    # -------- Assembly --------
+    def assemble(self, save_path: str, index_type: str = "flat", nprobe: Optional[int] = None,
+                 ef_search: Optional[int] = None, **index_params) -> Optional["FAISS"]:
+        """Merge the checkpointed shards into a FAISS vector store of `index_type` and save it."""
+        try:
+            shards = list(self.iter_shards())
+            if not shards:
+                raise ValueError(f"No shards found in {self.checkpoint_dir}")
+
+            vectors = np.concatenate([vectors for vectors, _, _ in shards])
+            texts = [text for _, shard_texts, _ in shards for text in shard_texts]
+            indexes = [index for _, _, shard_indexes in shards for index in shard_indexes]
+
+            started = time.perf_counter()
+            vs = self.manager.create_vector_store(vectors, texts, indexes, index_type=index_type, **index_params)
+            self.manager.save_vector_store(vs, save_path, index_type=index_type, nprobe=nprobe, ef_search=ef_search,
+                                           vectors=vectors, build_params=index_params)
+            print(f"Vector store ({index_type}) with {vs.index.ntotal} vectors assembled in "
+                  f"{time.perf_counter() - started:.1f}s and saved to {save_path}")
+            return vs
+        except Exception as e:
+            print(f"Error assembling vector store: {e}")
+            return None
+
+    def build(self, save_path: str, dataset_name: str = "tomytjandra/h-and-m-fashion-caption",
+              split: str = "train", text_column: str = "text", index_type: str = "flat",
+              **index_params) -> Optional["FAISS"]:
+        self.encode_dataset(dataset_name, split=split, text_column=text_column)
+        return self.assemble(save_path, index_type=index_type, **index_params)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the FAISS vector store from the H&M captions dataset.")
+    parser.add_argument("--dataset", default="tomytjandra/h-and-m-fashion-caption")
+    parser.add_argument("--save-path", default="vector_store")
+    parser.add_argument("--checkpoint-dir", default="vector_store_shards")
+    parser.add_argument("--shard-size", type=int, default=4096, help="Rows per checkpointed shard")
+    parser.add_argument("--batch-size", type=int, default=64, help="Rows per embedding batch")
+    parser.add_argument("--workers", type=int, default=2, help="Parallel embedding workers")
+    parser.add_argument("--index-type", default="flat", choices=list(ann_index.INDEX_TYPES))
+    parser.add_argument("--nlist", type=int, default=None, help="IVF cells (default: ~4*sqrt(n))")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW neighbours per node")
+    parser.add_argument("--pq-m", type=int, default=16, help="PQ sub-quantizers")
+    parser.add_argument("--nprobe", type=int, default=None, help="Default IVF cells probed per query")
+    parser.add_argument("--ef-search", type=int, default=None, help="Default HNSW search depth")
+    parser.add_argument("--catalog-path", default="catalog_store", help="Where to pack captions and thumbnails")
+    parser.add_argument("--skip-catalog", action="store_true", help="Don't build the local catalog store")
+    parser.add_argument("--image-index", default=None,
+                        help="Also embed the catalog thumbnails into an image index at this path (see visual_search)")
+    args = parser.parse_args()
+
+    # 1. Stream, encode & checkpoint the dataset (resumes from existing shards)
     manager = VectorStoreManager()
-    vs = manager.build_vector_store(texts, save_path="vector_store")
+    builder = StreamingIndexBuilder(
+        manager,
+        checkpoint_dir=args.checkpoint_dir,
+        shard_size=args.shard_size,
+        batch_size=args.batch_size,
+        num_workers=args.workers,
+    )
 
-    # 4. (Optional) reload it to verify
+    # 2. Merge the shards & save the vector store
+    vs = builder.build(
+        args.save_path,
+        dataset_name=args.dataset,
+        index_type=args.index_type,
+        nlist=args.nlist,
+        hnsw_m=args.hnsw_m,
+        pq_m=args.pq_m,
+        nprobe=args.nprobe,
+        ef_search=args.ef_search,
+    )
+
+    # 3. (Optional) reload it to verify
     if vs is not None:
-        reloaded = manager.load_vector_store("vector_store")
+        reloaded = manager.load_vector_store(args.save_path)
+
+    # 4. Pack captions & thumbnails for the UI next to the index
+    if not args.skip_catalog:
+        from catalog_store import build_catalog_store
+        build_catalog_store(args.catalog_path, dataset_name=args.dataset, num_workers=args.workers)
+
+    # 5. (Optional) image index for direct visual search, from the packed thumbnails
+    if args.image_index:
+        from visual_search import build_image_index
+        build_image_index(args.image_index, catalog_path=args.catalog_path)
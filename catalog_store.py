@@ -0,0 +1,220 @@
+from PIL import Image
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import argparse
+import json
+import os
+import time
+
+from mmap_store import CAPTIONS, IMAGE_INDEX_FILE, IdLookup, PackedBlobs, write_ids, write_packed
+from resources import get_registry
+import telemetry
+
+DATASET = "tomytjandra/h-and-m-fashion-caption"
+THUMBNAILS = "thumbnails"
+FALLBACK_DIR = "fallback"
+
+THUMBNAIL_SIZE = 384  # longest side, in pixels
+THUMBNAIL_QUALITY = 85
+FETCH_WORKERS = 8
+
+
+def make_thumbnail(image: Image.Image, max_side: int = THUMBNAIL_SIZE, quality: int = THUMBNAIL_QUALITY) -> bytes:
+    """Downscale an image to `max_side` and encode it as JPEG bytes."""
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image = image.copy()
+    image.thumbnail((max_side, max_side))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def fetch_remote_item(image_index: int, session=None, dataset: str = DATASET) -> Tuple[bytes, str]:
+    """Fetch one catalog row from the Hugging Face datasets-server. Returns (image bytes, caption)."""
+    session = session or get_registry().http_session()
+    url = (
+        "https://datasets-server.huggingface.co/rows"
+        f"?dataset={dataset}"
+        f"&config=default"
+        f"&split=train"
+        f"&offset={image_index}"
+        f"&limit=1"
+    )
+
+    response = session.get(url)
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch data: {response.status_code}")
+
+    try:
+        row = response.json()["rows"][0]["row"]
+        image_response = session.get(row["image"]["src"])
+        return image_response.content, row["text"]
+    except (IndexError, KeyError) as e:
+        raise ValueError("Invalid response structure or index out of range") from e
+
+
+class CatalogStore:
+    """
+    Local, id-addressable store of catalog captions and pre-resized thumbnails.
+
+    Thumbnails and captions live in packed, memory-mapped files (see
+    mmap_store.write_packed) so a batch of results is read from local disk
+    in one call. Ids missing from the packed files are fetched concurrently
+    from the datasets-server and cached under `fallback/`.
+    """
+    def __init__(self, path: str = "catalog_store", fetch_workers: int = FETCH_WORKERS):
+        self.path = path
+        self.fetch_workers = fetch_workers
+        self.fallback_dir = os.path.join(path, FALLBACK_DIR)
+        os.makedirs(self.fallback_dir, exist_ok=True)
+
+        self._thumbnails = self._captions = self._lookup = None
+        if self.is_built(path):
+            self._thumbnails = PackedBlobs(path, THUMBNAILS)
+            self._captions = PackedBlobs(path, CAPTIONS)
+            self._lookup = IdLookup(np.load(os.path.join(path, IMAGE_INDEX_FILE), mmap_mode="r"))
+
+    @staticmethod
+    def is_built(path: str) -> bool:
+        return all(os.path.exists(os.path.join(path, name)) for name in (
+            f"{THUMBNAILS}.bin", f"{THUMBNAILS}.offsets.npy", f"{CAPTIONS}.bin", IMAGE_INDEX_FILE))
+
+    # -------- Lookup --------
+    def get_many(self, image_indexes: Sequence[int]) -> Dict[int, Tuple[Image.Image, str]]:
+        """
+        Look up several items at once.
+
+        Returns:
+            Dict[int, Tuple[Image.Image, str]]: image_index -> (thumbnail, caption).
+            Ids that could not be found locally or remotely are left out.
+        """
+        with telemetry.span("catalog_fetch", items=len(image_indexes)) as span:
+            return self._get_many([int(i) for i in image_indexes], span)
+
+    def _get_many(self, image_indexes: List[int], span) -> Dict[int, Tuple[Image.Image, str]]:
+        items, missing = {}, []
+
+        positions = self._lookup.positions_of(image_indexes) if self._lookup else [-1] * len(image_indexes)
+        for image_index, position in zip(image_indexes, positions):
+            if position >= 0:
+                items[image_index] = self._decode(self._thumbnails[position], self._captions[position])
+                continue
+            cached = self._read_fallback(image_index)
+            if cached is not None:
+                items[image_index] = cached
+            else:
+                missing.append(image_index)
+
+        span.attributes["remote"] = len(missing)
+        if missing:
+            items.update(self._fetch_missing(missing))
+        return items
+
+    def _decode(self, thumbnail: bytes, caption: bytes) -> Tuple[Image.Image, str]:
+        return Image.open(BytesIO(thumbnail)), caption.decode("utf-8")
+
+    # -------- Fallback --------
+    def _fallback_paths(self, image_index: int) -> Tuple[str, str]:
+        base = os.path.join(self.fallback_dir, str(image_index))
+        return base + ".jpg", base + ".txt"
+
+    def _read_fallback(self, image_index: int) -> Optional[Tuple[Image.Image, str]]:
+        image_path, caption_path = self._fallback_paths(image_index)
+        if not (os.path.exists(image_path) and os.path.exists(caption_path)):
+            return None
+        with open(image_path, "rb") as f:
+            thumbnail = f.read()
+        with open(caption_path, "rb") as f:
+            caption = f.read()
+        return self._decode(thumbnail, caption)
+
+    def _fetch_and_cache(self, image_index: int) -> Tuple[Image.Image, str]:
+        with telemetry.span("fetch_remote_item", image_index=image_index):
+            image_bytes, caption = fetch_remote_item(image_index)
+        thumbnail = make_thumbnail(Image.open(BytesIO(image_bytes)))
+
+        image_path, caption_path = self._fallback_paths(image_index)
+        for path, data in ((image_path, thumbnail), (caption_path, caption.encode("utf-8"))):
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        return self._decode(thumbnail, caption.encode("utf-8"))
+
+    def _fetch_missing(self, image_indexes: List[int]) -> Dict[int, Tuple[Image.Image, str]]:
+        items = {}
+        with ThreadPoolExecutor(max_workers=min(self.fetch_workers, len(image_indexes))) as pool:
+            futures = {image_index: telemetry.submit(pool, self._fetch_and_cache, image_index)
+                       for image_index in image_indexes}
+            for image_index, future in futures.items():
+                try:
+                    items[image_index] = future.result()
+                except Exception as e:
+                    print(f"Failed to fetch catalog item {image_index}: {e}")
+        return items
+
+
+def build_catalog_store(path: str = "catalog_store", dataset_name: str = DATASET, split: str = "train",
+                        max_side: int = THUMBNAIL_SIZE, quality: int = THUMBNAIL_QUALITY,
+                        num_workers: int = 4, chunk_size: int = 256) -> int:
+    """
+    Stream the dataset and pack every caption and resized thumbnail into `path`.
+
+    Returns:
+        int: Number of items written
+    """
+    from datasets import load_dataset
+
+    os.makedirs(path, exist_ok=True)
+    dataset = load_dataset(dataset_name, split=split, streaming=True)
+    image_indexes, captions = [], []
+    started = time.perf_counter()
+
+    def chunks() -> Iterator[List[Dict]]:
+        chunk = []
+        for row in dataset:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def encode(row: Dict) -> bytes:
+        return make_thumbnail(row["image"], max_side=max_side, quality=quality)
+
+    def thumbnails() -> Iterator[bytes]:
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            for chunk in chunks():
+                for row, thumbnail in zip(chunk, pool.map(encode, chunk)):
+                    image_indexes.append(len(image_indexes))
+                    captions.append(row["text"])
+                    yield thumbnail
+                print(f"{len(image_indexes)} thumbnails packed, "
+                      f"{len(image_indexes) / (time.perf_counter() - started):.1f} rows/sec")
+
+    count = write_packed(path, THUMBNAILS, thumbnails())
+    write_packed(path, CAPTIONS, (caption.encode("utf-8") for caption in captions))
+    write_ids(path, image_indexes)
+
+    with open(os.path.join(path, "catalog.json"), "w", encoding="utf-8") as f:
+        json.dump({"dataset": dataset_name, "split": split, "items": count,
+                   "max_side": max_side, "quality": quality}, f, indent=2)
+    print(f"Catalog store with {count} items written to {path}")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack catalog captions and thumbnails into a local store.")
+    parser.add_argument("--path", default="catalog_store")
+    parser.add_argument("--dataset", default=DATASET)
+    parser.add_argument("--max-side", type=int, default=THUMBNAIL_SIZE)
+    parser.add_argument("--quality", type=int, default=THUMBNAIL_QUALITY)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    build_catalog_store(args.path, dataset_name=args.dataset, max_side=args.max_side,
+                        quality=args.quality, num_workers=args.workers)
@@ -0,0 +1,189 @@
+"""
+Near-duplicate clusters and post-retrieval diversification.
+
+H&M captions often describe the same garment in several colours, so the k
+nearest captions to a query can be a handful of look-alikes. At build time
+each vector is linked to those of its nearest neighbours with cosine
+similarity above DUPLICATE_THRESHOLD, and the connected components are saved
+as one cluster id per index position (clusters.npy). At query time the
+candidates are collapsed to one per cluster, then maximal marginal
+relevance picks a diverse subset to send on to reranking:
+
+    python diversity.py --path vector_store      # publish a version of the store with rebuilt clusters
+"""
+from typing import Dict, List, Optional, Sequence
+import argparse
+import os
+
+import faiss
+import numpy as np
+
+import ann_index
+import mmap_store
+import telemetry
+from ranking import collapse_duplicates, maximal_marginal_relevance
+
+# Cosine similarity above which two captions count as the same garment
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.95"))
+DUPLICATE_NEIGHBOURS = 8
+# MMR trade-off between relevance (1.0) and diversity (0.0)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Candidates kept for reranking after collapsing and MMR
+DIVERSIFY_KEEP = int(os.getenv("DIVERSIFY_KEEP", "15"))
+
+
+def _components(n_nodes: int, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Smallest node of each node's connected component (label propagation with pointer jumping)."""
+    labels = np.arange(n_nodes, dtype="int64")
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, sources, labels[targets])
+        np.minimum.at(labels, targets, labels[sources])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def build_duplicate_clusters(index: faiss.Index, vectors: np.ndarray, threshold: float = DUPLICATE_THRESHOLD,
+                             neighbours: int = DUPLICATE_NEIGHBOURS, clusters: Optional[np.ndarray] = None,
+                             batch_size: int = 4096) -> np.ndarray:
+    """
+    Cluster id per index position: connected components of the graph linking
+    each vector to its `neighbours` nearest neighbours in `index` with cosine
+    similarity >= `threshold`.
+
+    Args:
+        index (faiss.Index): Index over `vectors`, used to find the neighbours
+        vectors (np.ndarray): One row per index position
+        clusters (np.ndarray): Cluster ids of the first len(clusters) positions (e.g. from the
+            previous version); only the rows after them are searched and linked in
+    """
+    vectors = np.asarray(vectors, dtype="float32")
+    start = 0 if clusters is None else len(clusters)
+    if clusters is None:
+        nodes = np.arange(len(vectors), dtype="int64")
+    else:
+        first_new = int(clusters.max()) + 1 if len(clusters) else 0
+        nodes = np.concatenate([np.asarray(clusters, dtype="int64"),
+                                first_new + np.arange(len(vectors) - start, dtype="int64")])
+    if not len(nodes):
+        return np.zeros(0, dtype="int32")
+    norms = np.linalg.norm(vectors, axis=1) + 1e-12
+
+    sources, targets = [], []
+    for batch_start in range(start, len(vectors), batch_size):
+        batch = vectors[batch_start:batch_start + batch_size]
+        _, ids = ann_index.search(index, batch, neighbours + 1)
+        rows = np.repeat(np.arange(batch_start, batch_start + len(batch)), ids.shape[1])
+        cols = ids.ravel()
+        valid = (cols >= 0) & (cols != rows)
+        rows, cols = rows[valid], cols[valid]
+        similarity = np.einsum("ij,ij->i", vectors[rows], vectors[cols]) / (norms[rows] * norms[cols])
+        close = similarity >= threshold
+        sources.append(nodes[rows[close]])
+        targets.append(nodes[cols[close]])
+
+    edges = (np.concatenate(sources), np.concatenate(targets)) if sources else (np.zeros(0, "int64"),) * 2
+    labels = _components(int(nodes.max()) + 1, *edges)
+    return np.unique(labels[nodes], return_inverse=True)[1].reshape(-1).astype("int32")
+
+
+def write_clusters(path: str, clusters: np.ndarray) -> None:
+    mmap_store.write_array(path, mmap_store.CLUSTERS_FILE, np.asarray(clusters, dtype="int32"))
+
+
+def load_clusters(path: str) -> Optional[np.ndarray]:
+    clusters_path = os.path.join(path, mmap_store.CLUSTERS_FILE)
+    return np.load(clusters_path, mmap_mode="r") if os.path.exists(clusters_path) else None
+
+
+class Diversifier:
+    """
+    Post-retrieval stage: collapses near-duplicate candidates and re-selects them with MMR.
+
+    Candidate vectors are read from the store's vectors.npy (memory-mapped)
+    or, for stores without one, reconstructed from the faiss index. Without
+    clusters.npy only MMR runs; without vectors only the collapsing.
+
+    Args:
+        vec_db: The loaded store (MmapVectorStore or langchain FAISS)
+        embeddings: Embedding model, for the query vector
+        path (str): Directory of the store's files
+        lambda_mult (float): MMR relevance / diversity trade-off
+        keep (int): Candidates returned
+    """
+    def __init__(self, vec_db, embeddings, path: str, lambda_mult: float = MMR_LAMBDA, keep: int = DIVERSIFY_KEEP):
+        self.vec_db = vec_db
+        self.embeddings = embeddings
+        self.lambda_mult = lambda_mult
+        self.keep = keep
+        self.clusters = load_clusters(path)
+        vectors_path = os.path.join(path, mmap_store.VECTORS_FILE)
+        self.vectors = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+        self._position_by_id: Optional[Dict[int, int]] = None
+
+    def positions_of(self, image_indexes: Sequence[int]) -> np.ndarray:
+        """Index positions of the given image indexes (-1 when unknown)."""
+        if hasattr(self.vec_db, "positions_of"):
+            return self.vec_db.positions_of(image_indexes)
+        if self._position_by_id is None:
+            self._position_by_id = {
+                int(self.vec_db.docstore.search(doc_id).metadata.get("image_index", position)): position
+                for position, doc_id in self.vec_db.index_to_docstore_id.items()
+            }
+        return np.asarray([self._position_by_id.get(int(i), -1) for i in image_indexes], dtype="int64")
+
+    def vectors_at(self, positions: np.ndarray) -> Optional[np.ndarray]:
+        if self.vectors is not None:
+            return np.asarray(self.vectors[positions], dtype="float32")
+        try:
+            return np.vstack([self.vec_db.index.reconstruct(int(p)) for p in positions])
+        except RuntimeError:
+            return None
+
+    def diversify(self, query: str, items: List[Dict], keep: Optional[int] = None,
+                  query_vector: Optional[Sequence[float]] = None) -> List[Dict]:
+        """
+        At most `keep` of `items`: one per near-duplicate cluster, chosen by MMR.
+
+        Items keep their fields; collapsed look-alikes are listed in "duplicates".
+        """
+        keep = keep or self.keep
+        if not items:
+            return items
+        with telemetry.span("diversify", candidates=len(items)):
+            positions = self.positions_of([int(item["id"]) for item in items])
+            if self.clusters is not None:
+                position_of = {int(item["id"]): position for item, position in zip(items, positions)}
+                known = (positions >= 0) & (positions < len(self.clusters))
+                cluster_ids = np.where(known, self.clusters[positions.clip(0, len(self.clusters) - 1)], -1)
+                items = collapse_duplicates(items, cluster_ids)
+                positions = np.asarray([position_of[int(item["id"])] for item in items], dtype="int64")
+
+            if len(items) > keep and (positions >= 0).all():
+                vectors = self.vectors_at(positions)
+                if vectors is not None:
+                    if query_vector is None:
+                        query_vector = self.embeddings.embed_query(query)
+                    order = maximal_marginal_relevance(query_vector, vectors, keep, self.lambda_mult)
+                    items = [items[i] for i in order]
+            telemetry.annotate(kept=min(len(items), keep))
+            return items[:keep]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute near-duplicate clusters for a vector store.")
+    parser.add_argument("--path", default="vector_store",
+                        help="Store root (published versions are immutable, so the clusters go in a new one)")
+    parser.add_argument("--threshold", type=float, default=DUPLICATE_THRESHOLD)
+    parser.add_argument("--neighbours", type=int, default=DUPLICATE_NEIGHBOURS)
+    args = parser.parse_args()
+
+    from index_versions import VersionedStore, resolve_store_path
+
+    VersionedStore(args.path, embeddings=None).recluster(threshold=args.threshold, neighbours=args.neighbours)
+    store_path = resolve_store_path(args.path)
+    clusters = load_clusters(store_path)
+    sizes = np.bincount(clusters)
+    print(f"{len(clusters)} vectors in {len(sizes)} clusters ({int((sizes > 1).sum())} with near-duplicates, "
+          f"largest {int(sizes.max()) if len(sizes) else 0}) written to {store_path}")
@@ -0,0 +1,411 @@
+"""
+Offline structured attribute extraction for the catalog.
+
+Each catalog caption is reduced once to the fields of the image-description
+schema (product type, gender, color, fabric, pattern, neckline, sleeve,
+fit) by a pluggable extractor: keyword rules over the caption (the default,
+no model needed) or a chat LLM. The values are stored as a compact
+columnar side file next to the catalog store:
+
+    attributes/image_index.npy    dataset row of each catalog item
+    attributes/<field>.npy        uint16 codes, one row per item, up to MAX_VALUES columns (0 = none)
+    attributes/vocab.json         code -> value for each field, plus the extractor used
+
+At query time the LLM rerank sends these fields instead of the free-text
+captions, and dense-only retrieval uses them as attribute filters.
+
+Extraction runs in chunks with bounded concurrency. Each finished chunk is
+saved under attributes/parts/, so an interrupted run picks up where it
+stopped; the columns are written once every chunk is done:
+
+    python enrich_catalog.py --catalog-path catalog_store
+    python enrich_catalog.py --extractor llm --concurrency 4 --rps 2
+"""
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from textwrap import dedent
+from typing import Dict, Iterable, List, Optional, Sequence
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+import telemetry
+from rate_limit import RateLimiter
+from hybrid_retriever import ATTRIBUTES, tokenize
+from mmap_store import CAPTIONS, IMAGE_INDEX_FILE, IdLookup, PackedBlobs, write_array, write_ids
+
+ATTRIBUTES_DIR = "attributes"
+PARTS_DIR = "parts"
+VOCAB_FILE = "vocab.json"
+JOB_FILE = "job.json"
+# Values kept per item and field (e.g. the first three colors)
+MAX_VALUES = 3
+
+# Keyword vocabularies for the fields the hybrid index doesn't cover, in the same value -> tokens form
+EXTRA_ATTRIBUTES: Dict[str, Dict[str, Sequence[str]]] = {
+    "fabric": {
+        "cotton": ["cotton"], "linen": ["linen"], "denim": ["denim"], "wool": ["wool", "merino"],
+        "cashmere": ["cashmere"], "silk": ["silk"], "satin": ["satin"], "jersey": ["jersey"],
+        "knit": ["knit", "knitted", "rib-knit", "fine-knit"], "lace": ["lace"], "leather": ["leather"],
+        "suede": ["suede"], "velvet": ["velvet", "velour"], "chiffon": ["chiffon"], "fleece": ["fleece"],
+        "corduroy": ["corduroy"], "mesh": ["mesh"], "sequins": ["sequins", "sequined", "sequinned"],
+        "viscose": ["viscose"], "polyester": ["polyester"],
+    },
+    "pattern": {
+        "striped": ["striped", "stripes"], "checked": ["checked", "check", "tartan", "plaid"],
+        "floral": ["floral", "flowers", "flower"], "spotted": ["spotted", "dots", "polka"],
+        "animal": ["leopard", "zebra", "snakeskin", "animal"], "printed": ["printed", "print", "motif"],
+        "embroidered": ["embroidered", "embroidery"], "camouflage": ["camouflage", "camo"],
+    },
+    "neckline": {
+        "v-neck": ["v-neck", "v-necked", "v-neckline"], "round": ["round-necked", "round-neck", "crew-neck"],
+        "collar": ["collar", "collared"], "hood": ["hood", "hooded"],
+        "turtleneck": ["turtleneck", "polo-neck", "high-necked"], "off-shoulder": ["off-the-shoulder"],
+    },
+    "sleeve": {
+        "long": ["long-sleeved"], "short": ["short-sleeved"], "sleeveless": ["sleeveless", "strappy"],
+        "puff": ["puff-sleeved", "puff"],
+    },
+    "fit": {
+        "slim": ["slim", "skinny", "fitted"], "regular": ["regular"], "relaxed": ["relaxed", "loose"],
+        "oversized": ["oversized"], "wide": ["wide", "flared"], "straight": ["straight"],
+    },
+}
+FIELDS = ["product_type", "gender", "color", "fabric", "pattern", "neckline", "sleeve", "fit"]
+# Short names used in the compact rerank payload
+LABELS = {"product_type": "type", "gender": "for", "color": "color", "fabric": "fabric", "pattern": "pattern",
+          "neckline": "neck", "sleeve": "sleeve", "fit": "fit"}
+
+
+def attributes_path(catalog_path: str) -> str:
+    return os.path.join(catalog_path, ATTRIBUTES_DIR)
+
+
+# -------- Extractors --------
+class Extractor(ABC):
+    """
+    Turns catalog captions into attribute dicts, e.g.
+    {"product_type": ["dress"], "color": ["black"], "fit": ["slim"]}.
+
+    Fields without a value are left out; values are lowercase.
+    """
+    name = "extractor"
+
+    @abstractmethod
+    def extract(self, ids: Sequence[int], texts: Sequence[str]) -> List[Dict[str, List[str]]]:
+        ...
+
+
+class RuleExtractor(Extractor):
+    """Keyword matching over caption tokens, with the hybrid index's vocabularies plus EXTRA_ATTRIBUTES."""
+    name = "rules"
+
+    def __init__(self, vocabularies: Optional[Dict[str, Dict[str, Sequence[str]]]] = None):
+        self.vocabularies = vocabularies or {**ATTRIBUTES, **EXTRA_ATTRIBUTES}
+
+    def extract(self, ids: Sequence[int], texts: Sequence[str]) -> List[Dict[str, List[str]]]:
+        results = []
+        for text in texts:
+            tokens = set(tokenize(text))
+            found = {}
+            for field, values in self.vocabularies.items():
+                matched = [value for value, keywords in values.items() if tokens.intersection(keywords)]
+                if matched:
+                    found[field] = matched
+            results.append(found)
+        return results
+
+
+class LLMExtractor(Extractor):
+    """
+    Asks a chat LLM for the fields of a batch of captions in one JSON-mode call.
+
+    Args:
+        client: Groq client (default: the shared one from the registry)
+        requests_per_second (float): Client-side rate limit shared by all workers
+    """
+    name = "llm"
+
+    def __init__(self, client=None, model: str = "meta-llama/llama-4-scout-17b-16e-instruct",
+                 requests_per_second: float = 2.0):
+        from resources import get_registry
+
+        self.client = client or get_registry().groq_client()
+        self.model = model
+        self.limiter = RateLimiter(requests_per_second)
+
+    def system_prompt(self) -> str:
+        fields = ", ".join(FIELDS)
+        return dedent(f"""
+            You are a fashion catalog tagger. For each product caption below, extract these fields: {fields}.
+
+            Input: one item per line as `id|caption`.
+
+            Rules:
+            - Use short lowercase values (e.g. "dress", "women", "black", "cotton", "striped", "v-neck", "long", "slim").
+            - Every field is a list; leave it empty when the caption doesn't say.
+            - Do not guess beyond the caption.
+
+            Return only this JSON object:
+            {{"items": [{{"id": "4", "product_type": ["dress"], "color": ["black"], "fabric": [], ...}}]}}
+        """).strip()
+
+    def extract(self, ids: Sequence[int], texts: Sequence[str]) -> List[Dict[str, List[str]]]:
+        from tenacity import retry, stop_after_attempt, wait_exponential
+
+        @retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=1),
+               before_sleep=telemetry.count_retries("enrich"))
+        def call():
+            self.limiter.acquire()
+            with telemetry.span("llm.enrich", model=self.model, items=len(texts)):
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": self.system_prompt()},
+                        {"role": "user", "content": "\n".join(
+                            f"{i}|{' '.join(text.split())}" for i, text in zip(ids, texts))},
+                    ],
+                    temperature=0.0,
+                    response_format={"type": "json_object"},
+                )
+                telemetry.record_usage("enrich", response)
+            return json.loads(response.choices[0].message.content.strip()).get("items", [])
+
+        by_id = {str(item.get("id")): item for item in call() if isinstance(item, dict)}
+        results = []
+        for i in ids:
+            item = by_id.get(str(i), {})
+            found = {}
+            for field in FIELDS:
+                values = item.get(field) or []
+                values = [values] if isinstance(values, str) else values
+                values = [" ".join(str(value).lower().split()) for value in values if str(value).strip()]
+                if values:
+                    found[field] = list(dict.fromkeys(values))
+            results.append(found)
+        return results
+
+
+def get_extractor(name: str, **kwargs) -> Extractor:
+    """Extractor by name: "rules" or "llm"."""
+    name = (name or "rules").lower()
+    if name == "rules":
+        return RuleExtractor()
+    if name == "llm":
+        return LLMExtractor(**kwargs)
+    raise ValueError(f"Unknown extractor '{name}'. Choose from: rules, llm")
+
+
+# -------- Enrichment job --------
+def _write_json(path: str, data) -> None:
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def write_columns(path: str, image_indexes: np.ndarray, rows: Sequence[Dict[str, List[str]]],
+                  extractor: str) -> Dict[str, int]:
+    """
+    Encode attribute dicts as one uint16 code matrix per field and write them with the vocabulary.
+
+    Returns:
+        Dict[str, int]: Vocabulary size per field
+    """
+    vocab = {}
+    for field in FIELDS:
+        values = sorted({value for row in rows for value in row.get(field, [])})
+        if len(values) >= np.iinfo("uint16").max:
+            raise ValueError(f"Too many distinct values for {field} ({len(values)}) to store as uint16")
+        codes = {value: code for code, value in enumerate(values, start=1)}
+        width = max([min(len(row.get(field, [])), MAX_VALUES) for row in rows] + [1])
+        column = np.zeros((len(rows), width), dtype="uint16")
+        for position, row in enumerate(rows):
+            for slot, value in enumerate(row.get(field, [])[:width]):
+                column[position, slot] = codes[value]
+        write_array(path, f"{field}.npy", column)
+        vocab[field] = [""] + values
+
+    write_ids(path, image_indexes)
+    _write_json(os.path.join(path, VOCAB_FILE), {"extractor": extractor, "items": len(rows), "fields": vocab})
+    return {field: len(values) - 1 for field, values in vocab.items()}
+
+
+def enrich_catalog(catalog_path: str = "catalog_store", extractor: Optional[Extractor] = None,
+                   chunk_size: int = 256, batch_size: int = 16, concurrency: int = 4,
+                   restart: bool = False) -> Dict:
+    """
+    Extract attributes for every catalog caption and write the columnar side file.
+
+    Args:
+        chunk_size (int): Items per saved part (the unit of resumption)
+        batch_size (int): Captions per extractor call
+        concurrency (int): Chunks extracted in parallel
+        restart (bool): Drop parts left by a previous run instead of resuming it
+    """
+    from catalog_store import CatalogStore
+
+    if not CatalogStore.is_built(catalog_path):
+        raise FileNotFoundError(f"No catalog store in {catalog_path}; build it with bulid_vec_db.py first")
+    extractor = extractor or RuleExtractor()
+    path = attributes_path(catalog_path)
+    parts_path = os.path.join(path, PARTS_DIR)
+    if restart and os.path.exists(parts_path):
+        shutil.rmtree(parts_path)
+    os.makedirs(parts_path, exist_ok=True)
+
+    captions = PackedBlobs(catalog_path, CAPTIONS)
+    image_indexes = np.load(os.path.join(catalog_path, IMAGE_INDEX_FILE))
+    job = {"extractor": extractor.name, "items": len(image_indexes), "chunk_size": chunk_size}
+    job_path = os.path.join(parts_path, JOB_FILE)
+    if os.path.exists(job_path):
+        with open(job_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous != job:
+            captions.close()
+            raise ValueError(f"{parts_path} holds parts of a different run ({previous}); rerun with --restart")
+    else:
+        _write_json(job_path, job)
+
+    def part_file(start: int) -> str:
+        return os.path.join(parts_path, f"{start:09d}.json")
+
+    def run_chunk(start: int) -> int:
+        end = min(start + chunk_size, len(image_indexes))
+        ids = [int(i) for i in image_indexes[start:end]]
+        texts = [captions[position].decode("utf-8") for position in range(start, end)]
+        rows = []
+        for offset in range(0, len(ids), batch_size):
+            rows.extend(extractor.extract(ids[offset:offset + batch_size], texts[offset:offset + batch_size]))
+        _write_json(part_file(start), rows)
+        return end - start
+
+    starts = range(0, len(image_indexes), chunk_size)
+    pending = [start for start in starts if not os.path.exists(part_file(start))]
+    if len(pending) < len(starts):
+        print(f"Resuming: {len(starts) - len(pending)} of {len(starts)} chunks already extracted")
+
+    started = time.perf_counter()
+    processed = failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            in_flight, queue = {}, iter(pending)
+            # Keep at most `concurrency` chunks submitted, so a long run doesn't queue every chunk up front
+            for start in queue:
+                in_flight[pool.submit(run_chunk, start)] = start
+                if len(in_flight) < concurrency:
+                    continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    processed, failed = _collect(future, in_flight.pop(future), processed, failed, started)
+            for future in list(in_flight):
+                processed, failed = _collect(future, in_flight.pop(future), processed, failed, started)
+    finally:
+        captions.close()
+
+    summary = {"extractor": extractor.name, "processed": processed, "failed_chunks": failed,
+               "seconds": round(time.perf_counter() - started, 2)}
+    if failed:
+        summary["complete"] = False
+        print(json.dumps(summary))
+        print("Some chunks failed; rerun to retry them")
+        return summary
+
+    rows = []
+    for start in starts:
+        with open(part_file(start), "r", encoding="utf-8") as f:
+            rows.extend(json.load(f))
+    summary["vocabulary"] = write_columns(path, image_indexes, rows, extractor.name)
+    summary["complete"] = True
+    shutil.rmtree(parts_path)
+    print(json.dumps(summary))
+    return summary
+
+
+def _collect(future, start: int, processed: int, failed: int, started: float):
+    try:
+        processed += future.result()
+        print(f"{processed} items enriched, {processed / (time.perf_counter() - started):.1f} items/sec")
+    except Exception as e:
+        failed += 1
+        print(f"Chunk starting at item {start} failed: {e}")
+    return processed, failed
+
+
+# -------- Lookup --------
+class CatalogAttributes:
+    """Read-only, memory-mapped view of the attribute side file, addressed by image index."""
+    def __init__(self, catalog_path: str = "catalog_store"):
+        path = attributes_path(catalog_path)
+        with open(os.path.join(path, VOCAB_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.extractor = meta["extractor"]
+        self.vocab: Dict[str, List[str]] = meta["fields"]
+        self.codes = {field: {value: code for code, value in enumerate(values)} for field, values in self.vocab.items()}
+        self.columns = {field: np.load(os.path.join(path, f"{field}.npy"), mmap_mode="r") for field in self.vocab}
+        self._lookup = IdLookup(np.load(os.path.join(path, IMAGE_INDEX_FILE), mmap_mode="r"))
+
+    def _positions(self, image_indexes: Sequence) -> np.ndarray:
+        ids = [int(i) if str(i).lstrip("-").isdigit() else -1 for i in image_indexes]
+        return self._lookup.positions_of(ids)
+
+    @staticmethod
+    def is_built(catalog_path: str = "catalog_store") -> bool:
+        return os.path.exists(os.path.join(attributes_path(catalog_path), VOCAB_FILE))
+
+    def get(self, image_indexes: Sequence[int]) -> List[Optional[Dict[str, List[str]]]]:
+        """Attribute dicts of the given items (None for items not in the side file)."""
+        positions = self._positions(image_indexes)
+        rows = [{} if position >= 0 else None for position in positions]
+        known = np.flatnonzero(positions >= 0)
+        for field, column in self.columns.items():
+            values = self.vocab[field]
+            for i, codes in zip(known, column[positions[known]]):
+                if codes.any():
+                    rows[i][field] = [values[code] for code in codes if code]
+        return rows
+
+    def describe(self, image_indexes: Sequence[int]) -> List[Optional[str]]:
+        """Compact `type=dress color=black/white ...` descriptions (None when an item has no attributes)."""
+        return [
+            " ".join(f"{LABELS.get(field, field)}={'/'.join(row[field])}" for field in FIELDS if field in row) or None
+            if row is not None else None
+            for row in self.get(image_indexes)
+        ]
+
+    def mask(self, image_indexes: Sequence[int], filters: Dict[str, Iterable[str]]) -> np.ndarray:
+        """
+        Which items match the filters, with the semantics of AttributeBitmaps.mask.
+
+        Values of one field are OR-ed, fields are AND-ed; items missing from
+        the side file don't match.
+        """
+        positions = self._positions(image_indexes)
+        result = positions >= 0
+        for field, values in filters.items():
+            codes = [self.codes.get(field, {}).get(value) for value in values]
+            codes = [code for code in codes if code]
+            if field not in self.columns or not codes:
+                return np.zeros(len(positions), dtype=bool)
+            rows = np.asarray(self.columns[field][positions.clip(0)])
+            result &= np.isin(rows, codes).any(axis=1)
+        return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract structured attributes for every catalog item.")
+    parser.add_argument("--catalog-path", default="catalog_store")
+    parser.add_argument("--extractor", default="rules", help="rules or llm")
+    parser.add_argument("--chunk-size", type=int, default=256, help="Items per saved part")
+    parser.add_argument("--batch-size", type=int, default=16, help="Captions per extractor call")
+    parser.add_argument("--concurrency", type=int, default=4, help="Chunks extracted in parallel")
+    parser.add_argument("--rps", type=float, default=2.0, help="Max LLM requests per second (llm extractor)")
+    parser.add_argument("--restart", action="store_true", help="Discard parts of an interrupted run")
+    args = parser.parse_args()
+
+    extractor = get_extractor(args.extractor, **({"requests_per_second": args.rps} if args.extractor == "llm" else {}))
+    enrich_catalog(args.catalog_path, extractor, chunk_size=args.chunk_size, batch_size=args.batch_size,
+                   concurrency=args.concurrency, restart=args.restart)
@@ -1,18 +1,186 @@
 from rephrase_query import QueryRephraser
 from bulid_vec_db import VectorStoreManager
-from typing import List, Dict, Union
-import streamlit as st
+from resources import get_registry
+from query_cache import SemanticCache
+from hybrid_retriever import HybridRetriever, extract_attributes, has_hybrid_index
+import telemetry
+from typing import List, Dict, Optional, Sequence, Union
+import numpy as np
+import os
+
+import ann_index
+
+# Cosine similarity above which a new query reuses a cached rephrasing + retrieval (0 disables)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0"))
+SEMANTIC_CACHE_SIZE = 1024
+SEMANTIC_CACHE_TTL = 3600  # seconds
+# Fuse BM25 with dense search when the store has a lexical index
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+# Pre-filter candidates on the colors / product types / genders named in the user's own query
+AUTO_FILTERS = os.getenv("AUTO_FILTERS", "0") == "1"
+# Collapse near-duplicate candidates and pick a diverse subset (MMR) before reranking
+DIVERSIFY = os.getenv("DIVERSIFY", "1") == "1"
+# Without a hybrid index, filters apply to the extracted catalog attributes (see enrich_catalog)
+# of this many times k dense candidates
+ATTRIBUTE_FILTER_OVERFETCH = 4
 
 class recommendations_based_on_vecdb:
     """
     Class to handle recommendations based on vector database.
     """
-    def __init__(self, vector_store_path: str = "vector_store"):
+    def __init__(self, vector_store_path: str = "vector_store",
+                 semantic_cache_threshold: float = SEMANTIC_CACHE_THRESHOLD):
         self.vector_store_path = vector_store_path
         self.vector_manager = VectorStoreManager()
-        self.vec_db = self.vector_manager.load_vector_store(self.vector_store_path)
+        self.query_rephraser = QueryRephraser()
+        self.semantic_cache_threshold = semantic_cache_threshold
+
+    # The store, its hybrid index and the semantic cache are looked up per
+    # request, keyed by the live version, so a newly published index version
+    # (see index_versions) is picked up without restarting the app.
+    @property
+    def vec_db(self):
+        return get_registry().vector_store(self.vector_store_path)
+
+    @property
+    def sharded(self):
+        """Scatter-gather search over shard servers when SHARD_URLS is set (see sharded_search)."""
+        return get_registry().sharded_search()
+
+    @property
+    def hybrid(self) -> Optional[HybridRetriever]:
+        if self.sharded is not None:
+            return None
+        live_path = get_registry().live_store_path(self.vector_store_path)
+        if not HYBRID_SEARCH or not has_hybrid_index(live_path):
+            return None
+        vec_db = self.vec_db
+        return get_registry().get(
+            f"hybrid_retriever:{live_path}",
+            lambda: HybridRetriever(self.vector_manager, vec_db, live_path),
+        )
+
+    @property
+    def semantic_cache(self) -> Optional[SemanticCache]:
+        if not self.semantic_cache_threshold:
+            return None
+        live_path = get_registry().live_store_path(self.vector_store_path)
+        return get_registry().get(
+            f"semantic_cache:{live_path}",
+            lambda: SemanticCache(threshold=self.semantic_cache_threshold, maxsize=SEMANTIC_CACHE_SIZE,
+                                  ttl=SEMANTIC_CACHE_TTL),
+        )
+
+    @property
+    def attributes(self):
+        """Extracted catalog attributes (see enrich_catalog), or None when they haven't been built."""
+        return get_registry().catalog_attributes()
+
+    def filter_by_attributes(self, items: List[Dict], filters: Dict[str, List[str]], k: int) -> List[Dict]:
+        """The first `k` of `items` whose extracted attributes match `filters` (all of them without attributes)."""
+        attributes = self.attributes
+        if attributes is None or not items:
+            return items[:k]
+        mask = attributes.mask([item["id"] for item in items], filters)
+        return [item for item, keep in zip(items, mask) if keep][:k]
+
+    def diversify(self, query: str, items: List[Dict], keep: Optional[int] = None,
+                  query_vector: Optional[Sequence[float]] = None) -> List[Dict]:
+        """
+        One candidate per near-duplicate cluster, narrowed to a diverse `keep` with MMR (see diversity).
+
+        Returns `items` unchanged when DIVERSIFY is off or the store is sharded.
+        """
+        if not DIVERSIFY or not items or self.sharded is not None:
+            return items
+        return get_registry().diversifier(self.vector_store_path).diversify(query, items, keep=keep,
+                                                                            query_vector=query_vector)
+
+    def search(self, query: str, k: int = 30, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None, filters: Optional[Dict[str, List[str]]] = None) -> List[Dict]:
+        """
+        Search only (no rephrasing), returning items as {'id', 'content'} dicts.
+
+        Uses hybrid dense + BM25 retrieval when available; `filters` (e.g.
+        {"color": ["black"]}) restrict results to matching captions. Without
+        a hybrid index (e.g. sharded search) `filters` are matched against the
+        extracted catalog attributes of an over-fetched candidate set instead.
+        """
+        hybrid = self.hybrid
+        with telemetry.span("retrieve", k=k, hybrid=hybrid is not None):
+            if hybrid is not None:
+                return hybrid.search(query, k=k, filters=filters, nprobe=nprobe, ef_search=ef_search)
+
+            fetch_k = k * ATTRIBUTE_FILTER_OVERFETCH if filters and self.attributes is not None else k
+            sharded = self.sharded
+            if sharded is not None:
+                items = [{'id': item['id'], 'content': item['content']}
+                         for item in sharded.search(query, k=fetch_k, nprobe=nprobe, ef_search=ef_search)]
+                return self.filter_by_attributes(items, filters, k) if filters else items
 
-    def get_vector_recommendations(self, user_query: str, k: int = 30) -> Union[str, List[Dict]]:
+            relevant_items = self.vector_manager.similarity_search(
+                self.vec_db,
+                query,
+                k=fetch_k,
+                nprobe=nprobe,
+                ef_search=ef_search
+            )
+
+        recommended_items = []
+        for item in relevant_items:
+
+            recommendation = {
+                'id': item.metadata.get('image_index', 'N/A'),
+                'content': item.page_content,
+                                        }
+            recommended_items.append(recommendation)
+        if filters:
+            return self.filter_by_attributes(recommended_items, filters, k)
+        return recommended_items
+
+    def search_many(self, queries: Sequence[str], k: int = 30,
+                    filters: Optional[Sequence[Optional[Dict[str, List[str]]]]] = None,
+                    nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[List[Dict]]:
+        """
+        Batched `search`: one embedding call and one faiss search for all queries.
+
+        Used by the recommendation service to serve concurrent requests together.
+        """
+        if not queries:
+            return []
+        embeddings = self.vector_manager.embeddings
+        hybrid = self.hybrid
+        with telemetry.span("retrieve_batch", k=k, batch=len(queries), hybrid=hybrid is not None):
+            if hasattr(embeddings, "embed_queries"):
+                vectors = embeddings.embed_queries(list(queries))
+            else:
+                vectors = [embeddings.embed_query(query) for query in queries]
+            matrix = np.asarray(vectors, dtype="float32")
+
+            if hybrid is not None:
+                return hybrid.search_many(queries, matrix, k=k, filters=filters, nprobe=nprobe, ef_search=ef_search)
+
+            filters = filters or [None] * len(queries)
+            fetch_k = k * ATTRIBUTE_FILTER_OVERFETCH if any(filters) and self.attributes is not None else k
+            sharded = self.sharded
+            if sharded is not None:
+                rows = [[{'id': item['id'], 'content': item['content']} for item in row]
+                        for row in sharded.search_many(matrix, k=fetch_k, nprobe=nprobe, ef_search=ef_search)]
+            else:
+                vec_db = self.vec_db
+                _, positions = ann_index.search(vec_db.index, matrix, fetch_k, nprobe=nprobe, ef_search=ef_search,
+                                                mask=getattr(vec_db, "live_mask", None))
+                rows = [
+                    [{'id': doc.metadata.get('image_index', 'N/A'), 'content': doc.page_content}
+                     for doc in self.vector_manager.documents_at(vec_db, row_positions)]
+                    for row_positions in positions
+                ]
+            return [self.filter_by_attributes(row, row_filters, k) if row_filters else row[:k]
+                    for row, row_filters in zip(rows, filters)]
+
+    def get_vector_recommendations(self, user_query: str, k: int = 30, nprobe: Optional[int] = None,
+                                   ef_search: Optional[int] = None,
+                                   filters: Optional[Dict[str, List[str]]] = None) -> Union[str, List[Dict]]:
         """
         Get recommendations based on user intent using vector similarity search.
         
@@ -20,31 +188,43 @@ class recommendations_based_on_vecdb:
             user_query (str): The user's query or intent
             vec_db (FAISS): The FAISS vector store containing the items
             k (int): Number of recommendations to return (default: 20)
+            nprobe (int): IVF cells to probe for this query (IVF indexes only)
+            ef_search (int): HNSW search depth for this query (HNSW indexes only)
+            filters (Dict): Attribute filters, e.g. {"color": ["black"], "gender": ["men"]} (hybrid index or
+                extracted catalog attributes)
             
         Returns:
             Union[str, List[Dict]]: user_intent,  List of recommended items with their metadata and scores
         """
-        
-        query_rephraser = QueryRephraser()
-        user_intent = query_rephraser.rephrase_query(user_query)
+        if filters is None and AUTO_FILTERS and (self.hybrid is not None or self.attributes is not None):
+            filters = {attribute: sorted(values) for attribute, values in extract_attributes(user_query).items()}
+        params = (nprobe, ef_search, tuple(sorted((a, tuple(sorted(v))) for a, v in (filters or {}).items())))
+
+        query_embedding = None
+        semantic_cache = self.semantic_cache
+        if semantic_cache is not None:
+            query_embedding = self.vector_manager.embeddings.embed_query(user_query)
+            cached = semantic_cache.get(query_embedding)
+            if cached is not None and cached["k"] >= k and cached["params"] == params:
+                telemetry.annotate(semantic_cache_hit=True)
+                return cached["user_intent"], cached["items"][:k]
+
+        with telemetry.span("rephrase"):
+            user_intent = self.query_rephraser.rephrase_query(user_query)
 
         try:
 
-            relevant_items = self.vec_db.similarity_search(
-                user_intent,
-                k=k
-            )
-            
-            recommended_items = []
-            for item in relevant_items:
-            
-                recommendation = {
-                    'id': item.metadata.get('image_index', 'N/A'),
-                    'content': item.page_content,
-                                            }
-                recommended_items.append(recommendation)
+            recommended_items = self.search(user_intent, k=k, nprobe=nprobe, ef_search=ef_search, filters=filters)
+
+            if query_embedding is not None and user_intent:
+                semantic_cache.set(query_embedding, {
+                    "user_intent": user_intent,
+                    "items": recommended_items,
+                    "k": k,
+                    "params": params,
+                })
                 
             return user_intent, recommended_items
             
         except Exception as e:
-            st.error(f"Error during getting vector_recommendations: {str(e)}")
+            telemetry.report_error("vector_recommendations", f"Error during getting vector_recommendations: {str(e)}")
@@ -0,0 +1,281 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+import json
+import os
+import re
+
+import numpy as np
+
+import ann_index
+import telemetry
+from ranking import reciprocal_rank_fusion
+
+HYBRID_DIR = "hybrid"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+# Attribute vocabularies, matched against caption tokens at build time.
+# Each value maps to the tokens that signal it.
+ATTRIBUTES: Dict[str, Dict[str, Sequence[str]]] = {
+    "color": {
+        "black": ["black"], "white": ["white"], "grey": ["grey", "gray"], "beige": ["beige"],
+        "brown": ["brown"], "blue": ["blue", "denim"], "navy": ["navy"], "turquoise": ["turquoise"],
+        "green": ["green", "khaki"], "yellow": ["yellow"], "orange": ["orange"], "red": ["red"],
+        "pink": ["pink"], "purple": ["purple", "lilac"], "gold": ["gold", "gold-coloured"],
+        "silver": ["silver", "silver-coloured"], "cream": ["cream", "off-white"],
+    },
+    "product_type": {
+        "top": ["top", "vest", "tank", "camisole"], "t-shirt": ["t-shirt", "tee"], "shirt": ["shirt"],
+        "blouse": ["blouse"], "jumper": ["jumper", "sweater", "pullover"], "cardigan": ["cardigan"],
+        "hoodie": ["hoodie", "sweatshirt"], "jacket": ["jacket", "blazer"], "coat": ["coat", "parka"],
+        "dress": ["dress"], "skirt": ["skirt"], "trousers": ["trousers", "joggers", "chinos", "leggings"],
+        "jeans": ["jeans"], "shorts": ["shorts"], "bra": ["bra", "bikini"], "briefs": ["briefs", "knickers", "boxer"],
+        "socks": ["socks", "tights"], "shoes": ["shoes", "trainers", "boots", "sandals", "sneakers"],
+        "bag": ["bag", "handbag", "backpack"], "hat": ["hat", "cap", "beanie"], "scarf": ["scarf"],
+        "swimwear": ["swimsuit", "swimwear"], "pyjamas": ["pyjamas", "pyjama", "nightdress"],
+    },
+    "gender": {
+        "women": ["women", "womens", "women's", "ladies", "maternity"],
+        "men": ["men", "mens", "men's"],
+        "kids": ["kids", "children", "child", "boys", "girls", "baby", "toddler"],
+    },
+}
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def extract_attributes(text: str) -> Dict[str, Set[str]]:
+    """Attribute values mentioned in a caption or query, e.g. {"color": {"black"}, "product_type": {"jumper"}}."""
+    tokens = set(tokenize(text))
+    found = {}
+    for attribute, values in ATTRIBUTES.items():
+        matched = {value for value, keywords in values.items() if tokens.intersection(keywords)}
+        if matched:
+            found[attribute] = matched
+    return found
+
+
+class BM25Index:
+    """
+    BM25 over the captions, stored as a CSR term -> postings matrix.
+
+    Scoring a query touches only the postings of its terms and accumulates
+    scores into one dense array with numpy.
+    """
+    def __init__(self, vocabulary: Dict[str, int], indptr: np.ndarray, doc_ids: np.ndarray,
+                 term_freqs: np.ndarray, doc_lengths: np.ndarray):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.n_docs = len(doc_lengths)
+        self.avg_length = float(doc_lengths.mean()) if self.n_docs else 0.0
+
+        doc_freqs = np.diff(indptr).astype("float32")
+        self.idf = np.log1p((self.n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype("float32")
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "BM25Index":
+        vocabulary: Dict[str, int] = {}
+        postings: List[Dict[int, int]] = []
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for token in tokens:
+                term_id = vocabulary.setdefault(token, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append({})
+                postings[term_id][doc_id] = postings[term_id].get(doc_id, 0) + 1
+
+        indptr = np.zeros(len(postings) + 1, dtype="int64")
+        indptr[1:] = np.cumsum([len(p) for p in postings])
+        doc_ids = np.fromiter((d for p in postings for d in p), dtype="int32", count=int(indptr[-1]))
+        term_freqs = np.fromiter((f for p in postings for f in p.values()), dtype="float32", count=int(indptr[-1]))
+        return cls(vocabulary, indptr, doc_ids, term_freqs, np.asarray(doc_lengths, dtype="float32"))
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.n_docs, dtype="float32")
+        for token in set(tokenize(query)):
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs, tf = self.doc_ids[start:end], self.term_freqs[start:end]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docs] / self.avg_length)
+            scores[docs] += self.idf[term_id] * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> List[int]:
+        """Positions of the top-k documents (only those with a positive score, and inside `mask` if given)."""
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0.0
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")].tolist()
+
+    def save(self, path: str) -> None:
+        np.savez(os.path.join(path, "bm25.npz"), indptr=self.indptr, doc_ids=self.doc_ids,
+                 term_freqs=self.term_freqs, doc_lengths=self.doc_lengths)
+        with open(os.path.join(path, "vocabulary.json"), "w", encoding="utf-8") as f:
+            json.dump(self.vocabulary, f)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(os.path.join(path, "bm25.npz")) as data:
+            arrays = {name: data[name] for name in ("indptr", "doc_ids", "term_freqs", "doc_lengths")}
+        with open(os.path.join(path, "vocabulary.json"), "r", encoding="utf-8") as f:
+            vocabulary = json.load(f)
+        return cls(vocabulary, **arrays)
+
+
+class AttributeBitmaps:
+    """One packed bitmap over index positions per attribute value, precomputed from the captions."""
+    def __init__(self, n_docs: int, bitmaps: Dict[str, np.ndarray]):
+        self.n_docs = n_docs
+        self.bitmaps = bitmaps  # "color=black" -> packed bits
+
+    @classmethod
+    def build(cls, texts: Sequence[str]) -> "AttributeBitmaps":
+        masks: Dict[str, np.ndarray] = {}
+        for position, text in enumerate(texts):
+            for attribute, values in extract_attributes(text).items():
+                for value in values:
+                    key = f"{attribute}={value}"
+                    if key not in masks:
+                        masks[key] = np.zeros(len(texts), dtype=bool)
+                    masks[key][position] = True
+        return cls(len(texts), {key: np.packbits(mask) for key, mask in masks.items()})
+
+    def mask(self, filters: Dict[str, Iterable[str]]) -> np.ndarray:
+        """
+        Boolean mask of positions matching the filters.
+
+        Values of one attribute are OR-ed, attributes are AND-ed:
+        {"color": ["black", "grey"], "product_type": ["jumper"]}.
+        """
+        result = np.ones(self.n_docs, dtype=bool)
+        for attribute, values in filters.items():
+            packed = None
+            for value in values:
+                bits = self.bitmaps.get(f"{attribute}={value}")
+                if bits is not None:
+                    packed = bits if packed is None else packed | bits
+            if packed is None:
+                return np.zeros(self.n_docs, dtype=bool)
+            result &= np.unpackbits(packed, count=self.n_docs).astype(bool)
+        return result
+
+    def counts(self) -> Dict[str, int]:
+        return {key: int(np.unpackbits(bits, count=self.n_docs).sum()) for key, bits in self.bitmaps.items()}
+
+    def save(self, path: str) -> None:
+        np.savez(os.path.join(path, "attributes.npz"), n_docs=np.asarray(self.n_docs), **self.bitmaps)
+
+    @classmethod
+    def load(cls, path: str) -> "AttributeBitmaps":
+        with np.load(os.path.join(path, "attributes.npz")) as data:
+            n_docs = int(data["n_docs"])
+            bitmaps = {key: data[key] for key in data.files if key != "n_docs"}
+        return cls(n_docs, bitmaps)
+
+
+def build_hybrid_index(store_path: str, texts: Sequence[str]) -> None:
+    """Build the BM25 index and attribute bitmaps next to the vector index (positions match the faiss index)."""
+    path = os.path.join(store_path, HYBRID_DIR)
+    os.makedirs(path, exist_ok=True)
+    BM25Index.build(texts).save(path)
+    AttributeBitmaps.build(texts).save(path)
+
+
+def has_hybrid_index(store_path: str) -> bool:
+    return os.path.exists(os.path.join(store_path, HYBRID_DIR, "bm25.npz"))
+
+
+class HybridRetriever:
+    """
+    Dense + BM25 retrieval fused with reciprocal rank fusion, with optional attribute pre-filtering.
+
+    Filters are applied inside both searches (a faiss ID selector for the
+    dense side, a mask on the BM25 scores), so every returned candidate
+    already satisfies the hard constraints.
+    """
+    def __init__(self, vector_manager, vs, store_path: str, dense_weight: float = 1.0, lexical_weight: float = 1.0):
+        path = os.path.join(store_path, HYBRID_DIR)
+        self.vector_manager = vector_manager
+        self.vs = vs
+        self.bm25 = BM25Index.load(path)
+        self.attributes = AttributeBitmaps.load(path)
+        self.dense_weight = dense_weight
+        self.lexical_weight = lexical_weight
+
+    def _items(self, positions: Sequence[int]) -> List[Dict]:
+        return [
+            {"id": doc.metadata.get("image_index", "N/A"), "content": doc.page_content}
+            for doc in self.vector_manager.documents_at(self.vs, positions)
+        ]
+
+    def _mask(self, filters: Optional[Dict[str, Iterable[str]]]) -> Optional[np.ndarray]:
+        mask = self.attributes.mask(filters) if filters else None
+        if hasattr(self.vs, "combine_mask"):
+            mask = self.vs.combine_mask(mask)
+        return mask
+
+    def _fuse(self, query: str, dense_positions: Sequence[int], k: int, mask: Optional[np.ndarray]) -> List[Dict]:
+        with telemetry.span("bm25_search", k=k):
+            lexical_positions = self.bm25.search(query, k, mask=mask)
+
+        fused = reciprocal_rank_fusion(
+            [self._items(dense_positions), self._items(lexical_positions)],
+            weights=[self.dense_weight, self.lexical_weight],
+        )
+        return fused[:k]
+
+    def search(self, query: str, k: int = 30, filters: Optional[Dict[str, Iterable[str]]] = None,
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Dict]:
+        mask = self._mask(filters)
+        if mask is not None and not mask.any():
+            return []
+
+        query_vector = np.asarray([self.vector_manager.embeddings.embed_query(query)], dtype="float32")
+        with telemetry.span("dense_search", k=k):
+            _, dense_positions = ann_index.search(self.vs.index, query_vector, k, nprobe=nprobe,
+                                                  ef_search=ef_search, mask=mask)
+        return self._fuse(query, dense_positions[0], k, mask)
+
+    def search_many(self, queries: Sequence[str], query_vectors: np.ndarray, k: int = 30,
+                    filters: Optional[Sequence[Optional[Dict[str, Iterable[str]]]]] = None,
+                    nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[List[Dict]]:
+        """
+        Batched `search` over precomputed query vectors.
+
+        Queries sharing the same filters go through one faiss call; BM25 and
+        fusion still run per query.
+        """
+        filters = filters or [None] * len(queries)
+        groups: Dict[str, List[int]] = {}
+        for i, query_filters in enumerate(filters):
+            # Filters may hold sets (see extract_attributes), so sort the values into a stable key
+            key = json.dumps({a: sorted(v) for a, v in query_filters.items()} if query_filters else None,
+                             sort_keys=True)
+            groups.setdefault(key, []).append(i)
+
+        results: List[List[Dict]] = [[] for _ in queries]
+        for rows in groups.values():
+            mask = self._mask(filters[rows[0]])
+            if mask is not None and not mask.any():
+                continue
+            with telemetry.span("dense_search", k=k, batch=len(rows)):
+                _, dense_positions = ann_index.search(self.vs.index, query_vectors[rows], k, nprobe=nprobe,
+                                                      ef_search=ef_search, mask=mask)
+            for row, positions in zip(rows, dense_positions):
+                results[row] = self._fuse(queries[row], positions, k, mask)
+        return results
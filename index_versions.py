@@ -0,0 +1,457 @@
+"""
+Versioned vector store snapshots with incremental add / update / delete.
+
+Layout under a store root (e.g. `vector_store/`):
+
+    CURRENT               name of the live version, replaced atomically
+    PUBLISHED             when each version was published (JSON), for pruning
+    versions/v000001/     a complete memory-mapped store (see mmap_store)
+    versions/v000002/     ...
+
+A root without CURRENT is read as a single, unversioned store, so stores
+built before versioning keep working and become the base of the first
+update. Deleted or superseded items are tombstoned rather than removed
+from the faiss index; `compact` rebuilds a version without them.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import json
+import os
+import shutil
+import threading
+import time
+
+import faiss
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import ann_index
+import diversity
+import mmap_store
+from hybrid_retriever import build_hybrid_index
+
+CURRENT_FILE = "CURRENT"
+PUBLISHED_FILE = "PUBLISHED"
+VERSIONS_DIR = "versions"
+LOCK_FILE = ".update.lock"
+
+# Superseded versions stay on disk this long, for processes still reading them
+PRUNE_GRACE_SECONDS = 600
+# Without flock, a lock file older than this is taken to be left by a crashed writer
+STALE_LOCK_SECONDS = 3600
+
+# Compact automatically once this fraction of the index is tombstoned
+COMPACT_RATIO = 0.2
+
+_current_cache: Dict[str, Tuple[float, str]] = {}
+
+
+def read_current(root: str) -> Optional[str]:
+    """Name of the live version under `root`, read from CURRENT itself rather than the cache; None if unversioned."""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def resolve_store_path(root: str) -> str:
+    """Directory of the live version under `root` (or `root` itself for unversioned stores)."""
+    current_path = os.path.join(root, CURRENT_FILE)
+    try:
+        mtime = os.stat(current_path).st_mtime
+    except FileNotFoundError:
+        return root
+
+    cached = _current_cache.get(root)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(current_path, "r", encoding="utf-8") as f:
+        resolved = os.path.join(root, VERSIONS_DIR, f.read().strip())
+    _current_cache[root] = (mtime, resolved)
+    return resolved
+
+
+def list_versions(root: str) -> List[str]:
+    versions_dir = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(versions_dir):
+        return []
+    return sorted(name for name in os.listdir(versions_dir) if name.startswith("v"))
+
+
+class _UpdateLock:
+    """
+    Cross-process writer lock on a store root.
+
+    Where flock is available the lock is held on the open lock file, so the
+    kernel releases it if the writer crashes. Elsewhere the lock file is
+    created exclusively, and one older than `stale_after` seconds is broken.
+    Either way the file records the owner's pid and start time.
+    """
+    def __init__(self, root: str, timeout: float = 600.0, stale_after: float = STALE_LOCK_SECONDS):
+        self.path = os.path.join(root, LOCK_FILE)
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self._fd: Optional[int] = None
+
+    def _owner(self) -> bytes:
+        return json.dumps({"pid": os.getpid(), "since": time.time()}).encode("utf-8")
+
+    def _try_acquire(self) -> bool:
+        if fcntl is not None:
+            fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            os.ftruncate(fd, 0)
+            os.write(fd, self._owner())
+            self._fd = fd
+            return True
+
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            self._break_if_stale()
+            return False
+        try:
+            os.write(fd, self._owner())
+        finally:
+            os.close(fd)
+        return True
+
+    def _break_if_stale(self) -> None:
+        try:
+            age = time.time() - os.stat(self.path).st_mtime
+            if age > self.stale_after:
+                print(f"Breaking stale lock {self.path} ({age:.0f}s old)")
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while not self._try_acquire():
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Another update holds {self.path}")
+            time.sleep(0.1)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            # Closing releases the flock; the file stays for the next writer
+            os.close(self._fd)
+            self._fd = None
+        else:
+            os.remove(self.path)
+
+
+class VersionedStore:
+    """
+    Applies incremental changes to a store root and publishes each result as a new version.
+
+    Only new or changed captions are embedded. Every published version is
+    immutable, and switching versions is a single atomic rename of CURRENT,
+    so running app processes pick up the new version on their next request
+    (see ResourceRegistry.vector_store) without a restart.
+    """
+    def __init__(self, root: str, embeddings, keep_versions: int = 3, prune_grace: float = PRUNE_GRACE_SECONDS):
+        self.root = root
+        self.embeddings = embeddings
+        self.keep_versions = keep_versions
+        self.prune_grace = prune_grace
+        self._compaction: Optional[threading.Thread] = None
+
+    # -------- Reading the live version --------
+    def _load_live(self) -> Dict:
+        # Not resolve_store_path: two publishes within one mtime tick would leave its cache stale
+        version = read_current(self.root)
+        path = os.path.join(self.root, VERSIONS_DIR, version) if version else self.root
+        if not mmap_store.is_mmap_store(path):
+            raise FileNotFoundError(f"{path} has no memory-mapped store; rebuild it or run mmap_store.py first")
+
+        vectors_path = os.path.join(path, mmap_store.VECTORS_FILE)
+        if not os.path.exists(vectors_path):
+            raise FileNotFoundError(f"{vectors_path} is missing; rebuild the store to enable incremental updates")
+
+        blobs = mmap_store.PackedBlobs(path, mmap_store.CAPTIONS)
+        try:
+            texts = [blobs[i].decode("utf-8") for i in range(len(blobs))]
+        finally:
+            blobs.close()
+
+        tombstones_path = os.path.join(path, mmap_store.TOMBSTONES_FILE)
+        return {
+            "version": version,
+            "path": path,
+            "index": faiss.read_index(os.path.join(path, mmap_store.INDEX_FILE)),
+            "vectors": np.load(vectors_path),
+            "texts": texts,
+            "ids": np.load(os.path.join(path, mmap_store.IMAGE_INDEX_FILE)),
+            "tombstones": set(np.load(tombstones_path).tolist()) if os.path.exists(tombstones_path) else set(),
+            "clusters": diversity.load_clusters(path),
+            "params": ann_index.load_index_params(path),
+        }
+
+    @staticmethod
+    def _live_positions(live: Dict) -> Dict[int, int]:
+        """image_index -> position of its live (non-tombstoned) row."""
+        return {int(image_index): position for position, image_index in enumerate(live["ids"])
+                if position not in live["tombstones"]}
+
+    # -------- Writing versions --------
+    def _next_version(self) -> str:
+        versions = list_versions(self.root)
+        number = int(versions[-1][1:]) + 1 if versions else 1
+        return f"v{number:06d}"
+
+    def _write_version(self, index: faiss.Index, vectors: np.ndarray, texts: List[str], ids: Sequence[int],
+                       tombstones: Iterable[int], params: Dict, clusters: Optional[np.ndarray] = None,
+                       base: Optional[str] = None) -> str:
+        version = self._next_version()
+        tmp_path = os.path.join(self.root, VERSIONS_DIR, f".{version}.tmp")
+        os.makedirs(tmp_path, exist_ok=True)
+
+        faiss.write_index(index, os.path.join(tmp_path, mmap_store.INDEX_FILE))
+        mmap_store.write_array(tmp_path, mmap_store.VECTORS_FILE, np.asarray(vectors, dtype="float32"))
+        mmap_store.write_metadata(tmp_path, texts, ids)
+        mmap_store.write_array(tmp_path, mmap_store.TOMBSTONES_FILE, np.asarray(sorted(tombstones), dtype="int64"))
+        ann_index.save_index_params(tmp_path, params)
+        build_hybrid_index(tmp_path, texts)
+        if clusters is not None:
+            diversity.write_clusters(tmp_path, clusters)
+        with open(os.path.join(tmp_path, "version.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": version, "base": base, "created": time.time(), "vectors": len(texts),
+                       "tombstones": len(set(tombstones))}, f, indent=2)
+
+        os.replace(tmp_path, os.path.join(self.root, VERSIONS_DIR, version))
+        return version
+
+    def _published(self) -> Dict[str, float]:
+        """version -> when it was published."""
+        try:
+            with open(os.path.join(self.root, PUBLISHED_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_published(self, published: Dict[str, float]) -> None:
+        tmp_path = os.path.join(self.root, PUBLISHED_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(published, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, os.path.join(self.root, PUBLISHED_FILE))
+
+    def _base_of(self, version: str) -> Optional[str]:
+        """The version `version` was built from; missing for versions written before this was recorded."""
+        with open(os.path.join(self.root, VERSIONS_DIR, version, "version.json"), "r", encoding="utf-8") as f:
+            return json.load(f).get("base", read_current(self.root))
+
+    def publish(self, version: str) -> None:
+        """
+        Atomically make `version` the live one.
+
+        Raises:
+            ValueError: If another version was published after `version` was
+                built from the live one; publishing it would undo that update
+        """
+        with _UpdateLock(self.root):
+            base, live = self._base_of(version), read_current(self.root)
+            if base != live:
+                raise ValueError(f"{version} was built from {base or 'the unversioned store'} but {live} is live "
+                                 "now; apply the changes again")
+            self._publish_locked(version)
+
+    def _publish_locked(self, version: str) -> None:
+        """publish() for callers already holding the update lock (it isn't reentrant)."""
+        tmp_current = os.path.join(self.root, CURRENT_FILE + ".tmp")
+        with open(tmp_current, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_current, os.path.join(self.root, CURRENT_FILE))
+        self._write_published({**self._published(), version: time.time()})
+        print(f"Published {version} in {self.root}")
+        self._prune()
+
+    def _prune(self) -> None:
+        """
+        Delete versions beyond the newest `keep_versions` once they've been superseded for `prune_grace` seconds.
+
+        Other processes may still be reading a superseded version (its
+        hybrid index and clusters are loaded lazily), so it is only removed
+        after the grace period, and never while it's live. Versions whose
+        successor was published before PUBLISHED existed are left alone.
+        """
+        live = read_current(self.root)
+        published = self._published()
+        now = time.time()
+        for version in list_versions(self.root)[:-self.keep_versions]:
+            if version == live:
+                continue
+            superseded = min((when for name, when in published.items() if name > version), default=None)
+            if superseded is None or now - superseded < self.prune_grace:
+                continue
+            shutil.rmtree(os.path.join(self.root, VERSIONS_DIR, version), ignore_errors=True)
+            published.pop(version, None)
+        self._write_published(published)
+
+    # -------- Updates --------
+    def apply(self, upserts: Optional[Dict[int, str]] = None, deletes: Iterable[int] = (),
+              publish: bool = True) -> Optional[str]:
+        """
+        Add, update and delete items in one new version.
+
+        The update is read, written and published under one update lock, so
+        concurrent writers and compaction can't publish over each other.
+
+        Args:
+            upserts (Dict[int, str]): image_index -> caption; unchanged captions are skipped
+            deletes (Iterable[int]): image_indexes to remove
+            publish (bool): Make the new version live right away
+
+        Returns:
+            Optional[str]: The new version name, or None if nothing changed
+        """
+        upserts = upserts or {}
+        with _UpdateLock(self.root):
+            live = self._load_live()
+            positions = self._live_positions(live)
+            tombstones = set(live["tombstones"])
+
+            changed = {image_index: text for image_index, text in upserts.items()
+                       if image_index not in positions or live["texts"][positions[image_index]] != text}
+            removed = [image_index for image_index in deletes if image_index in positions]
+            if not changed and not removed:
+                print("No changes to apply")
+                return None
+
+            # Superseded and deleted rows are tombstoned, not removed from the index
+            for image_index in list(changed) + removed:
+                if image_index in positions:
+                    tombstones.add(positions[image_index])
+
+            index, vectors, clusters = live["index"], live["vectors"], live["clusters"]
+            texts, ids = list(live["texts"]), list(live["ids"])
+            if changed:
+                new_vectors = np.asarray(self.embeddings.embed_documents(list(changed.values())), dtype="float32")
+                index.add(new_vectors)
+                vectors = np.concatenate([vectors, new_vectors])
+                texts.extend(changed.values())
+                ids.extend(changed.keys())
+                if clusters is not None:
+                    # Only the new rows are searched; existing clusters are kept
+                    clusters = diversity.build_duplicate_clusters(index, vectors, clusters=np.asarray(clusters))
+
+            version = self._write_version(index, vectors, texts, ids, tombstones, live["params"], clusters,
+                                          base=live["version"])
+            print(f"{version}: embedded {len(changed)} items, tombstoned {len(tombstones) - len(live['tombstones'])}")
+            if publish:
+                self._publish_locked(version)
+
+        if publish and len(tombstones) > COMPACT_RATIO * len(texts):
+            self.compact(background=True)
+        return version
+
+    def upsert(self, items: Dict[int, str], publish: bool = True) -> Optional[str]:
+        return self.apply(upserts=items, publish=publish)
+
+    def delete(self, image_indexes: Iterable[int], publish: bool = True) -> Optional[str]:
+        return self.apply(deletes=image_indexes, publish=publish)
+
+    def recluster(self, threshold: float = diversity.DUPLICATE_THRESHOLD,
+                  neighbours: int = diversity.DUPLICATE_NEIGHBOURS) -> str:
+        """Publish the live version again with freshly built near-duplicate clusters (see diversity)."""
+        with _UpdateLock(self.root):
+            live = self._load_live()
+            clusters = diversity.build_duplicate_clusters(live["index"], live["vectors"], threshold=threshold,
+                                                          neighbours=neighbours)
+            version = self._write_version(live["index"], live["vectors"], live["texts"], live["ids"],
+                                          live["tombstones"], live["params"], clusters, base=live["version"])
+            self._publish_locked(version)
+        return version
+
+    # -------- Compaction --------
+    def _compact(self, attempts: int = 3) -> Optional[str]:
+        """
+        Rebuild the live version without its tombstones.
+
+        The rebuild runs outside the update lock so upserts aren't held up
+        behind it. If one is published meanwhile, the rebuilt version would
+        drop it, so it is discarded and the compaction starts again from the
+        new live version, up to `attempts` times.
+        """
+        for _ in range(attempts):
+            with _UpdateLock(self.root):
+                live = self._load_live()
+            if not live["tombstones"]:
+                return None
+
+            keep = np.ones(len(live["ids"]), dtype=bool)
+            keep[sorted(live["tombstones"])] = False
+            vectors = live["vectors"][keep]
+            texts = [text for text, kept in zip(live["texts"], keep) if kept]
+            ids = live["ids"][keep]
+
+            params = live["params"]
+            index = ann_index.rebuild_faiss_index(vectors, params)
+            clusters = diversity.build_duplicate_clusters(index, vectors)
+
+            with _UpdateLock(self.root):
+                current = read_current(self.root)
+                if current != live["version"]:
+                    print(f"{current} was published during compaction of {live['version']}; compacting again")
+                    continue
+                version = self._write_version(index, vectors, texts, ids, (), params, clusters, base=current)
+                print(f"{version}: compacted away {len(live['tombstones'])} tombstones")
+                self._publish_locked(version)
+                return version
+
+        print(f"Gave up compacting {self.root} after {attempts} attempts; updates kept landing first")
+        return None
+
+    def wait_for_compaction(self, timeout: Optional[float] = None) -> None:
+        if self._compaction is not None:
+            self._compaction.join(timeout)
+
+    def compact(self, background: bool = True) -> Optional[str]:
+        """Rebuild the live version without its tombstoned rows, on a background thread by default."""
+        if not background:
+            return self._compact()
+        if self._compaction is not None and self._compaction.is_alive():
+            return None
+        self._compaction = threading.Thread(target=self._compact, name="index-compaction", daemon=True)
+        self._compaction.start()
+        return None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Incrementally update a versioned vector store.")
+    parser.add_argument("--root", default="vector_store")
+    parser.add_argument("--upsert", help="JSONL file of {\"image_index\", \"text\"} rows to add or update")
+    parser.add_argument("--delete", type=int, nargs="*", default=[], help="image_indexes to delete")
+    parser.add_argument("--compact", action="store_true", help="Compact tombstones after applying changes")
+    parser.add_argument("--prune-grace", type=float, default=PRUNE_GRACE_SECONDS,
+                        help="Seconds a superseded version is kept for processes still reading it")
+    args = parser.parse_args()
+
+    from resources import get_registry
+
+    upserts = {}
+    if args.upsert:
+        with open(args.upsert, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    upserts[int(row["image_index"])] = row["text"]
+
+    store = VersionedStore(args.root, get_registry().embeddings(), prune_grace=args.prune_grace)
+    store.apply(upserts=upserts, deletes=args.delete)
+    if args.compact:
+        store.wait_for_compaction()
+        store.compact(background=False)
+    else:
+        store.wait_for_compaction()
@@ -0,0 +1,231 @@
+import faiss
+import numpy as np
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence
+import argparse
+import mmap
+import os
+
+import ann_index
+
+INDEX_FILE = "index.faiss"
+CAPTIONS = "captions"
+CAPTIONS_FILE = "captions.bin"
+OFFSETS_FILE = "captions.offsets.npy"
+IMAGE_INDEX_FILE = "image_index.npy"
+TOMBSTONES_FILE = "tombstones.npy"
+VECTORS_FILE = "vectors.npy"
+CLUSTERS_FILE = "clusters.npy"
+
+# Map the index read-only: IVF lists and flat codes stay in the page cache,
+# shared by every process that opens the same file. Newer faiss maps through
+# IO_FLAG_MMAP_IFC; combined with IO_FLAG_MMAP it fails on IVF indexes.
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+@dataclass
+class CatalogDocument:
+    """Lightweight stand-in for a langchain Document (same `page_content` / `metadata` attributes)."""
+    page_content: str
+    metadata: Dict = field(default_factory=dict)
+
+
+def is_mmap_store(path: str) -> bool:
+    return all(os.path.exists(os.path.join(path, name))
+               for name in (INDEX_FILE, CAPTIONS_FILE, OFFSETS_FILE, IMAGE_INDEX_FILE))
+
+
+def write_packed(path: str, name: str, blobs: Iterable[bytes]) -> int:
+    """
+    Write byte blobs back to back into `<name>.bin`, with their n+1 offsets in `<name>.offsets.npy`.
+
+    Files are written under temporary names and swapped in atomically. Returns the number of blobs.
+    """
+    offsets = [0]
+    with open(os.path.join(path, f"{name}.bin.tmp"), "wb") as f:
+        for blob in blobs:
+            f.write(blob)
+            offsets.append(offsets[-1] + len(blob))
+    with open(os.path.join(path, f"{name}.offsets.npy.tmp"), "wb") as f:
+        np.save(f, np.asarray(offsets, dtype="uint64"))
+
+    for suffix in (".bin", ".offsets.npy"):
+        os.replace(os.path.join(path, f"{name}{suffix}.tmp"), os.path.join(path, f"{name}{suffix}"))
+    return len(offsets) - 1
+
+
+def write_ids(path: str, image_indexes: Sequence[int]) -> None:
+    write_array(path, IMAGE_INDEX_FILE, np.asarray(image_indexes, dtype="int64"))
+
+
+def write_array(path: str, name: str, array: np.ndarray) -> None:
+    """Atomically write a .npy file."""
+    with open(os.path.join(path, name + ".tmp"), "wb") as f:
+        np.save(f, array)
+    os.replace(os.path.join(path, name + ".tmp"), os.path.join(path, name))
+
+
+def write_metadata(path: str, texts: Sequence[str], image_indexes: Sequence[int]) -> None:
+    """
+    Write captions and image indexes in the offset-indexed layout read by MmapVectorStore.
+
+    captions.bin holds the UTF-8 captions back to back, captions.offsets.npy the
+    n+1 byte offsets into it, and image_index.npy the dataset row of each vector.
+    """
+    if len(texts) != len(image_indexes):
+        raise ValueError("texts and image_indexes must have the same length")
+    write_packed(path, CAPTIONS, (text.encode("utf-8") for text in texts))
+    write_ids(path, image_indexes)
+
+
+class PackedBlobs:
+    """Read-only, memory-mapped view of a file written by `write_packed`."""
+    def __init__(self, path: str, name: str):
+        self.offsets = np.load(os.path.join(path, f"{name}.offsets.npy"), mmap_mode="r")
+        self._file = open(os.path.join(path, f"{name}.bin"), "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position: int) -> bytes:
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        return bytes(self._data[start:end])
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+class IdLookup:
+    """Vectorized image_index -> position lookup over a (possibly memory-mapped) id column."""
+    def __init__(self, image_indexes: np.ndarray):
+        self.image_indexes = image_indexes
+        self._sorted = None
+
+    def positions_of(self, image_indexes: Sequence[int]) -> np.ndarray:
+        """Positions of the given image indexes (-1 when unknown)."""
+        if self._sorted is None:
+            order = np.argsort(self.image_indexes, kind="stable")
+            self._sorted = (np.asarray(self.image_indexes)[order], order)
+        sorted_ids, order = self._sorted
+
+        wanted = np.asarray(image_indexes, dtype="int64")
+        if not len(sorted_ids):
+            return np.full(len(wanted), -1, dtype="int64")
+        found = np.searchsorted(sorted_ids, wanted).clip(max=len(sorted_ids) - 1)
+        return np.where(sorted_ids[found] == wanted, order[found], -1)
+
+
+class MmapVectorStore:
+    """
+    Read-only vector store over a memory-mapped faiss index and offset-indexed captions.
+
+    Nothing is unpickled and nothing is copied at load time: the index, the
+    offsets and the captions are all mapped from disk, and a caption is only
+    decoded when a search returns it.
+
+    Positions listed in tombstones.npy (deleted or superseded items, see
+    index_versions) are excluded from every search and lookup.
+    """
+    def __init__(self, path: str, embeddings=None):
+        if not is_mmap_store(path):
+            raise FileNotFoundError(f"No memory-mapped vector store found in {path}")
+
+        self.path = path
+        self.embeddings = embeddings
+        self.index = faiss.read_index(os.path.join(path, INDEX_FILE), MMAP_FLAGS)
+        self.image_indexes = np.load(os.path.join(path, IMAGE_INDEX_FILE), mmap_mode="r")
+        self._captions = PackedBlobs(path, CAPTIONS)
+
+        self.tombstones = np.zeros(0, dtype="int64")
+        if os.path.exists(os.path.join(path, TOMBSTONES_FILE)):
+            self.tombstones = np.load(os.path.join(path, TOMBSTONES_FILE))
+        self.live_mask = None
+        if len(self.tombstones):
+            self.live_mask = np.ones(len(self.image_indexes), dtype=bool)
+            self.live_mask[self.tombstones] = False
+            live_ids = np.where(self.live_mask, self.image_indexes, -1)
+            self._lookup = IdLookup(live_ids)
+        else:
+            self._lookup = IdLookup(self.image_indexes)
+
+        params = ann_index.load_index_params(path)
+        ann_index.set_search_params(self.index, nprobe=params.get("nprobe"), ef_search=params.get("ef_search"))
+
+        if self.index.ntotal != len(self.image_indexes):
+            raise ValueError(f"Index has {self.index.ntotal} vectors but metadata has {len(self.image_indexes)} rows")
+
+    def __len__(self) -> int:
+        return int(self.index.ntotal)
+
+    def close(self) -> None:
+        self._captions.close()
+
+    # -------- Lazy metadata access --------
+    def caption_at(self, position: int) -> str:
+        return self._captions[position].decode("utf-8")
+
+    def document_at(self, position: int) -> CatalogDocument:
+        return CatalogDocument(
+            page_content=self.caption_at(position),
+            metadata={"image_index": int(self.image_indexes[position])},
+        )
+
+    def positions_of(self, image_indexes: Sequence[int]) -> np.ndarray:
+        """Vector positions of the given image indexes (-1 when unknown)."""
+        return self._lookup.positions_of(image_indexes)
+
+    def get_by_image_index(self, image_indexes: Sequence[int]) -> List[Optional[CatalogDocument]]:
+        return [self.document_at(int(p)) if p >= 0 else None for p in self.positions_of(image_indexes)]
+
+    # -------- Search --------
+    def combine_mask(self, mask: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """AND a caller's position mask with the live (non-tombstoned) mask."""
+        if self.live_mask is None:
+            return mask
+        return self.live_mask if mask is None else (mask & self.live_mask)
+
+    def similarity_search_by_vector(self, embedding: Sequence[float], k: int = 4, nprobe: Optional[int] = None,
+                                    ef_search: Optional[int] = None) -> List[CatalogDocument]:
+        _, ids = ann_index.search(self.index, np.asarray(embedding, dtype="float32"), k,
+                                  nprobe=nprobe, ef_search=ef_search, mask=self.live_mask)
+        return [self.document_at(int(i)) for i in ids[0] if i != -1]
+
+    def similarity_search(self, query: str, k: int = 4, nprobe: Optional[int] = None,
+                          ef_search: Optional[int] = None) -> List[CatalogDocument]:
+        if self.embeddings is None:
+            raise ValueError("An embedding model is required for text queries")
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k=k,
+                                                nprobe=nprobe, ef_search=ef_search)
+
+
+def export_vector_store(vs, path: str) -> None:
+    """Write the memory-mapped layout next to a langchain FAISS store (offline, one-time unpickle)."""
+    os.makedirs(path, exist_ok=True)
+    faiss.write_index(vs.index, os.path.join(path, INDEX_FILE))
+
+    texts, image_indexes = [], []
+    for position in range(vs.index.ntotal):
+        doc = vs.docstore.search(vs.index_to_docstore_id[position])
+        texts.append(doc.page_content)
+        image_indexes.append(doc.metadata.get("image_index", position))
+    write_metadata(path, texts, image_indexes)
+
+    from hybrid_retriever import build_hybrid_index
+    build_hybrid_index(path, texts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a pickled langchain FAISS store to the memory-mapped layout.")
+    parser.add_argument("--path", default="vector_store")
+    args = parser.parse_args()
+
+    from bulid_vec_db import VectorStoreManager
+
+    manager = VectorStoreManager()
+    export_vector_store(manager.load_vector_store(args.path), args.path)
+    print(f"Memory-mapped vector store written to {args.path}")
@@ -0,0 +1,238 @@
+"""
+ONNX Runtime backend for the bge query encoder, optionally int8-quantized.
+
+The encoder is exported once from the torch model (needs torch and
+transformers); at runtime only onnxruntime and the `tokenizers` library
+are loaded, which keeps per-query latency and per-worker memory down on
+CPU-only hosts. Needs `onnx` and `onnxruntime` (pinned in requirements.txt).
+
+    python onnx_embeddings.py --quantize            # export + verify against torch
+    EMBEDDING_BACKEND=onnx-int8 streamlit run app.py
+
+Every export is checked against the torch reference (CLS pooling +
+L2 normalization, as sentence-transformers does for bge): the minimum cosine
+similarity over a sample of captions must stay above COSINE_TOLERANCE, so
+indexes built with the torch model remain valid. Export and verification
+only happen in the CLI; at runtime a graph without a passing verification
+is refused, so the app never loads torch for this backend.
+"""
+from typing import Dict, List, Optional, Sequence
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+ONNX_DIR = os.path.join(".cache", "onnx")
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model.int8.onnx"
+VERIFICATION_FILE = "verification.json"
+COSINE_TOLERANCE = 0.99
+MAX_LENGTH = 512
+# Threads per ONNX session (0: let onnxruntime decide)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+
+SAMPLE_TEXTS = [
+    "black wool jumper for men",
+    "Relaxed-fit denim jacket with a classic collar, button front and chest pockets.",
+    "summer dress for a beach wedding",
+    "High-waisted leggings in soft, stretchy jersey with a wide waistband.",
+    "something warm and cosy for winter walks",
+    "Slim-fit shirt in woven cotton with a turn-down collar and buttoned cuffs.",
+    "red sneakers",
+    "Short, fitted top in ribbed jersey with narrow shoulder straps.",
+]
+
+
+def model_dir(model_name: str, root: str = ONNX_DIR) -> str:
+    return os.path.join(root, model_name.replace("/", "__"))
+
+
+def export_onnx(model_name: str, output_dir: str, quantize: bool = True, opset: int = 17) -> str:
+    """
+    Export the transformer encoder (last_hidden_state) to ONNX, plus its tokenizer.
+
+    Returns the path of the model to load: the int8 one when `quantize`.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(output_dir)
+
+    inputs = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in inputs]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    model_path = os.path.join(output_dir, MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(inputs[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+
+    if not quantize:
+        return model_path
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantized_path = os.path.join(output_dir, QUANTIZED_MODEL_FILE)
+    quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+    return quantized_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    bge embeddings computed with ONNX Runtime: CLS pooling, L2-normalized.
+
+    Args:
+        model_name (str): Hugging Face model the ONNX graph was exported from
+        quantize (bool): Use the dynamically int8-quantized graph
+        num_threads (int): intra-op threads for the session (0: onnxruntime default)
+        batch_size (int): Texts per session run in `embed_documents`
+        require_verified (bool): Refuse a graph whose comparison with torch is missing or failed
+    """
+    def __init__(self, model_name: str, quantize: bool = True, num_threads: int = EMBEDDING_THREADS,
+                 batch_size: int = 32, max_length: int = MAX_LENGTH, root: str = ONNX_DIR,
+                 require_verified: bool = True):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.directory = model_dir(model_name, root)
+        self.model_path = os.path.join(self.directory, QUANTIZED_MODEL_FILE if quantize else MODEL_FILE)
+
+        flag = " --quantize" if quantize else ""
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"{self.model_path} not found; run `python onnx_embeddings.py{flag}` first")
+        if require_verified and not self.verified():
+            raise RuntimeError(f"{self.model_path} has not passed verification against {model_name}; "
+                               f"run `python onnx_embeddings.py{flag}` (see {VERIFICATION_FILE})")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(self.model_path, sess_options=options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.directory, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+
+    def verified(self) -> bool:
+        path = os.path.join(self.directory, VERIFICATION_FILE)
+        if not os.path.exists(path):
+            return False
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get(os.path.basename(self.model_path), {}).get("passed", False)
+
+    def _encode(self, texts: Sequence[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(list(texts))
+        feeds = {
+            "input_ids": np.asarray([e.ids for e in encodings], dtype="int64"),
+            "attention_mask": np.asarray([e.attention_mask for e in encodings], dtype="int64"),
+            "token_type_ids": np.asarray([e.type_ids for e in encodings], dtype="int64"),
+        }
+        hidden = self.session.run(None, {name: feeds[name] for name in self.input_names})[0]
+        cls = hidden[:, 0]
+        return cls / (np.linalg.norm(cls, axis=1, keepdims=True) + 1e-12)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = [self._encode(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)]
+        return np.concatenate(vectors).tolist() if vectors else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+
+def verify_against_reference(embeddings: OnnxEmbeddings, model_name: str, texts: Sequence[str] = SAMPLE_TEXTS,
+                             tolerance: float = COSINE_TOLERANCE, reference: Optional[Embeddings] = None) -> Dict:
+    """
+    Compare ONNX vectors with the torch reference and record the result next to the graph.
+
+    Raises ValueError when any text's cosine similarity falls below `tolerance`.
+    """
+    if reference is None:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        reference = HuggingFaceEmbeddings(model_name=model_name)
+
+    expected = np.asarray(reference.embed_documents(list(texts)), dtype="float32")
+    actual = np.asarray(embeddings.embed_documents(list(texts)), dtype="float32")
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True) + 1e-12
+    cosines = np.sum(expected * actual, axis=1)
+
+    result = {
+        "min_cosine": round(float(cosines.min()), 6),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "tolerance": tolerance,
+        "passed": bool(cosines.min() >= tolerance),
+    }
+    path = os.path.join(embeddings.directory, VERIFICATION_FILE)
+    recorded = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            recorded = json.load(f)
+    recorded[os.path.basename(embeddings.model_path)] = result
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(recorded, f, indent=2)
+
+    if not result["passed"]:
+        raise ValueError(f"ONNX embeddings drift from {model_name}: min cosine {result['min_cosine']} < {tolerance}")
+    return result
+
+
+if __name__ == "__main__":
+    from resources import DEFAULT_EMBEDDING_MODEL
+
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX and check it against torch.")
+    parser.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL)
+    parser.add_argument("--quantize", action="store_true", help="Also write and verify a dynamic int8 graph")
+    parser.add_argument("--threads", type=int, default=EMBEDDING_THREADS)
+    parser.add_argument("--tolerance", type=float, default=COSINE_TOLERANCE)
+    parser.add_argument("--queries", type=int, default=200, help="Queries timed per backend")
+    parser.add_argument("--force", action="store_true", help="Re-export even when the graphs already exist")
+    args = parser.parse_args()
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    directory = model_dir(args.model)
+    wanted = [MODEL_FILE, QUANTIZED_MODEL_FILE] if args.quantize else [MODEL_FILE]
+    if args.force or not all(os.path.exists(os.path.join(directory, name)) for name in wanted):
+        export_onnx(args.model, directory, quantize=args.quantize)
+    else:
+        print(f"Using the existing export in {directory} (--force to re-export)")
+    reference = HuggingFaceEmbeddings(model_name=args.model)
+    queries = [f"{text} #{i}" for i in range(args.queries // len(SAMPLE_TEXTS) + 1) for text in SAMPLE_TEXTS]
+    queries = queries[:args.queries]
+
+    backends = {"torch": reference}
+    for quantize in ([False, True] if args.quantize else [False]):
+        onnx = OnnxEmbeddings(args.model, quantize=quantize, num_threads=args.threads, require_verified=False)
+        result = verify_against_reference(onnx, args.model, tolerance=args.tolerance, reference=reference)
+        name = "onnx-int8" if quantize else "onnx"
+        print(f"{name}: min cosine {result['min_cosine']}, mean {result['mean_cosine']}")
+        backends[name] = onnx
+
+    for name, backend in backends.items():
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            backend.embed_query(query)
+            latencies.append((time.perf_counter() - started) * 1000)
+        size = os.path.getsize(backend.model_path) / 2**20 if name != "torch" else float("nan")
+        print(f"{name:<10} p50 {np.percentile(latencies, 50):7.2f} ms  p99 {np.percentile(latencies, 99):7.2f} ms"
+              f"  model {size:7.1f} MB")
@@ -0,0 +1,422 @@
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import os
+import queue
+import threading
+import time
+
+from tenacity import stop_after_attempt, stop_after_delay
+
+import telemetry
+from ranking import reciprocal_rank_fusion
+from resources import get_registry
+
+# Per-request latency budget, in seconds
+PIPELINE_DEADLINE = float(os.getenv("PIPELINE_DEADLINE", "6.0"))
+PIPELINE_WORKERS = 16
+# Calls of each LLM stage (rephrase, LLM rerank) running at once, so abandoned ones can't take every worker
+LLM_STAGE_SLOTS = int(os.getenv("LLM_STAGE_SLOTS", "4"))
+
+# Weight of the rephrased-query ranking vs. the raw-query ranking when merging
+INTENT_WEIGHT = 2.0
+RAW_WEIGHT = 1.0
+
+
+@dataclass
+class PipelineResult:
+    """Recommendations plus a record of how they were produced."""
+    user_intent: str
+    recommendations: Dict[str, Any]
+    path: List[str] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict)
+    degraded: bool = False
+
+
+class _StageTimings:
+    """
+    Per-request stage durations, written from the worker threads.
+
+    Once the result is built the timings are frozen: a stage that outlived
+    its wait and finishes later no longer writes into what was returned.
+    """
+    def __init__(self):
+        self._values: Dict[str, float] = {}
+        self._frozen = False
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            if not self._frozen:
+                self._values[name] = round(seconds, 4)
+
+    def get(self, name: str, default: Optional[float] = None) -> Optional[float]:
+        with self._lock:
+            return self._values.get(name, default)
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._values
+
+    def freeze(self) -> Dict[str, float]:
+        """Stop recording and return a copy of the timings so far."""
+        with self._lock:
+            self._frozen = True
+            return dict(self._values)
+
+
+class _LatencyEstimate:
+    """Exponentially weighted moving average of a stage's latency, used to decide whether it fits the budget."""
+    def __init__(self, initial: float, alpha: float = 0.2):
+        self.value = initial
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    def update(self, seconds: float) -> None:
+        with self._lock:
+            self.value = (1 - self.alpha) * self.value + self.alpha * seconds
+
+
+class _StageSlots:
+    """
+    Caps how many calls of one stage run on the shared executor at once.
+
+    A call abandoned at the deadline can't be interrupted mid-request, so it
+    keeps its worker, and its slot, until the model answers. Requests that
+    find every slot taken skip the stage instead of queueing behind those
+    calls, and the remaining workers stay free for search and reranking.
+    """
+    def __init__(self, limit: int):
+        self._slots = threading.BoundedSemaphore(limit)
+
+    def submit(self, executor: ThreadPoolExecutor, fn: Callable, *args, **kwargs) -> Optional[Future]:
+        """`telemetry.submit` if a slot is free, else None."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            future = telemetry.submit(executor, fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+class _StreamedStage:
+    """
+    A streaming stage (a generator function) drained on the executor into a queue.
+
+    The consumer waits on the queue with the time left, so the deadline holds
+    even while the model is silent between pieces. The stage's span covers
+    the producer only, never the consumer's yields. Once the consumer stops
+    (deadline or `cancel`), the producer closes the stream at its next piece.
+    With no free slot in `slots` the stage is `skipped` and yields nothing.
+    """
+    _END = object()
+
+    def __init__(self, executor: ThreadPoolExecutor, slots: _StageSlots, name: str,
+                 stream_fn: Callable[..., Iterator], *args):
+        self.name = name
+        self.failed = False
+        self.expired = False
+        self._pieces: queue.Queue = queue.Queue()
+        self._stop = threading.Event()
+        self.skipped = slots.submit(executor, self._produce, stream_fn, *args) is None
+        if self.skipped:
+            self._pieces.put(self._END)
+
+    def _produce(self, stream_fn: Callable[..., Iterator], *args) -> None:
+        try:
+            with telemetry.span(self.name, stream=True):
+                stream = stream_fn(*args)
+                try:
+                    for piece in stream:
+                        if self._stop.is_set():
+                            break
+                        self._pieces.put(piece)
+                finally:
+                    stream.close()
+        except Exception as e:
+            print(f"Pipeline stage failed: {e}")
+            self.failed = True
+        finally:
+            self._pieces.put(self._END)
+
+    def pieces(self, until: float) -> Iterator[Any]:
+        """Pieces as they arrive, until the stream ends or `until` (a perf_counter time) passes."""
+        while True:
+            try:
+                piece = self._pieces.get(timeout=max(0.0, until - time.perf_counter()))
+            except queue.Empty:
+                self.expired = True
+                self.cancel()
+                return
+            if piece is self._END:
+                return
+            yield piece
+
+    def cancel(self) -> None:
+        self._stop.set()
+
+
+class RecommendationPipeline:
+    """
+    Deadline-aware orchestration of rephrase -> retrieve -> rerank.
+
+    Retrieval on the raw query starts while the rephrasing is still in flight.
+    When the rephrasing arrives in time, a second retrieval runs on it and the
+    two rankings are merged; otherwise the raw results are used. Reranking
+    stages are skipped when their expected latency doesn't fit in what is
+    left of the budget, or when `llm_stage_slots` calls of them are already
+    running, degrading to vector-only results. Each result records the path
+    it took.
+    """
+    def __init__(self, recommender, deadline: float = PIPELINE_DEADLINE, max_workers: int = PIPELINE_WORKERS,
+                 llm_stage_slots: int = LLM_STAGE_SLOTS):
+        self.recommender = recommender
+        self.vecdb = recommender.recommendations_object
+        self.deadline = deadline
+        self.executor: ThreadPoolExecutor = get_registry().get(
+            "pipeline_executor",
+            lambda: ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline"),
+        )
+        self.rephrase_slots = _StageSlots(llm_stage_slots)
+        self.llm_slots = _StageSlots(llm_stage_slots)
+        self.search_estimate = _LatencyEstimate(0.1)
+        self.rerank_estimate = _LatencyEstimate(0.3)
+        self.llm_estimate = _LatencyEstimate(1.5)
+
+    # -------- Helpers --------
+    @staticmethod
+    def _remaining(deadline_at: float) -> float:
+        return max(0.0, deadline_at - time.perf_counter())
+
+    def _timed(self, timings: _StageTimings, name: str, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with telemetry.span(name):
+                return fn(*args, **kwargs)
+        finally:
+            timings.record(name, time.perf_counter() - started)
+
+    def _wait(self, future: Optional[Future], timeout: float) -> Optional[Any]:
+        """Result of `future` within `timeout`, or None (the future is cancelled if it hasn't started)."""
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            return None
+        except Exception as e:
+            print(f"Pipeline stage failed: {e}")
+            return None
+
+    def _rephrase(self, query: str, budget: float) -> Optional[str]:
+        """
+        Rephrase with tenacity retries bounded by the remaining budget instead of a fixed attempt count.
+
+        The last error is raised; `_wait` turns it into a fallback to the raw query.
+        """
+        rephraser = self.vecdb.query_rephraser
+        bounded = rephraser.request_rephrasing.retry_with(stop=stop_after_attempt(3) | stop_after_delay(budget))
+        return bounded(rephraser, query)
+
+    def _intent_candidates(self, user_intent: Optional[str], raw_items: List[Dict], k: int, deadline_at: float,
+                           timings: _StageTimings, path: List[str]) -> List[Dict]:
+        """Search the rephrased query, if there is one, and merge it with the raw-query results."""
+        if not user_intent:
+            path.append("rephrase_skipped")
+            return raw_items
+
+        path.append("rephrase")
+        intent_future = telemetry.submit(self.executor, self._timed, timings, "intent_search",
+                                         self.vecdb.search, user_intent, k=k)
+        intent_items = self._wait(intent_future, self._remaining(deadline_at))
+        if not intent_items:
+            return raw_items
+        path.append("intent_search")
+        if raw_items:
+            path.append("merge")
+        return reciprocal_rank_fusion([intent_items, raw_items], weights=[INTENT_WEIGHT, RAW_WEIGHT])[:k]
+
+    def _shortlist(self, user_intent: str, candidates: List[Dict], n: int, deadline_at: float,
+                   timings: _StageTimings, path: List[str]) -> List[Dict]:
+        """Drop near-duplicates, then rerank locally if it fits in the budget."""
+        # Fewer, distinct candidates for the rerankers
+        if candidates:
+            diversified = self._timed(timings, "diversify", self.vecdb.diversify, user_intent, candidates)
+            if len(diversified) < len(candidates):
+                path.append("diversify")
+            candidates = diversified
+
+        reranker = self.recommender.reranker
+        if reranker is not None and candidates and self._remaining(deadline_at) > self.rerank_estimate.value:
+            shortlist = max(n, self.recommender.llm_candidates) if self.recommender.llm_reranker else n
+            rerank_future = telemetry.submit(self.executor, self._timed, timings, "local_rerank", reranker.rerank,
+                                             user_intent, candidates, shortlist)
+            reranked = self._wait(rerank_future, self._remaining(deadline_at))
+            if reranked:
+                path.append("local_rerank")
+                self.rerank_estimate.update(timings.get("local_rerank", 0.0))
+                candidates = reranked
+        elif reranker is not None:
+            path.append("local_rerank_skipped")
+        return candidates
+
+    @staticmethod
+    def _result(user_intent: str, selected: List[Dict], started: float, timings: _StageTimings,
+                path: List[str]) -> PipelineResult:
+        degraded = any(step.endswith(("_skipped", "_timeout")) for step in path)
+        if degraded and "llm_rerank" not in path and "local_rerank" not in path:
+            path.append("vector_only")
+
+        timings.record("total", time.perf_counter() - started)
+        telemetry.annotate(path=" > ".join(path), degraded=degraded)
+        return PipelineResult(
+            user_intent=user_intent,
+            recommendations={"results": [{"id": str(item["id"])} for item in selected]},
+            path=path,
+            timings=timings.freeze(),
+            degraded=degraded,
+        )
+
+    # -------- Pipeline --------
+    def run(self, user_query: str, n: int = 4, k: int = 30, deadline: Optional[float] = None) -> PipelineResult:
+        started = time.perf_counter()
+        deadline_at = started + (deadline if deadline is not None else self.deadline)
+        timings = _StageTimings()
+        path: List[str] = []
+
+        # 1. Rephrase and search the raw query at the same time
+        rephrase_future = self.rephrase_slots.submit(
+            self.executor, self._timed, timings, "rephrase", self._rephrase, user_query, self._remaining(deadline_at))
+        raw_future = telemetry.submit(self.executor, self._timed, timings, "raw_search", self.vecdb.search,
+                                      user_query, k=k)
+
+        raw_items = self._wait(raw_future, self._remaining(deadline_at)) or []
+        if raw_items:
+            path.append("raw_search")
+            self.search_estimate.update(timings.get("raw_search", 0.0))
+
+        # 2. Wait for the rephrasing, leaving room for a second search and a local rerank
+        reserve = self.search_estimate.value + self.rerank_estimate.value
+        user_intent = self._wait(rephrase_future, max(0.0, self._remaining(deadline_at) - reserve))
+        candidates = self._intent_candidates(user_intent, raw_items, k, deadline_at, timings, path)
+        user_intent = user_intent or user_query
+
+        # 3. Diversify and rerank locally, if it fits
+        candidates = self._shortlist(user_intent, candidates, n, deadline_at, timings, path)
+
+        # 4. LLM final pass, only when its expected latency fits what's left
+        selected = candidates[:n]
+        llm_reranker = self.recommender.llm_reranker
+        if llm_reranker is not None and candidates:
+            if self._remaining(deadline_at) > self.llm_estimate.value:
+                llm_started = time.perf_counter()
+                llm_future = self.llm_slots.submit(self.executor, self._timed, timings, "llm_rerank",
+                                                   llm_reranker.rerank, user_intent, candidates, n)
+                llm_selected = self._wait(llm_future, self._remaining(deadline_at))
+                if llm_future is None:
+                    path.append("llm_rerank_skipped")
+                elif "llm_rerank" in timings:
+                    self.llm_estimate.update(timings.get("llm_rerank"))
+                else:
+                    # Timed out: count the time spent waiting on it so the next request is more cautious
+                    self.llm_estimate.update(time.perf_counter() - llm_started)
+                if llm_selected:
+                    path.append("llm_rerank")
+                    selected = llm_selected
+                elif llm_future is not None:
+                    path.append("llm_rerank_timeout")
+            else:
+                path.append("llm_rerank_skipped")
+
+        return self._result(user_intent, selected, started, timings, path)
+
+    def stream(self, user_query: str, n: int = 4, k: int = 30,
+               deadline: Optional[float] = None) -> Iterator[Tuple[str, Any]]:
+        """
+        Streaming variant of `run`, for progressive rendering. Yields events:
+
+            ("intent_token", str)       a piece of the rephrasing, as the model writes it
+            ("intent_discarded", str)   the pieces sent so far won't be used ("deadline" or "error")
+            ("intent", str)             the complete user intent (the raw query if rephrasing failed or ran late)
+            ("item", Dict)              a selected item, as soon as it is known
+            ("result", PipelineResult)  the final result, last
+
+        The raw query is searched while the rephrasing streams in, and the
+        LLM rerank is streamed too, so the first item is yielded as soon as
+        the model has written its id. Both streams are drained on the
+        executor, so the deadline is enforced while waiting for the next piece.
+        """
+        started = time.perf_counter()
+        deadline_at = started + (deadline if deadline is not None else self.deadline)
+        timings = _StageTimings()
+        path: List[str] = []
+
+        # 1. Stream the rephrasing while the raw query is searched
+        raw_future = telemetry.submit(self.executor, self._timed, timings, "raw_search", self.vecdb.search,
+                                      user_query, k=k)
+        reserve = self.search_estimate.value + self.rerank_estimate.value
+        pieces: List[str] = []
+        rephrasing = _StreamedStage(self.executor, self.rephrase_slots, "rephrase",
+                                    self.vecdb.query_rephraser.rephrase_stream, user_query)
+        try:
+            # Past deadline_at - reserve it's too late to search the intent as well: fall back to the raw query
+            for piece in rephrasing.pieces(deadline_at - reserve):
+                pieces.append(piece)
+                yield "intent_token", piece
+        finally:
+            rephrasing.cancel()
+        timings.record("rephrase", time.perf_counter() - started)
+        if rephrasing.expired or rephrasing.failed:
+            if pieces:
+                yield "intent_discarded", "deadline" if rephrasing.expired else "error"
+            pieces = []
+
+        raw_items = self._wait(raw_future, self._remaining(deadline_at)) or []
+        if raw_items:
+            path.append("raw_search")
+            self.search_estimate.update(timings.get("raw_search", 0.0))
+
+        # 2. Search the intent and merge, then diversify and rerank locally
+        user_intent = "".join(pieces).strip() or None
+        candidates = self._intent_candidates(user_intent, raw_items, k, deadline_at, timings, path)
+        user_intent = user_intent or user_query
+        yield "intent", user_intent
+        candidates = self._shortlist(user_intent, candidates, n, deadline_at, timings, path)
+
+        # 3. Stream the LLM final pass, item by item
+        selected: List[Dict] = []
+        llm_reranker = self.recommender.llm_reranker
+        if llm_reranker is not None and candidates:
+            if self._remaining(deadline_at) > self.llm_estimate.value:
+                llm_started = time.perf_counter()
+                reranking = _StreamedStage(self.executor, self.llm_slots, "llm_rerank", llm_reranker.rerank_stream,
+                                           user_intent, candidates, n)
+                try:
+                    for item in reranking.pieces(deadline_at):
+                        selected.append(item)
+                        yield "item", item
+                finally:
+                    reranking.cancel()
+                if reranking.skipped:
+                    path.append("llm_rerank_skipped")
+                else:
+                    timings.record("llm_rerank", time.perf_counter() - llm_started)
+                    self.llm_estimate.update(timings.get("llm_rerank"))
+                    path.append("llm_rerank" if selected else "llm_rerank_timeout")
+            else:
+                path.append("llm_rerank_skipped")
+
+        # Fill up from the local ranking when the LLM picked fewer than n (or didn't run)
+        chosen = {str(item["id"]) for item in selected}
+        for item in candidates:
+            if len(selected) >= n:
+                break
+            if str(item["id"]) not in chosen:
+                selected.append(item)
+                yield "item", item
+
+        yield "result", self._result(user_intent, selected, started, timings, path)
@@ -0,0 +1,182 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import telemetry
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, used as the exact-match cache key."""
+    return " ".join(query.lower().split())
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with an optional time-to-live and hit/miss counters.
+
+    Args:
+        maxsize (int): Max number of entries kept
+        ttl (float): Seconds an entry stays valid (None: never expires)
+    """
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[0] < self.ttl):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SemanticCache:
+    """
+    Cache keyed by embedding similarity rather than exact text.
+
+    A lookup hits when the cosine similarity between the query embedding and a
+    cached embedding is at least `threshold`. Entries are kept in a single
+    normalized matrix so a lookup is one matrix-vector product.
+    """
+    def __init__(self, threshold: float = 0.95, maxsize: int = 512, ttl: Optional[float] = None):
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("threshold must be in (0, 1]")
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._vectors: Optional[np.ndarray] = None
+        self._values: List[Any] = []
+        self._created: List[float] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype="float32").ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, embedding) -> Optional[Any]:
+        query = self._normalize(embedding)
+        with self._lock:
+            if self._vectors is None or not len(self._values):
+                self.misses += 1
+                return None
+
+            similarities = self._vectors @ query
+            if self.ttl is not None:
+                expired = time.monotonic() - np.asarray(self._created) >= self.ttl
+                similarities[expired] = -1.0
+
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                self.hits += 1
+                return self._values[best]
+            self.misses += 1
+            return None
+
+    def set(self, embedding, value: Any) -> None:
+        vector = self._normalize(embedding)[None, :]
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = vector
+            else:
+                self._vectors = np.vstack([self._vectors, vector])
+            self._values.append(value)
+            self._created.append(time.monotonic())
+
+            overflow = len(self._values) - self.maxsize
+            if overflow > 0:
+                self._vectors = self._vectors[overflow:]
+                del self._values[:overflow]
+                del self._created[:overflow]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vectors = None
+            self._values.clear()
+            self._created.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._values),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with an exact-match LRU cache for query embeddings."""
+    def __init__(self, embeddings: Embeddings, maxsize: int = 4096, ttl: Optional[float] = None):
+        self.embeddings = embeddings
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with telemetry.span("embed_query") as span:
+            vector = self.cache.get(text)
+            span.attributes["cached"] = vector is not None
+            if vector is None:
+                vector = self.embeddings.embed_query(text)
+                self.cache.set(text, vector)
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries with one model call, reusing cached vectors."""
+        with telemetry.span("embed_queries", batch=len(texts)) as span:
+            vectors = [self.cache.get(text) for text in texts]
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            span.attributes["cached"] = len(texts) - len(missing)
+            if missing:
+                fresh = self.embeddings.embed_documents([texts[i] for i in missing])
+                for i, vector in zip(missing, fresh):
+                    self.cache.set(texts[i], vector)
+                    vectors[i] = vector
+        return vectors
+
+    def stats(self) -> Dict[str, float]:
+        return self.cache.stats()
@@ -0,0 +1,86 @@
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[Dict]], weights: Sequence[float] = None,
+                           k: int = 60, key: str = "id") -> List[Dict]:
+    """
+    Merge several ranked candidate lists with reciprocal rank fusion.
+
+    Each item scores sum(weight / (k + rank)) over the lists it appears in.
+    Items keep the fields of their first occurrence, plus an "rrf_score".
+
+    Args:
+        rankings: Ranked lists of candidate dicts, best first
+        weights: Optional weight per list (default: 1.0 each)
+        k (int): RRF damping constant
+        key (str): Field identifying the same item across lists
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict = {}
+    items: Dict = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking, start=1):
+            item_id = item[key]
+            scores[item_id] = scores.get(item_id, 0.0) + weight / (k + rank)
+            items.setdefault(item_id, item)
+
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [{**items[item_id], "rrf_score": scores[item_id]} for item_id in ordered]
+
+
+def maximal_marginal_relevance(query_vector: Sequence[float], candidate_vectors: np.ndarray, k: int,
+                               lambda_mult: float = 0.7) -> List[int]:
+    """
+    Greedy maximal-marginal-relevance selection over a candidate embedding matrix.
+
+    Each step picks the candidate maximizing
+    lambda_mult * sim(query, c) - (1 - lambda_mult) * max(sim(c, s) for s already selected),
+    with cosine similarities. The pairwise matrix is computed once; each step
+    is a single vector update of every candidate's redundancy.
+
+    Returns:
+        List[int]: Rows of `candidate_vectors`, in selection order
+    """
+    vectors = np.asarray(candidate_vectors, dtype="float32")
+    k = min(k, len(vectors))
+    if k <= 0:
+        return []
+    vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+    query = np.asarray(query_vector, dtype="float32").ravel()
+    relevance = vectors @ (query / (np.linalg.norm(query) + 1e-12))
+    pairwise = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = pairwise[selected[0]].copy()
+    available = np.ones(len(vectors), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, pairwise[best], out=redundancy)
+    return selected
+
+
+def collapse_duplicates(items: List[Dict], cluster_ids: Sequence[int], key: str = "id") -> List[Dict]:
+    """
+    Keep the best-ranked item of each near-duplicate cluster.
+
+    Kept items list the ids they stand for in "duplicates". A cluster id of
+    -1 means unknown; such items are never collapsed.
+    """
+    kept: List[Dict] = []
+    by_cluster: Dict[int, Dict] = {}
+    for item, cluster_id in zip(items, cluster_ids):
+        cluster_id = int(cluster_id)
+        if cluster_id < 0:
+            kept.append(item)
+        elif cluster_id in by_cluster:
+            by_cluster[cluster_id]["duplicates"].append(item[key])
+        else:
+            by_cluster[cluster_id] = {**item, "duplicates": []}
+            kept.append(by_cluster[cluster_id])
+    return kept
@@ -1,15 +1,25 @@
-from groq import Groq
-import streamlit as st
 from textwrap import dedent
+from typing import Iterator, Optional
 from Get_Ai_Image_Description import APIKeyError, get_api_key
 from tenacity import retry, stop_after_attempt, wait_exponential
+from resources import get_registry
+from query_cache import LRUCache, normalize_query
+import telemetry
+
+REPHRASE_CACHE_SIZE = 2048
+REPHRASE_CACHE_TTL = 24 * 3600  # seconds
 
 class QueryRephraser:
     def __init__(self, model: str = "meta-llama/llama-4-maverick-17b-128e-instruct"):
         """Initialize the query rephraser with model configuration"""
         self.model = model
-        self.client = Groq(api_key=get_api_key())
+        self.client = get_registry().groq_client(get_api_key())
         self.system_prompt = self.get_system_prompt()
+        # Exact-match cache of rephrasings, shared by every rephraser in the process
+        self.cache = get_registry().get(
+            "rephrase_cache",
+            lambda: LRUCache(maxsize=REPHRASE_CACHE_SIZE, ttl=REPHRASE_CACHE_TTL),
+        )
 
     def get_system_prompt(self) -> str:
         """Return a refined system prompt for rephrasing fashion-related user queries."""
@@ -38,17 +48,21 @@ class QueryRephraser:
             Use your fashion expertise to fill in missing details, making the query ready for a recommendation engine.
         """)
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1))
-    def rephrase_query(self, query: str) -> str:
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1), reraise=True,
+           before_sleep=telemetry.count_retries("rephrase"))
+    def request_rephrasing(self, query: str) -> str:
         """
-        Rephrase and enhance the user's fashion query
-        Args:
-            query: Original user query
-        Returns:
-            Enhanced query with structured metadata
+        Rephrase `query` with the LLM (or from the cache).
+
+        Retried; the last error is raised once the attempts are used up. Use
+        `retry_with` to bound the retries differently (see pipeline).
         """
+        cache_key = (self.model, normalize_query(query))
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-        try:
+        with telemetry.span("llm.rephrase", model=self.model):
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=[
@@ -60,10 +74,66 @@ class QueryRephraser:
                 top_p=0.9,
                 frequency_penalty=0.2
             )
-            
-            return response.choices[0].message.content
+            telemetry.record_usage("rephrase", response)
+
+        rephrased = response.choices[0].message.content
+        if rephrased:
+            self.cache.set(cache_key, rephrased)
+        return rephrased
 
+    def rephrase_query(self, query: str) -> Optional[str]:
+        """
+        Rephrase and enhance the user's fashion query
+        Args:
+            query: Original user query
+        Returns:
+            Enhanced query with structured metadata, or None (after reporting the error) when it failed
+        """
+        try:
+            return self.request_rephrasing(query)
         except APIKeyError as e:
-            st.error(f"❌ API Key Error: {str(e)}")
+            telemetry.report_error("rephrase", f"❌ API Key Error: {str(e)}")
         except Exception as e:
-            st.error(f"❌ Error During Enhanced query: {str(e)}")
+            telemetry.report_error("rephrase", f"❌ Error During Enhanced query: {str(e)}")
+
+    def rephrase_stream(self, query: str) -> Iterator[str]:
+        """
+        Streaming variant of `rephrase_query`: yields the rephrasing piece by piece as the model writes it.
+
+        The complete text is cached like `rephrase_query`'s, and a cached
+        rephrasing is yielded in one piece. Not retried: errors propagate to
+        the caller, which can fall back to the raw query.
+        """
+        cache_key = (self.model, normalize_query(query))
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+        pieces = []
+        with telemetry.span("llm.rephrase", model=self.model, stream=True):
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": query}
+                ],
+                temperature=0.3,
+                max_tokens=200,
+                top_p=0.9,
+                frequency_penalty=0.2,
+                stream=True,
+            )
+            try:
+                for chunk in stream:
+                    telemetry.record_usage("rephrase", chunk)
+                    piece = chunk.choices[0].delta.content if chunk.choices else None
+                    if piece:
+                        pieces.append(piece)
+                        yield piece
+            finally:
+                stream.close()
+
+        rephrased = "".join(pieces)
+        if rephrased:
+            self.cache.set(cache_key, rephrased)
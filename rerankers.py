@@ -0,0 +1,263 @@
+from abc import ABC, abstractmethod
+from textwrap import dedent
+from typing import Dict, Iterator, List, Optional
+import json
+import re
+
+import numpy as np
+
+from query_cache import LRUCache
+from ranking import reciprocal_rank_fusion
+from resources import DEFAULT_VECTOR_STORE_PATH, get_registry
+import telemetry
+
+DEFAULT_CROSS_ENCODER = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+CHARS_PER_TOKEN = 4  # rough estimate for English captions
+# A complete `"id": "123"` (or unquoted `"id": 123` followed by a delimiter) in partial JSON
+ID_PATTERN = re.compile(r'"id"\s*:\s*(?:"([^"]*)"|(-?\d+)\s*[,}\]])')
+
+
+class Reranker(ABC):
+    """
+    Reorders vector-search candidates by relevance to the user query.
+
+    Candidates are the dicts produced by `get_vector_recommendations`
+    ({"id": ..., "content": ...}); rerankers return the top `n` of them,
+    best first, each with an added "score".
+    """
+    @abstractmethod
+    def rerank(self, query: str, candidates: List[Dict], n: int) -> List[Dict]:
+        ...
+
+    @staticmethod
+    def _top_n(candidates: List[Dict], scores: np.ndarray, n: int) -> List[Dict]:
+        order = np.argsort(-scores, kind="stable")[:n]
+        return [{**candidates[i], "score": float(scores[i])} for i in order]
+
+
+class CrossEncoderReranker(Reranker):
+    """Scores each (query, caption) pair jointly with a small CPU cross-encoder."""
+    def __init__(self, model_name: str = DEFAULT_CROSS_ENCODER, batch_size: int = 32):
+        self.model_name = model_name
+        self.batch_size = batch_size
+
+    @property
+    def model(self):
+        def factory():
+            from sentence_transformers import CrossEncoder
+            return CrossEncoder(self.model_name, device="cpu")
+
+        return get_registry().get(f"cross_encoder:{self.model_name}", factory)
+
+    def rerank(self, query: str, candidates: List[Dict], n: int) -> List[Dict]:
+        if not candidates:
+            return []
+        pairs = [(query, item["content"]) for item in candidates]
+        scores = np.asarray(self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False))
+        return self._top_n(candidates, scores, n)
+
+
+class BiEncoderReranker(Reranker):
+    """
+    Cosine similarity between the query and caption embeddings, fused with the retrieval order.
+
+    Caption vectors are read by position from the live store's vectors.npy
+    (through its diversifier, which is rebuilt when a new version is
+    published). Captions not found there, e.g. with sharded search, are
+    embedded and cached by id and caption, so an updated caption is embedded
+    again. The cosine ranking is merged with the incoming order (the hybrid
+    and raw / intent fusion) by reciprocal rank fusion instead of replacing
+    it; ties keep the incoming order.
+
+    Args:
+        embeddings: Embedding model (default: the shared one)
+        cache_size (int): Caption vectors kept for candidates missing from the store
+        vector_store_path (str): Store root whose vectors are reused
+        retrieval_weight (float): RRF weight of the incoming order (the cosine order weighs 1.0)
+    """
+    def __init__(self, embeddings=None, cache_size: int = 20_000, vector_store_path: str = DEFAULT_VECTOR_STORE_PATH,
+                 retrieval_weight: float = 1.0):
+        self.embeddings = embeddings or get_registry().embeddings()
+        self.cache = LRUCache(maxsize=cache_size)
+        self.vector_store_path = vector_store_path
+        self.retrieval_weight = retrieval_weight
+
+    def _store(self):
+        """The live store's diversifier, for its vectors by position; None when search is sharded."""
+        registry = get_registry()
+        if registry.sharded_search() is not None:
+            return None
+        return registry.diversifier(self.vector_store_path)
+
+    def _caption_vectors(self, candidates: List[Dict]) -> np.ndarray:
+        vectors: List[Optional[np.ndarray]] = [None] * len(candidates)
+        store = self._store()
+        if store is not None:
+            positions = store.positions_of([int(item["id"]) for item in candidates])
+            known = np.flatnonzero(positions >= 0)
+            stored = store.vectors_at(positions[known]) if len(known) else None
+            if stored is not None:
+                for i, vector in zip(known, stored):
+                    vectors[i] = vector
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        keys = {i: (candidates[i]["id"], candidates[i]["content"]) for i in missing}
+        for i in missing:
+            vectors[i] = self.cache.get(keys[i])
+        to_embed = [i for i in missing if vectors[i] is None]
+        if to_embed:
+            fresh = self.embeddings.embed_documents([candidates[i]["content"] for i in to_embed])
+            for i, vector in zip(to_embed, fresh):
+                self.cache.set(keys[i], vector)
+                vectors[i] = vector
+        return np.asarray(vectors, dtype="float32")
+
+    def rerank(self, query: str, candidates: List[Dict], n: int) -> List[Dict]:
+        if not candidates:
+            return []
+        matrix = self._caption_vectors(candidates)
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype="float32")
+
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+        query_vector /= np.linalg.norm(query_vector) + 1e-12
+        by_cosine = [candidates[i] for i in np.argsort(-(matrix @ query_vector), kind="stable")]
+        fused = reciprocal_rank_fusion([candidates, by_cosine], weights=[self.retrieval_weight, 1.0])
+        return [{**item, "score": item["rrf_score"]} for item in fused[:n]]
+
+
+class IncrementalIdParser:
+    """Picks item ids out of a streamed `{"results": [{"id": ...}, ...]}` completion as soon as each is complete."""
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+
+    def feed(self, text: str) -> List[str]:
+        """Append streamed text; returns the ids completed by it, in order."""
+        self.buffer += text
+        ids = []
+        for match in ID_PATTERN.finditer(self.buffer, self.position):
+            ids.append(match.group(1) if match.group(1) is not None else match.group(2))
+            self.position = match.end()
+        return ids
+
+
+class LLMReranker(Reranker):
+    """
+    Picks the top `n` items with a chat LLM.
+
+    Candidates are sent as compact `id|description` lines instead of indented
+    JSON, trimmed to fit `token_budget`. With `attributes` (see
+    enrich_catalog) the description is the item's extracted fields rather
+    than its caption; items without any fall back to the caption.
+    """
+    def __init__(self, client, model: str = "meta-llama/llama-4-scout-17b-16e-instruct",
+                 token_budget: int = 1200, max_chars_per_item: int = 240, attributes=None):
+        self.client = client
+        self.model = model
+        self.token_budget = token_budget
+        self.max_chars_per_item = max_chars_per_item
+        self.attributes = attributes
+
+    def system_prompt(self, n: int) -> str:
+        return dedent(f"""
+            You are a fashion recommendation engine. From the stock items below, select the top {n} items that best match the user's intent (color, style, season, usage).
+
+            Input: a QUERY line, then one item per line as `id|description`; a description is either a caption or `field=value` attributes.
+
+            Rules:
+            - Select exactly {n} items, using only ids from the list.
+            - Do not fabricate ids or explanations.
+
+            Return only this JSON object:
+            {{"results": [{{"id": "4"}}, {{"id": "1485"}}]}}
+        """).strip()
+
+    def build_payload(self, query: str, candidates: List[Dict]) -> str:
+        """Compact, token-budgeted payload: the query followed by `id|description` lines."""
+        lines = [f"QUERY: {' '.join(query.split())}", "ITEMS:"]
+        budget = self.token_budget * CHARS_PER_TOKEN - sum(len(line) + 1 for line in lines)
+        compact = [None] * len(candidates)
+        if self.attributes is not None:
+            compact = self.attributes.describe([item["id"] for item in candidates])
+        for item, attributes in zip(candidates, compact):
+            description = attributes or " ".join(str(item["content"]).split())[:self.max_chars_per_item]
+            line = f"{item['id']}|{description}"
+            if len(line) + 1 > budget:
+                break
+            lines.append(line)
+            budget -= len(line) + 1
+        return "\n".join(lines)
+
+    def rerank(self, query: str, candidates: List[Dict], n: int) -> List[Dict]:
+        if not candidates:
+            return []
+        with telemetry.span("llm.rerank", model=self.model, candidates=len(candidates)):
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": self.system_prompt(n)},
+                    {"role": "user", "content": self.build_payload(query, candidates)},
+                ],
+                temperature=0.0,
+                max_tokens=40 + 16 * n,
+                response_format={"type": "json_object"},
+            )
+            telemetry.record_usage("rerank", response)
+        selected = json.loads(response.choices[0].message.content.strip()).get("results", [])
+
+        by_id = {str(item["id"]): item for item in candidates}
+        ranked, seen = [], set()
+        for result in selected:
+            item_id = str(result.get("id"))
+            if item_id in by_id and item_id not in seen:
+                seen.add(item_id)
+                ranked.append({**by_id[item_id], "score": float(n - len(ranked))})
+        return ranked[:n]
+
+    def rerank_stream(self, query: str, candidates: List[Dict], n: int) -> Iterator[Dict]:
+        """
+        Streaming variant of `rerank`: yields each selected item as soon as the model has written its id.
+
+        JSON mode can't be combined with streaming, so ids are parsed out of
+        the partial completion; unknown and repeated ids are skipped, and the
+        stream is closed once `n` items have been yielded.
+        """
+        if not candidates:
+            return
+        by_id = {str(item["id"]): item for item in candidates}
+        parser, seen = IncrementalIdParser(), set()
+        with telemetry.span("llm.rerank", model=self.model, candidates=len(candidates), stream=True):
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": self.system_prompt(n)},
+                    {"role": "user", "content": self.build_payload(query, candidates)},
+                ],
+                temperature=0.0,
+                max_tokens=40 + 16 * n,
+                stream=True,
+            )
+            try:
+                for chunk in stream:
+                    telemetry.record_usage("rerank", chunk)
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    for item_id in parser.feed(text or ""):
+                        if item_id in by_id and item_id not in seen:
+                            seen.add(item_id)
+                            yield {**by_id[item_id], "score": float(n - len(seen) + 1)}
+                            if len(seen) == n:
+                                return
+            finally:
+                stream.close()
+
+
+def get_local_reranker(name: str) -> Optional[Reranker]:
+    """Local reranker by name: "cross_encoder", "bi_encoder" or "none"."""
+    name = (name or "none").lower()
+    if name == "cross_encoder":
+        return CrossEncoderReranker()
+    if name == "bi_encoder":
+        return BiEncoderReranker()
+    if name == "none":
+        return None
+    raise ValueError(f"Unknown reranker '{name}'. Choose from: cross_encoder, bi_encoder, none")
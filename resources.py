@@ -0,0 +1,286 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_EMBEDDING_MODEL = "BAAI/bge-base-en-v1.5"
+DEFAULT_VECTOR_STORE_PATH = "vector_store"
+# Embedding backend: torch (sentence-transformers), onnx, or onnx-int8 (see onnx_embeddings.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Comma-separated shard server URLs; when set, search fans out to them instead of a local store (see sharded_search)
+SHARD_URLS = [url.strip() for url in os.getenv("SHARD_URLS", "").split(",") if url.strip()]
+
+# Connection pool sizes for the shared Groq / HTTP clients
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+HTTP_TIMEOUT = 60.0  # seconds
+
+
+class ResourceRegistry:
+    """
+    Process-wide, thread-safe home for long-lived resources.
+
+    Each resource is created once, on first use or during `warm_up`, and then
+    shared by every request and every Streamlit session in the process: the
+    embedding model, loaded vector stores, and keep-alive Groq/HTTP clients.
+    """
+    COLD, WARMING, WARM, FAILED = "cold", "warming", "warm", "failed"
+    # Where warm-up records that no Groq API key was found
+    GROQ_CLIENT_WITHOUT_KEY = "groq_client:missing_key"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._resources: Dict[str, Any] = {}
+        self._state: Dict[str, str] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        self._warmup_thread: Optional[threading.Thread] = None
+        self._live_versions: Dict[str, str] = {}
+
+    # -------- Core --------
+    def get(self, name: str, factory: Callable[[], Any]) -> Any:
+        """Return the resource `name`, creating it with `factory` exactly once."""
+        resource = self._resources.get(name)
+        if resource is not None:
+            return resource
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(name, threading.Lock())
+
+        # One lock per resource, so a slow model load doesn't block unrelated lookups
+        with key_lock:
+            resource = self._resources.get(name)
+            if resource is not None:
+                return resource
+
+            self._state[name] = self.WARMING
+            started = time.perf_counter()
+            try:
+                resource = factory()
+            except Exception as e:
+                self.mark_failed(name, e)
+                raise
+            with self._lock:
+                self._errors.pop(name, None)
+                self._load_seconds[name] = time.perf_counter() - started
+                self._resources[name] = resource
+                self._state[name] = self.WARM
+            return resource
+
+    def is_warm(self, name: str) -> bool:
+        return self._state.get(name) == self.WARM
+
+    def mark_failed(self, name: str, error: Exception) -> None:
+        """Record that `name` couldn't be loaded, so status() reports why."""
+        with self._lock:
+            self._state[name] = self.FAILED
+            self._errors[name] = str(error)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Warm/cold state, load time and last load error of every resource the registry knows about."""
+        with self._lock:
+            states, load_seconds, errors = dict(self._state), dict(self._load_seconds), dict(self._errors)
+        return {
+            name: {"state": state, "load_seconds": round(load_seconds.get(name, 0.0), 3),
+                   **({"error": errors[name]} if state == self.FAILED and name in errors else {})}
+            for name, state in sorted(states.items())
+        }
+
+    def cache_stats(self) -> Dict[str, Dict[str, float]]:
+        """Hit/miss counters of every loaded resource that exposes `stats()` (caches, cached embeddings)."""
+        # A snapshot, so resources loaded or reset meanwhile don't break the iteration
+        with self._lock:
+            resources = sorted(self._resources.items())
+        return {name: resource.stats() for name, resource in resources if callable(getattr(resource, "stats", None))}
+
+    def reset(self, name: str) -> None:
+        """Drop a resource so the next `get` rebuilds it."""
+        with self._lock:
+            self._resources.pop(name, None)
+            self._state.pop(name, None)
+            self._load_seconds.pop(name, None)
+            self._errors.pop(name, None)
+
+    # -------- Resources --------
+    def embeddings(self, model_name: str = DEFAULT_EMBEDDING_MODEL, backend: str = EMBEDDING_BACKEND):
+        """The embedding model, wrapped in an exact-match cache for query embeddings."""
+        if backend not in ("torch", "onnx", "onnx-int8"):
+            raise ValueError(f"Unknown embedding backend '{backend}'. Choose from: torch, onnx, onnx-int8")
+
+        def factory():
+            from query_cache import CachedEmbeddings
+            if backend == "torch":
+                from langchain_community.embeddings import HuggingFaceEmbeddings
+                return CachedEmbeddings(HuggingFaceEmbeddings(model_name=model_name))
+            from onnx_embeddings import OnnxEmbeddings
+            return CachedEmbeddings(OnnxEmbeddings(model_name, quantize=backend == "onnx-int8"))
+
+        key = f"embeddings:{model_name}" if backend == "torch" else f"embeddings:{model_name}:{backend}"
+        return self.get(key, factory)
+
+    def live_store_path(self, path: str = DEFAULT_VECTOR_STORE_PATH) -> str:
+        """
+        Directory of the live version of the store at `path` (see index_versions).
+
+        When a new version has been published since the last call, resources
+        built on the previous one are dropped so they're rebuilt on demand.
+        """
+        from index_versions import resolve_store_path
+        resolved = resolve_store_path(path)
+        with self._lock:
+            previous = self._live_versions.get(path)
+            self._live_versions[path] = resolved
+        if previous is not None and previous != resolved:
+            for prefix in ("vector_store", "hybrid_retriever", "semantic_cache", "diversifier"):
+                self.reset(f"{prefix}:{previous}")
+        return resolved
+
+    def vector_store(self, path: str = DEFAULT_VECTOR_STORE_PATH, model_name: str = DEFAULT_EMBEDDING_MODEL):
+        """The live version of the vector store at `path`; picks up newly published versions without a restart."""
+        resolved = self.live_store_path(path)
+
+        def factory():
+            from bulid_vec_db import VectorStoreManager
+            return VectorStoreManager(model_name=model_name).load(resolved)
+
+        return self.get(f"vector_store:{resolved}", factory)
+
+    def diversifier(self, path: str = DEFAULT_VECTOR_STORE_PATH, model_name: str = DEFAULT_EMBEDDING_MODEL):
+        """Near-duplicate collapsing and MMR over the live version of the store at `path` (see diversity)."""
+        vec_db = self.vector_store(path, model_name)
+        resolved = self.live_store_path(path)
+
+        def factory():
+            from diversity import Diversifier
+            return Diversifier(vec_db, self.embeddings(model_name), resolved)
+
+        return self.get(f"diversifier:{resolved}", factory)
+
+    def catalog_attributes(self, catalog_path: str = "catalog_store"):
+        """Structured attributes of the catalog items (see enrich_catalog), or None when they haven't been extracted."""
+        from enrich_catalog import CatalogAttributes
+        if not CatalogAttributes.is_built(catalog_path):
+            return None
+        return self.get(f"catalog_attributes:{catalog_path}", lambda: CatalogAttributes(catalog_path))
+
+    def sharded_search(self, model_name: str = DEFAULT_EMBEDDING_MODEL):
+        """Scatter-gather search over the SHARD_URLS shard servers, or None when not configured."""
+        if not SHARD_URLS:
+            return None
+
+        def factory():
+            from sharded_search import ShardedSearch
+            return ShardedSearch(SHARD_URLS, self.embeddings(model_name))
+
+        return self.get("sharded_search", factory)
+
+    def groq_client(self, api_key: Optional[str] = None):
+        """Shared Groq client whose httpx pool keeps connections to the API alive between requests."""
+        if api_key is None:
+            from Get_Ai_Image_Description import get_api_key
+            api_key = get_api_key()
+
+        def factory():
+            import httpx
+            from groq import Groq
+
+            from telemetry import record_http_response
+
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+                timeout=HTTP_TIMEOUT,
+                event_hooks={"response": [record_http_response]},
+            )
+            # GROQ_BASE_URL points the client at another endpoint, e.g. benchmarks/fake_groq.py
+            return Groq(api_key=api_key, base_url=os.getenv("GROQ_BASE_URL") or None, http_client=http_client)
+
+        if self.GROQ_CLIENT_WITHOUT_KEY in self._state:
+            self.reset(self.GROQ_CLIENT_WITHOUT_KEY)
+        return self.get(self.groq_client_key(api_key), factory)
+
+    @staticmethod
+    def groq_client_key(api_key: str) -> str:
+        """Registry name of the Groq client for `api_key`: a hash, so the key itself never shows up in status()."""
+        return f"groq_client:{hash(api_key) & 0xffffffff:08x}"
+
+    def http_session(self):
+        """Shared requests.Session with a keep-alive connection pool."""
+        def factory():
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_KEEPALIVE_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            return session
+
+        return self.get("http_session", factory)
+
+    # -------- Warm-up --------
+    def warm_up(self, vector_store_path: str = DEFAULT_VECTOR_STORE_PATH, background: bool = True) -> None:
+        """
+        Load the embedding model, the vector store and the clients ahead of the first request.
+
+        With SHARD_URLS set the store lives in the shard servers and isn't loaded here.
+
+        With `background=True` this returns immediately and warms up on a
+        daemon thread; calling it again while warm or warming is a no-op.
+        The API key is looked up on the calling thread, since it reads
+        Streamlit secrets and reports a missing key in the page; failures on
+        the warm-up thread are only logged and show up in status().
+        """
+        with self._lock:
+            if self._warmup_thread is not None:
+                return
+
+        api_key = None
+        try:
+            from Get_Ai_Image_Description import get_api_key
+            api_key = get_api_key()
+        except Exception as e:
+            # No key, so no client name to report under yet; cleared once a client is created
+            self.mark_failed(self.GROQ_CLIENT_WITHOUT_KEY, e)
+
+        def run():
+            loaders = [
+                ("embeddings", self.embeddings),
+                ("vector_store", lambda: self.sharded_search() or self.vector_store(vector_store_path)),
+                ("http_session", self.http_session),
+            ]
+            if api_key is not None:
+                loaders.append(("groq_client", lambda: self.groq_client(api_key)))
+            for name, load in loaders:
+                try:
+                    load()
+                except Exception as e:
+                    # The failed resource is marked in status() by `get`
+                    print(f"Warm-up of {name} failed: {e}")
+
+        with self._lock:
+            if self._warmup_thread is not None:
+                return
+            self._warmup_thread = threading.Thread(target=run, name="resource-warmup", daemon=True)
+
+        if background:
+            self._warmup_thread.start()
+        else:
+            run()
+
+    def wait_until_warm(self, timeout: Optional[float] = None) -> bool:
+        """Block until a background warm-up finishes. Returns False on timeout."""
+        thread = self._warmup_thread
+        if thread is None or not thread.is_alive():
+            return True
+        thread.join(timeout)
+        return not thread.is_alive()
+
+
+_registry = ResourceRegistry()
+
+
+def get_registry() -> ResourceRegistry:
+    """The process-wide registry."""
+    return _registry
@@ -0,0 +1,295 @@
+"""
+Headless recommendation service: the recommendation stages over HTTP, independent of the Streamlit UI.
+
+    python service.py --port 8080
+
+Endpoints (JSON in, JSON out):
+
+    POST /rephrase   {"query"}                                  -> {"user_intent"}
+    POST /retrieve   {"query", "k"?, "filters"?}                -> {"items": [{"id", "content"}]}
+    POST /rerank     {"query", "candidates", "n"?, "llm"?}      -> {"results": [{"id", "content", "score"}]}
+    POST /recommend  {"query", "n"?, "k"?}                      -> {"user_intent", "results", "path", "timings"}
+    POST /describe   {"image_url"} or {"image_base64"}          -> {"description"}
+    GET  /health, GET /metrics
+
+Concurrent /retrieve (and /recommend) requests are coalesced into
+micro-batches: one embedding call and one faiss search per batch. LLM calls
+(rephrase, LLM rerank, describe) are bounded by a semaphore so bursts queue
+here instead of piling up on the Groq API. Point the app at a running service
+with RECOMMENDER_SERVICE_URL to make it a thin client.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import base64
+import contextvars
+import functools
+import io
+import os
+import time
+
+from aiohttp import web
+
+import telemetry
+from resources import DEFAULT_VECTOR_STORE_PATH, get_registry
+
+# Micro-batching: flush when this many queries are waiting, or this long after the first arrived
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT = float(os.getenv("BATCH_MAX_WAIT", "0.005"))  # seconds
+# Max Groq calls in flight across all requests
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+SERVICE_WORKERS = 16
+
+
+async def run_in_thread(executor: ThreadPoolExecutor, fn: Callable, *args) -> Any:
+    """Run blocking work on the executor, keeping the request's trace."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, contextvars.copy_context().run, fn, *args)
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item calls into batched calls.
+
+    `batch_fn` takes a list of items and returns a list of results in the
+    same order; it runs on `executor`. A batch is flushed when `max_size`
+    items are waiting or `max_wait` seconds after its first item arrived.
+    """
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], executor: ThreadPoolExecutor,
+                 max_size: int = BATCH_MAX_SIZE, max_wait: float = BATCH_MAX_WAIT):
+        self.batch_fn = batch_fn
+        self.executor = executor
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._getter: Optional[asyncio.Future] = None
+
+    async def submit(self, item: Any) -> Any:
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future]]:
+        # A get that times out is left pending for the next batch rather than cancelled:
+        # before Python 3.12, cancelling a get that has just been handed an item drops the item
+        batch: List[Tuple[Any, asyncio.Future]] = []
+        loop = asyncio.get_running_loop()
+        deadline = None
+        while len(batch) < self.max_size:
+            timeout = None if deadline is None else deadline - loop.time()
+            if timeout is not None and timeout <= 0:
+                break
+            if self._getter is None:
+                self._getter = asyncio.ensure_future(self._queue.get())
+            done, _ = await asyncio.wait({self._getter}, timeout=timeout)
+            if not done:
+                break
+            batch.append(self._getter.result())
+            self._getter = None
+            if deadline is None:
+                deadline = loop.time() + self.max_wait
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            items = [item for item, _ in batch]
+            self.batches += 1
+            self.items += len(items)
+            try:
+                results = await run_in_thread(self.executor, self.batch_fn, items)
+                if len(results) != len(batch):
+                    raise ValueError(f"batch_fn returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self) -> Dict[str, float]:
+        return {"batches": self.batches, "items": self.items,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0}
+
+
+class RecommendationService:
+    """The recommendation stages as async operations over the existing classes."""
+    def __init__(self, vector_store_path: str = DEFAULT_VECTOR_STORE_PATH, llm_concurrency: int = LLM_CONCURRENCY,
+                 batch_max_size: int = BATCH_MAX_SIZE, batch_max_wait: float = BATCH_MAX_WAIT):
+        from Get_LLM_response import LLMRecommender
+        from get_vector_recommendetion import recommendations_based_on_vecdb
+
+        self.retriever = recommendations_based_on_vecdb(vector_store_path)
+        self.recommender = LLMRecommender(recommendations_object=self.retriever)
+        self.executor = ThreadPoolExecutor(max_workers=SERVICE_WORKERS, thread_name_prefix="service")
+        self.llm_slots = asyncio.Semaphore(llm_concurrency)
+        self.retrieval = MicroBatcher(self._retrieve_batch, self.executor, batch_max_size, batch_max_wait)
+
+    def _retrieve_batch(self, requests: List[Tuple[str, int, Optional[Dict]]]) -> List[List[Dict]]:
+        """One `search_many` per distinct k (usually just one)."""
+        results: List[Optional[List[Dict]]] = [None] * len(requests)
+        by_k: Dict[int, List[int]] = {}
+        for i, (_, k, _) in enumerate(requests):
+            by_k.setdefault(k, []).append(i)
+        for k, rows in by_k.items():
+            found = self.retriever.search_many([requests[i][0] for i in rows], k=k,
+                                               filters=[requests[i][2] for i in rows])
+            for i, items in zip(rows, found):
+                results[i] = items
+        return results
+
+    async def _llm(self, fn: Callable, *args) -> Any:
+        async with self.llm_slots:
+            return await run_in_thread(self.executor, fn, *args)
+
+    # -------- Operations --------
+    async def rephrase(self, query: str) -> Optional[str]:
+        with telemetry.span("rephrase"):
+            return await self._llm(self.retriever.query_rephraser.rephrase_query, query)
+
+    async def retrieve(self, query: str, k: int = 30, filters: Optional[Dict[str, List[str]]] = None) -> List[Dict]:
+        with telemetry.span("retrieve", k=k):
+            return await self.retrieval.submit((query, k, filters or None))
+
+    async def rerank(self, query: str, candidates: List[Dict], n: int = 4, llm: bool = True) -> List[Dict]:
+        reranker, llm_reranker = self.recommender.reranker, self.recommender.llm_reranker if llm else None
+        if reranker is not None:
+            shortlist = max(n, self.recommender.llm_candidates) if llm_reranker else n
+            with telemetry.span("local_rerank", candidates=len(candidates)):
+                candidates = await run_in_thread(self.executor, reranker.rerank, query, candidates, shortlist)
+        if llm_reranker is not None and candidates:
+            try:
+                with telemetry.span("llm_rerank", candidates=len(candidates)):
+                    return await self._llm(llm_reranker.rerank, query, candidates, n) or candidates[:n]
+            except Exception as e:
+                print(f"LLM rerank failed, keeping local ranking: {e}")
+        return candidates[:n]
+
+    async def recommend(self, query: str, n: int = 4, k: int = 30) -> Dict[str, Any]:
+        """Rephrase and search the raw query concurrently, then search the intent and rerank."""
+        timings, path = {}, []
+        started = time.perf_counter()
+
+        rephrase_task = asyncio.create_task(self.rephrase(query))
+        raw_items = await self.retrieve(query, k=k)
+        timings["raw_search"] = round(time.perf_counter() - started, 4)
+
+        user_intent = await rephrase_task
+        timings["rephrase"] = round(time.perf_counter() - started, 4)
+        candidates = raw_items
+        if user_intent:
+            path.append("rephrase")
+            from ranking import reciprocal_rank_fusion
+            from pipeline import INTENT_WEIGHT, RAW_WEIGHT
+
+            intent_items = await self.retrieve(user_intent, k=k)
+            candidates = reciprocal_rank_fusion([intent_items, raw_items], weights=[INTENT_WEIGHT, RAW_WEIGHT])[:k]
+            path.append("intent_search")
+        else:
+            path.append("rephrase_skipped")
+            user_intent = query
+        candidates = await run_in_thread(self.executor, self.retriever.diversify, user_intent, candidates)
+
+        rerank_started = time.perf_counter()
+        selected = await self.rerank(user_intent, candidates, n=n)
+        timings["rerank"] = round(time.perf_counter() - rerank_started, 4)
+        timings["total"] = round(time.perf_counter() - started, 4)
+        return {
+            "user_intent": user_intent,
+            "results": [{"id": str(item["id"])} for item in selected],
+            "path": path,
+            "timings": timings,
+        }
+
+    async def describe(self, image_url: Optional[str] = None, image_base64: Optional[str] = None) -> Optional[str]:
+        from Get_Ai_Image_Description import get_image_description
+
+        if image_base64:
+            image_input, is_local = io.BytesIO(base64.b64decode(image_base64)), True
+        else:
+            image_input, is_local = image_url, False
+        # No spinner or status messages: there is no Streamlit page on the service threads
+        return await self._llm(functools.partial(get_image_description, show_progress=False), image_input, is_local)
+
+
+# -------- HTTP --------
+def create_app(service: Optional[RecommendationService] = None,
+               vector_store_path: str = DEFAULT_VECTOR_STORE_PATH) -> web.Application:
+    app = web.Application()
+
+    async def on_startup(app: web.Application) -> None:
+        get_registry().warm_up(vector_store_path)
+        app["service"] = service or RecommendationService(vector_store_path)
+
+    def endpoint(name: str, handler: Callable) -> Callable:
+        async def wrapped(request: web.Request) -> web.Response:
+            try:
+                body = await request.json()
+            except ValueError:
+                return web.json_response({"error": "Body must be JSON"}, status=400)
+            with telemetry.trace(f"service.{name}"):
+                try:
+                    return web.json_response(await handler(request.app["service"], body))
+                except KeyError as e:
+                    return web.json_response({"error": f"Missing field {e}"}, status=400)
+                except Exception as e:
+                    return web.json_response({"error": str(e)}, status=500)
+        return wrapped
+
+    async def rephrase(service: RecommendationService, body: Dict) -> Dict:
+        return {"user_intent": await service.rephrase(body["query"])}
+
+    async def retrieve(service: RecommendationService, body: Dict) -> Dict:
+        return {"items": await service.retrieve(body["query"], k=int(body.get("k", 30)), filters=body.get("filters"))}
+
+    async def rerank(service: RecommendationService, body: Dict) -> Dict:
+        results = await service.rerank(body["query"], body["candidates"], n=int(body.get("n", 4)),
+                                       llm=bool(body.get("llm", True)))
+        return {"results": results}
+
+    async def recommend(service: RecommendationService, body: Dict) -> Dict:
+        return await service.recommend(body["query"], n=int(body.get("n", 4)), k=int(body.get("k", 30)))
+
+    async def describe(service: RecommendationService, body: Dict) -> Dict:
+        if not body.get("image_url") and not body.get("image_base64"):
+            raise KeyError("image_url")
+        return {"description": await service.describe(body.get("image_url"), body.get("image_base64"))}
+
+    async def health(request: web.Request) -> web.Response:
+        service_ = request.app.get("service")
+        return web.json_response({
+            "resources": get_registry().status(),
+            "batching": service_.retrieval.stats() if service_ else {},
+        })
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=telemetry.METRICS.render_prometheus(), content_type="text/plain")
+
+    app.on_startup.append(on_startup)
+    app.router.add_post("/rephrase", endpoint("rephrase", rephrase))
+    app.router.add_post("/retrieve", endpoint("retrieve", retrieve))
+    app.router.add_post("/rerank", endpoint("rerank", rerank))
+    app.router.add_post("/recommend", endpoint("recommend", recommend))
+    app.router.add_post("/describe", endpoint("describe", describe))
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the recommendation service.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--vector-store", default=DEFAULT_VECTOR_STORE_PATH)
+    args = parser.parse_args()
+
+    web.run_app(create_app(vector_store_path=args.vector_store), host=args.host, port=args.port)
@@ -0,0 +1,48 @@
+import base64
+from typing import Any, Dict, List, Optional, Tuple
+import os
+
+from resources import get_registry
+
+# Base URL of a running service.py; when set, the app delegates all recommendation work to it
+RECOMMENDER_SERVICE_URL = os.getenv("RECOMMENDER_SERVICE_URL", "")
+SERVICE_TIMEOUT = 30.0  # seconds
+
+
+class RecommenderClient:
+    """Thin client for the recommendation service, over the registry's keep-alive HTTP session."""
+    def __init__(self, base_url: str = RECOMMENDER_SERVICE_URL, timeout: float = SERVICE_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = get_registry().http_session().post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("error", response.text)
+            except ValueError:
+                message = response.text
+            raise RuntimeError(f"Recommendation service {path} failed ({response.status_code}): {message}")
+        return response.json()
+
+    def rephrase(self, query: str) -> Optional[str]:
+        return self._post("/rephrase", {"query": query})["user_intent"]
+
+    def retrieve(self, query: str, k: int = 30, filters: Optional[Dict[str, List[str]]] = None) -> List[Dict]:
+        return self._post("/retrieve", {"query": query, "k": k, "filters": filters})["items"]
+
+    def rerank(self, query: str, candidates: List[Dict], n: int = 4, llm: bool = True) -> List[Dict]:
+        return self._post("/rerank", {"query": query, "candidates": candidates, "n": n, "llm": llm})["results"]
+
+    def recommend(self, query: str, n: int = 4, k: int = 30) -> Tuple[str, Dict[str, Any], List[str]]:
+        """(user_intent, {"results": [{"id"}]}, path), the same shape LLMRecommender returns plus the path taken."""
+        response = self._post("/recommend", {"query": query, "n": n, "k": k})
+        return response["user_intent"], {"results": response["results"]}, response.get("path", [])
+
+    def describe_image(self, image_input, is_local: bool = False) -> Optional[str]:
+        if is_local:
+            data = image_input.getvalue() if hasattr(image_input, "getvalue") else open(image_input, "rb").read()
+            payload = {"image_base64": base64.b64encode(data).decode("ascii")}
+        else:
+            payload = {"image_url": image_input}
+        return self._post("/describe", payload)["description"]
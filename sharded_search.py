@@ -0,0 +1,281 @@
+"""
+Sharded scatter-gather vector search across processes or hosts.
+
+The store is partitioned into N shards, each a complete memory-mapped store
+(see mmap_store) with its own faiss index. A shard server holds one shard
+and answers searches for precomputed query vectors over HTTP; the
+coordinator embeds the query once, fans it out to every shard in parallel
+and merges the per-shard top-k lists (each sorted by distance) with a heap.
+A shard that fails or doesn't answer within the timeout is left out of that
+result instead of failing the query.
+
+    python sharded_search.py partition --store vector_store --output vector_store_partitions --shards 4
+    python sharded_search.py serve --shard vector_store_partitions/shard-000 --port 8101     # one per shard
+    python sharded_search.py launch --root vector_store_partitions --base-port 8101          # all shards locally
+    SHARD_URLS=http://127.0.0.1:8101,http://127.0.0.1:8102,... streamlit run app.py
+
+Sharded mode covers dense search only: BM25 fusion, attribute filters and
+diversification need the full store and are skipped.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Sequence
+import argparse
+import asyncio
+import base64
+import heapq
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import faiss
+import numpy as np
+
+import ann_index
+import mmap_store
+import telemetry
+
+MANIFEST_FILE = "shards.json"
+SHARD_DIR = "shard-{:03d}"
+# Per-query budget for the fan-out; shards that haven't answered by then are skipped
+SHARD_TIMEOUT = float(os.getenv("SHARD_TIMEOUT", "0.5"))  # seconds
+
+
+# -------- Partitioning --------
+def partition_store(store_path: str, output_root: str, num_shards: int, index_type: Optional[str] = None,
+                    **index_params) -> Dict:
+    """
+    Split the live version of a store into `num_shards` round-robin shards under `output_root`.
+
+    Tombstoned rows are dropped. Each shard gets its own index of the
+    store's type and build params (or `index_type` and `index_params`) and
+    the store's default search params.
+
+    Returns:
+        Dict: The manifest written to `output_root/shards.json`
+    """
+    from index_versions import resolve_store_path
+
+    path = resolve_store_path(store_path)
+    vectors_path = os.path.join(path, mmap_store.VECTORS_FILE)
+    if not mmap_store.is_mmap_store(path) or not os.path.exists(vectors_path):
+        raise FileNotFoundError(f"{path} needs the memory-mapped layout and vectors.npy; rebuild the store first")
+
+    vectors = np.load(vectors_path, mmap_mode="r")
+    image_indexes = np.load(os.path.join(path, mmap_store.IMAGE_INDEX_FILE))
+    captions = mmap_store.PackedBlobs(path, mmap_store.CAPTIONS)
+    live = np.ones(len(image_indexes), dtype=bool)
+    tombstones_path = os.path.join(path, mmap_store.TOMBSTONES_FILE)
+    if os.path.exists(tombstones_path):
+        live[np.load(tombstones_path)] = False
+
+    params = ann_index.load_index_params(path)
+    if index_type is None or index_type == params.get("index_type", "flat"):
+        index_params = {**params.get("build", {}), **index_params}
+    index_type = index_type or params.get("index_type", "flat")
+    live_positions = np.flatnonzero(live)
+    shards = []
+    try:
+        for shard in range(num_shards):
+            started = time.perf_counter()
+            positions = live_positions[shard::num_shards]
+            shard_path = os.path.join(output_root, SHARD_DIR.format(shard))
+            os.makedirs(shard_path, exist_ok=True)
+
+            shard_vectors = np.asarray(vectors[positions], dtype="float32")
+            index = ann_index.build_faiss_index(shard_vectors, index_type=index_type, **index_params)
+            faiss.write_index(index, os.path.join(shard_path, mmap_store.INDEX_FILE))
+            mmap_store.write_array(shard_path, mmap_store.VECTORS_FILE, shard_vectors)
+            mmap_store.write_metadata(shard_path, [captions[int(p)].decode("utf-8") for p in positions],
+                                      image_indexes[positions])
+            ann_index.save_index_params(shard_path, {**params, "index_type": index_type, "build": index_params})
+            shards.append({"path": os.path.basename(shard_path), "vectors": len(positions)})
+            print(f"Shard {shard}: {len(positions)} vectors ({index_type}) in {time.perf_counter() - started:.1f}s")
+    finally:
+        captions.close()
+
+    manifest = {"source": path, "index_type": index_type, "dimension": int(vectors.shape[1]),
+                "vectors": int(len(live_positions)), "shards": shards}
+    with open(os.path.join(output_root, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def encode_vectors(vectors: np.ndarray) -> Dict:
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    return {"vectors": base64.b64encode(vectors.tobytes()).decode("ascii"), "dimension": int(vectors.shape[1])}
+
+
+def decode_vectors(payload: Dict) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(payload["vectors"]), dtype="float32").reshape(-1, int(payload["dimension"]))
+
+
+# -------- Shard server --------
+def create_shard_app(shard_path: str, workers: int = 4):
+    """
+    aiohttp app serving one shard:
+
+        POST /search  {"vectors" (base64 float32), "dimension", "k", "nprobe"?, "ef_search"?}
+                      -> {"shard", "results": [[{"id", "content", "distance"}, ...] per query]}
+        GET  /health  -> {"shard", "vectors"}
+
+    faiss releases the GIL, so searches run on a thread pool.
+    """
+    from aiohttp import web
+
+    store = mmap_store.MmapVectorStore(shard_path)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard")
+    name = os.path.basename(os.path.normpath(shard_path))
+
+    def search(payload: Dict) -> List[List[Dict]]:
+        distances, positions = ann_index.search(store.index, decode_vectors(payload), int(payload.get("k", 30)),
+                                                nprobe=payload.get("nprobe"), ef_search=payload.get("ef_search"),
+                                                mask=store.live_mask)
+        return [
+            [{"id": int(store.image_indexes[p]), "content": store.caption_at(int(p)), "distance": float(d)}
+             for d, p in zip(row_distances, row_positions) if p != -1]
+            for row_distances, row_positions in zip(distances, positions)
+        ]
+
+    async def handle_search(request: web.Request) -> web.Response:
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.json_response({"error": "Body must be JSON"}, status=400)
+        with telemetry.span("shard_search", shard=name):
+            results = await asyncio.get_running_loop().run_in_executor(executor, search, payload)
+        return web.json_response({"shard": name, "results": results})
+
+    async def handle_health(request: web.Request) -> web.Response:
+        return web.json_response({"shard": name, "vectors": len(store)})
+
+    app = web.Application()
+    app.router.add_post("/search", handle_search)
+    app.router.add_get("/health", handle_health)
+    return app
+
+
+def launch_local_workers(root: str, base_port: int = 8101, host: str = "127.0.0.1") -> List[subprocess.Popen]:
+    """Start one shard server process per shard in `root`, on consecutive ports."""
+    with open(os.path.join(root, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    processes = []
+    for offset, shard in enumerate(manifest["shards"]):
+        processes.append(subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), "serve",
+            "--shard", os.path.join(root, shard["path"]), "--host", host, "--port", str(base_port + offset),
+        ]))
+    return processes
+
+
+# -------- Coordinator --------
+class ShardedSearch:
+    """
+    Scatter-gather search over shard servers.
+
+    Args:
+        shard_urls (Sequence[str]): Base URL of each shard server
+        embeddings: Embedding model; queries are embedded once, here
+        timeout (float): Seconds to wait for the shards; late or failed shards are skipped
+    """
+    def __init__(self, shard_urls: Sequence[str], embeddings, timeout: float = SHARD_TIMEOUT):
+        from resources import get_registry
+
+        self.shard_urls = [url.rstrip("/") for url in shard_urls]
+        self.embeddings = embeddings
+        self.timeout = timeout
+        self.session = get_registry().http_session()
+        self.executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.shard_urls)), thread_name_prefix="scatter")
+
+    def _query_shard(self, url: str, payload: Dict) -> List[List[Dict]]:
+        response = self.session.post(f"{url}/search", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["results"]
+
+    @staticmethod
+    def merge(shard_results: Sequence[List[Dict]], k: int) -> List[Dict]:
+        """Global top-k of per-shard lists that are each sorted by ascending distance."""
+        return list(itertools.islice(heapq.merge(*shard_results, key=lambda item: item["distance"]), k))
+
+    def search_vectors(self, query_vectors: np.ndarray, k: int = 30, nprobe: Optional[int] = None,
+                       ef_search: Optional[int] = None) -> List[List[Dict]]:
+        """Top-k items per query vector across all shards that answered in time."""
+        payload = {**encode_vectors(query_vectors), "k": k, "nprobe": nprobe, "ef_search": ef_search}
+        with telemetry.span("scatter_gather", shards=len(self.shard_urls), k=k, batch=len(query_vectors)):
+            futures = {telemetry.submit(self.executor, self._query_shard, url, payload): url
+                       for url in self.shard_urls}
+            done, not_done = wait(futures, timeout=self.timeout)
+            for future in not_done:
+                future.cancel()
+
+            answered = []
+            for future in done:
+                try:
+                    answered.append(future.result())
+                except Exception as e:
+                    print(f"Shard {futures[future]} failed: {e}")
+            missing = len(self.shard_urls) - len(answered)
+            telemetry.annotate(shards_answered=len(answered), shards_missing=missing)
+            if missing:
+                telemetry.METRICS.inc("shard_misses_total", missing)
+
+        return [self.merge([shard[row] for shard in answered], k) for row in range(len(query_vectors))]
+
+    def search(self, query: str, k: int = 30, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> List[Dict]:
+        query_vector = np.asarray([self.embeddings.embed_query(query)], dtype="float32")
+        return self.search_vectors(query_vector, k=k, nprobe=nprobe, ef_search=ef_search)[0]
+
+    def search_many(self, query_vectors: np.ndarray, k: int = 30, nprobe: Optional[int] = None,
+                    ef_search: Optional[int] = None) -> List[List[Dict]]:
+        return self.search_vectors(query_vectors, k=k, nprobe=nprobe, ef_search=ef_search)
+
+    def health(self) -> Iterator[Dict]:
+        for url in self.shard_urls:
+            try:
+                yield {"url": url, **self.session.get(f"{url}/health", timeout=self.timeout).json()}
+            except Exception as e:
+                yield {"url": url, "error": str(e)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partition, serve and query a sharded vector store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    partition = commands.add_parser("partition", help="Split a store into shards")
+    partition.add_argument("--store", default="vector_store")
+    partition.add_argument("--output", default="vector_store_partitions")
+    partition.add_argument("--shards", type=int, default=4)
+    partition.add_argument("--index-type", default=None, choices=list(ann_index.INDEX_TYPES),
+                           help="Index type of each shard (default: the store's)")
+
+    serve = commands.add_parser("serve", help="Serve one shard over HTTP")
+    serve.add_argument("--shard", required=True)
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8101)
+    serve.add_argument("--workers", type=int, default=4, help="Search threads")
+
+    launch = commands.add_parser("launch", help="Serve every shard of a partition as local processes")
+    launch.add_argument("--root", default="vector_store_partitions")
+    launch.add_argument("--host", default="127.0.0.1")
+    launch.add_argument("--base-port", type=int, default=8101)
+    args = parser.parse_args()
+
+    if args.command == "partition":
+        manifest = partition_store(args.store, args.output, args.shards, index_type=args.index_type)
+        print(f"{manifest['vectors']} vectors in {len(manifest['shards'])} shards written to {args.output}")
+    elif args.command == "serve":
+        from aiohttp import web
+        web.run_app(create_shard_app(args.shard, workers=args.workers), host=args.host, port=args.port)
+    else:
+        processes = launch_local_workers(args.root, base_port=args.base_port, host=args.host)
+        urls = ",".join(f"http://{args.host}:{args.base_port + i}" for i in range(len(processes)))
+        print(f"SHARD_URLS={urls}")
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
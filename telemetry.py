@@ -0,0 +1,379 @@
+"""
+Per-stage tracing and in-process metrics for the recommendation pipeline.
+
+A trace covers one user request; spans time the stages inside it (rephrase,
+embed_query, dense_search, llm.rerank, catalog_fetch, ...). The current
+trace and span are carried in contextvars, so nested calls attach to the
+right parent. Work handed to a thread pool keeps its trace when submitted
+with `submit`.
+
+Metrics (exported as Prometheus text on METRICS_PORT at /metrics):
+- stage_seconds: histogram per span name
+- stage_errors_total: spans that raised, per span name
+- retries_total: tenacity retries per operation (see `count_retries`)
+- llm_tokens_total: Groq token usage per operation and kind (see `record_usage`)
+- llm_http_responses_total: HTTP statuses seen by the Groq client, including its own retries
+- errors_reported_total: failures handled by falling back, per operation (see `report_error`)
+- cache_hits_total / cache_misses_total / cache_hit_ratio: from ResourceRegistry.cache_stats
+
+With TRACE_LOG set, every finished trace is also appended to that file as one JSON line.
+"""
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+
+# Port of the Prometheus endpoint (0 disables it)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# JSONL file finished traces are appended to (empty disables it)
+TRACE_LOG = os.getenv("TRACE_LOG", "")
+RECENT_TRACES = 100
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_PREFIX = "recommender_"
+METRIC_HELP = {
+    "stage_seconds": ("histogram", "Duration of each pipeline stage"),
+    "stage_errors_total": ("counter", "Stages that raised an exception"),
+    "retries_total": ("counter", "Retries scheduled by tenacity, per operation"),
+    "llm_tokens_total": ("counter", "Groq tokens used, per operation and kind"),
+    "llm_http_responses_total": ("counter", "HTTP responses received by the Groq client, per status"),
+    "errors_reported_total": ("counter", "Failures handled by falling back, per operation"),
+}
+
+_span_ids = itertools.count(1)
+
+
+@dataclass
+class Span:
+    """One timed stage. `start` is relative to the start of its trace."""
+    name: str
+    start: float
+    span_id: int
+    parent_id: Optional[int] = None
+    duration: float = 0.0
+    thread: str = ""
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class Trace:
+    """All spans of one request, plus per-request counters (retries, tokens)."""
+    name: str
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    started: float = field(default_factory=time.perf_counter)
+    timestamp: float = field(default_factory=time.time)
+    duration: float = 0.0
+    spans: List[Span] = field(default_factory=list)
+    counters: Dict[str, float] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-friendly form with spans in start order and their nesting depth."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+            counters = dict(self.counters)
+        depth = {}
+        for span in spans:
+            depth[span.span_id] = depth[span.parent_id] + 1 if span.parent_id in depth else 0
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "timestamp": self.timestamp,
+            "duration": round(self.duration, 6),
+            "counters": counters,
+            "spans": [
+                {
+                    "name": span.name,
+                    "start": round(span.start, 6),
+                    "duration": round(span.duration, 6),
+                    "depth": depth[span.span_id],
+                    "thread": span.thread,
+                    "error": span.error,
+                    "attributes": span.attributes,
+                }
+                for span in spans
+            ],
+        }
+
+
+class Metrics:
+    """Thread-safe labelled counters and histograms."""
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], List] = {}  # key -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple]:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    @staticmethod
+    def _labels(labels: Tuple, **extra) -> str:
+        pairs = list(labels) + [(k, str(v)) for k, v in extra.items()]
+        if not pairs:
+            return ""
+        escaped = (f'{k}="{_escape(v)}"' for k, v in pairs)
+        return "{" + ",".join(escaped) + "}"
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format, including the registry's cache stats."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: [list(h[0]), h[1], h[2]] for key, h in self._histograms.items()}
+
+        lines = []
+        counter_names = {name for name, _ in counters}
+        for name in sorted(counter_names | {name for name, _ in histograms}):
+            kind, description = METRIC_HELP.get(name, ("counter" if name in counter_names else "histogram", name))
+            lines.append(f"# HELP {METRIC_PREFIX}{name} {description}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{METRIC_PREFIX}{name}{self._labels(labels)} {value:g}")
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{self._labels(labels, le=bound)} {bucket_count}")
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{self._labels(labels, le='+Inf')} {count}")
+                lines.append(f"{METRIC_PREFIX}{name}_sum{self._labels(labels)} {total:g}")
+                lines.append(f"{METRIC_PREFIX}{name}_count{self._labels(labels)} {count}")
+
+        lines.extend(_cache_lines())
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _cache_lines() -> List[str]:
+    from resources import get_registry
+
+    stats = get_registry().cache_stats()
+    if not stats:
+        return []
+    lines = []
+    for metric, field_name, kind in (("cache_hits_total", "hits", "counter"),
+                                     ("cache_misses_total", "misses", "counter"),
+                                     ("cache_hit_ratio", "hit_rate", "gauge")):
+        lines.append(f"# TYPE {METRIC_PREFIX}{metric} {kind}")
+        for cache, values in stats.items():
+            lines.append(f'{METRIC_PREFIX}{metric}{{cache="{_escape(cache)}"}} {values[field_name]:g}')
+    return lines
+
+
+METRICS = Metrics()
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("span", default=None)
+_recent: Deque[Dict[str, Any]] = deque(maxlen=RECENT_TRACES)
+_log_lock = threading.Lock()
+
+
+# -------- Tracing --------
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """
+    Time a stage. Always feeds the stage_seconds histogram; also recorded
+    in the current trace when there is one.
+    """
+    trace_ = _current_trace.get()
+    parent = _current_span.get()
+    started = time.perf_counter()
+    record = Span(
+        name=name,
+        start=started - trace_.started if trace_ is not None else 0.0,
+        span_id=next(_span_ids),
+        parent_id=parent.span_id if parent is not None else None,
+        thread=threading.current_thread().name,
+        attributes=attributes,
+    )
+    token = _current_span.set(record)
+    try:
+        yield record
+    except Exception as e:
+        record.error = type(e).__name__
+        METRICS.inc("stage_errors_total", stage=name)
+        raise
+    finally:
+        record.duration = time.perf_counter() - started
+        _current_span.reset(token)
+        METRICS.observe("stage_seconds", record.duration, stage=name)
+        if trace_ is not None:
+            trace_.add(record)
+
+
+@contextmanager
+def trace(name: str, **attributes) -> Iterator[Trace]:
+    """
+    Start a trace for one request. Inside an existing trace this only opens
+    a span, so instrumented entry points can be nested freely.
+    """
+    existing = _current_trace.get()
+    if existing is not None:
+        with span(name, **attributes):
+            yield existing
+        return
+
+    record = Trace(name=name)
+    trace_token = _current_trace.set(record)
+    span_token = _current_span.set(None)
+    try:
+        with span(name, **attributes):
+            yield record
+    finally:
+        record.duration = time.perf_counter() - record.started
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        _export(record)
+
+
+def annotate(**attributes) -> None:
+    """Attach attributes to the current span (no-op outside a span)."""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def submit(executor, fn, *args, **kwargs):
+    """`executor.submit` that carries the current trace and span into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# -------- Counters --------
+def count_retries(operation: str):
+    """tenacity `before_sleep` hook that counts retries of `operation`."""
+    def before_sleep(retry_state) -> None:
+        METRICS.inc("retries_total", operation=operation)
+        trace_ = _current_trace.get()
+        if trace_ is not None:
+            trace_.count(f"{operation}.retries")
+
+    return before_sleep
+
+
+def record_usage(operation: str, response) -> None:
+    """Token usage of a Groq chat-completions response, or of a streamed chunk (only the last one carries it)."""
+    usage = getattr(response, "usage", None) or getattr(getattr(response, "x_groq", None), "usage", None)
+    if usage is None:
+        return
+    tokens = {kind: getattr(usage, f"{kind}_tokens", None) or 0 for kind in ("prompt", "completion")}
+    for kind, value in tokens.items():
+        METRICS.inc("llm_tokens_total", value, operation=operation, kind=kind)
+    annotate(**{f"{kind}_tokens": value for kind, value in tokens.items()})
+    trace_ = _current_trace.get()
+    if trace_ is not None:
+        for kind, value in tokens.items():
+            trace_.count(f"{operation}.{kind}_tokens", value)
+
+
+def report_error(operation: str, message: str) -> None:
+    """
+    Count a failure that the caller recovers from, and surface it: in the Streamlit
+    page when called from the script thread, on stdout anywhere else (service
+    threads, batch jobs), where streamlit calls have no page to write to.
+    """
+    METRICS.inc("errors_reported_total", operation=operation)
+    annotate(error=message)
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        get_script_run_ctx = None
+    if get_script_run_ctx is not None and get_script_run_ctx() is not None:
+        import streamlit as st
+        st.error(message)
+    else:
+        print(message)
+
+
+def record_http_response(response) -> None:
+    """httpx response hook for the Groq client: counts statuses, so the client's own retries show up."""
+    METRICS.inc("llm_http_responses_total", status=response.status_code)
+
+
+# -------- Exporters --------
+def recent_traces() -> List[Dict[str, Any]]:
+    return list(_recent)
+
+
+def _export(record: Trace) -> None:
+    data = record.to_dict()
+    _recent.append(data)
+    if TRACE_LOG:
+        line = json.dumps(data, default=str)
+        with _log_lock, open(TRACE_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/metrics":
+            body, content_type = METRICS.render_prometheus(), "text/plain; version=0.0.4"
+        elif self.path.rstrip("/") == "/traces":
+            body, content_type = json.dumps(recent_traces(), default=str), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve /metrics (Prometheus text) and /traces (recent traces as JSON) on a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
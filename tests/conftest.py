@@ -0,0 +1,53 @@
+import hashlib
+import os
+import sys
+from typing import List, Sequence
+
+import numpy as np
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DIMENSION = 16
+
+
+class FakeEmbeddings:
+    """Deterministic unit vectors derived from the text, counting what was embedded."""
+    def __init__(self, dimension: int = DIMENSION):
+        self.dimension = dimension
+        self.embedded: List[str] = []
+
+    def vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype("float32")
+        return vector / np.linalg.norm(vector)
+
+    def embed_documents(self, texts: Sequence[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return [self.vector(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.vector(text).tolist()
+
+
+def write_mmap_store(path: str, texts: Sequence[str], embeddings: FakeEmbeddings,
+                     image_indexes: Sequence[int] = None, index_type: str = "flat", **build) -> None:
+    """An unversioned memory-mapped store, as bulid_vec_db writes it."""
+    import faiss
+    import ann_index
+    import mmap_store
+
+    os.makedirs(path, exist_ok=True)
+    vectors = np.asarray([embeddings.vector(text) for text in texts], dtype="float32")
+    image_indexes = list(range(len(texts))) if image_indexes is None else list(image_indexes)
+    index = ann_index.build_faiss_index(vectors, index_type, **build)
+    faiss.write_index(index, os.path.join(path, mmap_store.INDEX_FILE))
+    mmap_store.write_metadata(path, texts, image_indexes)
+    mmap_store.write_array(path, mmap_store.VECTORS_FILE, vectors)
+    ann_index.save_index_params(path, {"index_type": index_type, "build": build})
+
+
+@pytest.fixture
+def embeddings() -> FakeEmbeddings:
+    return FakeEmbeddings()
@@ -0,0 +1,79 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import disk_cache
+from disk_cache import DiskCache
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """Strictly increasing access times, so LRU order doesn't depend on the clock's resolution."""
+    ticks = itertools.count(1)
+    monkeypatch.setattr(disk_cache, "time", SimpleNamespace(time=lambda: float(next(ticks))))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache" / "descriptions.sqlite"), max_bytes=10)
+    yield cache
+    cache._conn.close()
+
+
+def test_round_trip_bytes_and_text(cache):
+    cache.set("image", b"\x00\x01")
+    cache.set("caption", "jumper")
+    assert cache.get("image") == b"\x00\x01"
+    assert cache.get_text("caption") == "jumper"
+    assert cache.get("missing") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_evicts_least_recently_used_beyond_max_bytes(cache):
+    cache.set("a", b"1234")
+    cache.set("b", b"1234")
+    cache.get("a")  # "b" is now the least recently used
+    cache.set("c", b"1234")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234"
+    assert cache.get("c") == b"1234"
+    assert cache.stats()["bytes"] == 8
+
+
+def test_evicts_as_many_entries_as_needed(cache):
+    for key in "abcde":
+        cache.set(key, b"12")
+    cache.set("big", b"123456789")
+    assert cache.stats()["entries"] == 1
+    assert cache.get("big") == b"123456789"
+
+
+def test_values_larger_than_the_cache_are_not_stored(cache):
+    cache.set("a", b"1234")
+    cache.set("huge", b"x" * 11)
+    assert cache.get("huge") is None
+    assert cache.get("a") == b"1234"
+
+
+def test_replacing_a_key_counts_its_size_once(cache):
+    cache.set("a", b"123456")
+    cache.set("a", b"1234")
+    cache.set("b", b"1234")
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"]) == (2, 8)
+
+
+def test_entries_persist_across_instances(tmp_path):
+    path = str(tmp_path / "descriptions.sqlite")
+    first = DiskCache(path)
+    first.set("caption", "red dress")
+    first._conn.close()
+
+    second = DiskCache(path)
+    assert second.get_text("caption") == "red dress"
+    second.clear()
+    assert second.get("caption") is None
+    second._conn.close()
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+import mmap_store
+from conftest import write_mmap_store
+from hybrid_retriever import (AttributeBitmaps, BM25Index, HybridRetriever, build_hybrid_index,
+                              extract_attributes, has_hybrid_index)
+
+CAPTIONS = [
+    "Black wool jumper for men with a ribbed collar.",
+    "Grey cotton jumper for women.",
+    "Red summer dress for women with thin straps.",
+    "Black leather jacket for men.",
+    "Blue denim jeans, slim fit.",
+    "Black jumper in soft black knit for kids.",
+]
+
+
+class FakeVectorManager:
+    """The parts of VectorStoreManager the retriever uses."""
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def documents_at(self, vs, positions):
+        return [vs.document_at(int(p)) for p in positions if p != -1]
+
+
+@pytest.fixture
+def retriever(tmp_path, embeddings):
+    path = str(tmp_path / "vector_store")
+    write_mmap_store(path, CAPTIONS, embeddings, image_indexes=range(100, 100 + len(CAPTIONS)))
+    build_hybrid_index(path, CAPTIONS)
+    vs = mmap_store.MmapVectorStore(path, embeddings)
+    return HybridRetriever(FakeVectorManager(embeddings), vs, path)
+
+
+def test_extract_attributes():
+    assert extract_attributes("A grey hoodie for men") == {
+        "color": {"grey"}, "product_type": {"hoodie"}, "gender": {"men"},
+    }
+    assert extract_attributes("something nice") == {}
+
+
+def test_bm25_ranks_by_term_frequency_and_rarity():
+    index = BM25Index.build(CAPTIONS)
+    # Both terms, with "black" twice, ranks above the other black jumper; single-term matches follow
+    assert index.search("black jumper", k=2) == [5, 0]
+    assert set(index.search("black jumper", k=10)) == {0, 1, 3, 5}
+    assert index.search("tuxedo", k=3) == []
+
+
+def test_bm25_only_returns_matching_documents():
+    index = BM25Index.build(CAPTIONS)
+    assert sorted(index.search("dress", k=10)) == [2]
+
+
+def test_bm25_search_respects_mask():
+    index = BM25Index.build(CAPTIONS)
+    mask = np.zeros(len(CAPTIONS), dtype=bool)
+    mask[[1, 3]] = True
+    assert set(index.search("black jumper", k=10, mask=mask)) == {1, 3}
+
+
+def test_bm25_round_trip(tmp_path):
+    index = BM25Index.build(CAPTIONS)
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+    np.testing.assert_allclose(loaded.scores("black wool jumper"), index.scores("black wool jumper"))
+
+
+def test_bitmap_mask_ors_values_and_ands_attributes():
+    bitmaps = AttributeBitmaps.build(CAPTIONS)
+    assert np.flatnonzero(bitmaps.mask({"color": ["black"]})).tolist() == [0, 3, 5]
+    assert np.flatnonzero(bitmaps.mask({"color": ["black", "grey"]})).tolist() == [0, 1, 3, 5]
+    assert np.flatnonzero(bitmaps.mask({"color": ["black"], "product_type": ["jumper"]})).tolist() == [0, 5]
+    assert np.flatnonzero(bitmaps.mask({"color": {"black"}, "gender": {"men"}})).tolist() == [0, 3]
+
+
+def test_bitmap_mask_with_unknown_value_matches_nothing():
+    bitmaps = AttributeBitmaps.build(CAPTIONS)
+    assert not bitmaps.mask({"color": ["gold"]}).any()
+    assert bitmaps.mask({}).all()
+
+
+def test_bitmaps_round_trip(tmp_path):
+    bitmaps = AttributeBitmaps.build(CAPTIONS)
+    bitmaps.save(str(tmp_path))
+    loaded = AttributeBitmaps.load(str(tmp_path))
+    assert loaded.counts() == bitmaps.counts()
+    assert loaded.counts()["color=black"] == 3
+
+
+def test_fuse_merges_dense_and_lexical_rankings(retriever):
+    fused = retriever._fuse("red dress", [4, 2, 0], k=3, mask=None)
+    # Position 2 is in both rankings, so it leads the fused list
+    assert [item["id"] for item in fused] == [102, 104, 100]
+    assert fused[0]["content"] == CAPTIONS[2]
+    assert all("rrf_score" in item for item in fused)
+
+
+def test_fuse_applies_mask_to_the_lexical_side(retriever):
+    mask = np.zeros(len(CAPTIONS), dtype=bool)
+    mask[[0, 3]] = True
+    fused = retriever._fuse("black jumper", [3, 0], k=5, mask=mask)
+    assert {item["id"] for item in fused} == {100, 103}
+
+
+def test_search_with_filters_only_returns_matches(retriever):
+    assert has_hybrid_index(retriever.vs.path)
+    results = retriever.search("warm jumper", k=5, filters={"color": ["black"], "product_type": ["jumper"]})
+    assert {item["id"] for item in results} == {100, 105}
+    assert retriever.search("warm jumper", k=5, filters={"color": ["gold"]}) == []
+
+
+def test_search_many_matches_search_and_groups_set_filters(retriever, embeddings):
+    queries = ["black jumper", "summer dress", "black jacket"]
+    filters = [{"color": {"black"}}, None, {"color": {"black"}}]
+    vectors = np.asarray([embeddings.embed_query(query) for query in queries], dtype="float32")
+    results = retriever.search_many(queries, vectors, k=3, filters=filters)
+    expected = [retriever.search(query, k=3, filters=query_filters)
+                for query, query_filters in zip(queries, filters)]
+    assert [[item["id"] for item in items] for items in results] == \
+        [[item["id"] for item in items] for items in expected]
@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+import time
+
+import faiss
+import numpy as np
+import pytest
+
+import index_versions
+import mmap_store
+from conftest import write_mmap_store
+from index_versions import VersionedStore, list_versions, resolve_store_path
+
+TEXTS = [f"black wool jumper {i}" for i in range(20)]
+
+
+@pytest.fixture
+def root(tmp_path, embeddings):
+    path = str(tmp_path / "vector_store")
+    write_mmap_store(path, TEXTS, embeddings)
+    return path
+
+
+def live_store(root: str, embeddings) -> mmap_store.MmapVectorStore:
+    return mmap_store.MmapVectorStore(resolve_store_path(root), embeddings)
+
+
+def test_unversioned_root_is_read_as_is(root):
+    assert resolve_store_path(root) == root
+    assert list_versions(root) == []
+
+
+def test_upsert_embeds_only_new_and_changed_captions(root, embeddings):
+    store = VersionedStore(root, embeddings)
+    version = store.upsert({3: "red silk dress", 100: "blue jeans", 4: TEXTS[4]})
+
+    assert version == "v000001"
+    assert resolve_store_path(root).endswith(os.path.join("versions", "v000001"))
+    assert sorted(embeddings.embedded) == ["blue jeans", "red silk dress"]
+
+    live = live_store(root, embeddings)
+    assert len(live) == len(TEXTS) + 2
+    assert live.tombstones.tolist() == [3]
+    assert live.get_by_image_index([3])[0].page_content == "red silk dress"
+    assert live.get_by_image_index([100])[0].page_content == "blue jeans"
+    assert live.get_by_image_index([4])[0].page_content == TEXTS[4]
+
+
+def test_apply_without_changes_writes_nothing(root, embeddings):
+    store = VersionedStore(root, embeddings)
+    assert store.apply(upserts={0: TEXTS[0]}, deletes=[999]) is None
+    assert list_versions(root) == []
+
+
+def test_delete_hides_items_from_search(root, embeddings):
+    store = VersionedStore(root, embeddings)
+    store.delete([5])
+
+    live = live_store(root, embeddings)
+    assert live.get_by_image_index([5]) == [None]
+    found = live.similarity_search(TEXTS[5], k=len(TEXTS))
+    assert 5 not in [doc.metadata["image_index"] for doc in found]
+
+
+def test_unpublished_version_is_not_live(root, embeddings):
+    store = VersionedStore(root, embeddings)
+    version = store.upsert({100: "blue jeans"}, publish=False)
+    assert version in list_versions(root)
+    assert resolve_store_path(root) == root
+
+    store.publish(version)
+    assert os.path.basename(resolve_store_path(root)) == version
+
+
+def test_compact_drops_tombstones_and_keeps_build_params(tmp_path, embeddings):
+    root = str(tmp_path / "ivf_store")
+    write_mmap_store(root, TEXTS, embeddings, index_type="ivf_flat", nlist=3)
+    store = VersionedStore(root, embeddings)
+    store.delete([1])
+    version = store.compact(background=False)
+
+    assert os.path.basename(resolve_store_path(root)) == version
+    live = live_store(root, embeddings)
+    assert len(live) == len(TEXTS) - 1
+    assert live.live_mask is None
+    assert live.get_by_image_index([1]) == [None]
+    assert faiss.extract_index_ivf(live.index).nlist == 3
+
+
+def test_publishing_a_version_built_from_a_superseded_one_is_refused(root, embeddings):
+    store = VersionedStore(root, embeddings)
+    stale = store.upsert({100: "blue jeans"}, publish=False)
+    live = store.upsert({101: "white sneakers"})
+
+    with pytest.raises(ValueError):
+        store.publish(stale)
+    assert os.path.basename(resolve_store_path(root)) == live
+
+
+def test_upsert_during_background_compaction_is_kept(root, embeddings, monkeypatch):
+    rebuilding, upserted = threading.Event(), threading.Event()
+    rebuild = index_versions.ann_index.rebuild_faiss_index
+
+    def slow_rebuild(vectors, params):
+        if not rebuilding.is_set():
+            rebuilding.set()
+            upserted.wait(timeout=10)
+        return rebuild(vectors, params)
+
+    monkeypatch.setattr(index_versions.ann_index, "rebuild_faiss_index", slow_rebuild)
+    store = VersionedStore(root, embeddings)
+    deleted = list(range(6))
+    store.delete(deleted)  # 6 of 20 tombstoned starts a background compaction
+    assert rebuilding.wait(timeout=10)
+
+    store.upsert({500: "green raincoat"})
+    upserted.set()
+    store.wait_for_compaction(timeout=30)
+
+    live = live_store(root, embeddings)
+    assert live.live_mask is None
+    assert len(live) == len(TEXTS) - len(deleted) + 1
+    assert live.get_by_image_index([500])[0].page_content == "green raincoat"
+    assert live.get_by_image_index(deleted) == [None] * len(deleted)
+
+
+def test_compact_without_tombstones_is_a_no_op(root, embeddings):
+    store = VersionedStore(root, embeddings)
+    store.upsert({100: "blue jeans"})
+    assert store.compact(background=False) is None
+
+
+def test_recluster_publishes_a_new_version(root, embeddings):
+    store = VersionedStore(root, embeddings)
+    first = store.delete([2])
+    version = store.recluster()
+
+    assert version != first
+    assert os.path.basename(resolve_store_path(root)) == version
+    assert not os.path.exists(os.path.join(root, "versions", first, mmap_store.CLUSTERS_FILE))
+    live = live_store(root, embeddings)
+    assert live.tombstones.tolist() == [2]
+    assert len(np.load(os.path.join(resolve_store_path(root), mmap_store.CLUSTERS_FILE))) == len(TEXTS)
+
+
+def test_prune_waits_for_the_grace_period(root, embeddings):
+    store = VersionedStore(root, embeddings, keep_versions=1, prune_grace=60)
+    store.upsert({100: "blue jeans"})
+    store.upsert({101: "white sneakers"})
+    store.upsert({102: "denim jacket"})
+    # Superseded less than a minute ago: still on disk for readers
+    assert list_versions(root) == ["v000001", "v000002", "v000003"]
+
+    published = store._published()
+    store._write_published({version: when - 120 for version, when in published.items()})
+    store._prune()
+    assert list_versions(root) == ["v000003"]
+    assert set(store._published()) == {"v000003"}
+
+
+def test_prune_never_removes_the_live_version(root, embeddings):
+    store = VersionedStore(root, embeddings, keep_versions=1, prune_grace=0)
+    first = store.upsert({100: "blue jeans"})
+    store.upsert({101: "white sneakers"}, publish=False)
+    store._write_published({first: time.time() - 3600})
+    store._prune()
+    assert first in list_versions(root)
+
+
+def test_prune_keeps_versions_without_a_publish_record(root, embeddings):
+    store = VersionedStore(root, embeddings, keep_versions=1, prune_grace=60)
+    store.upsert({100: "blue jeans"})
+    store.upsert({101: "white sneakers"})
+    os.remove(os.path.join(root, index_versions.PUBLISHED_FILE))
+    store.prune_grace = 0
+    store._prune()
+    assert list_versions(root) == ["v000001", "v000002"]
+
+
+def test_update_lock_is_exclusive(root):
+    with index_versions._UpdateLock(root):
+        with pytest.raises(TimeoutError):
+            with index_versions._UpdateLock(root, timeout=0.2):
+                pass
+    with index_versions._UpdateLock(root, timeout=0.2):
+        pass
+
+
+def test_stale_lock_file_is_broken(root, monkeypatch):
+    monkeypatch.setattr(index_versions, "fcntl", None)
+    lock_path = os.path.join(root, index_versions.LOCK_FILE)
+    with open(lock_path, "w", encoding="utf-8") as f:
+        json.dump({"pid": 0, "since": 0}, f)
+    old = time.time() - 7200
+    os.utime(lock_path, (old, old))
+
+    with index_versions._UpdateLock(root, timeout=1, stale_after=3600):
+        pass
+    assert not os.path.exists(lock_path)
@@ -0,0 +1,113 @@
+import time
+from types import SimpleNamespace
+
+from pipeline import RecommendationPipeline
+
+CATALOG = [{"id": i, "content": f"item {i}"} for i in range(10)]
+
+
+class FakeRephraser:
+    """Streams the rephrasing with a pause before each piece."""
+    def __init__(self, pieces, delays):
+        self.pieces = pieces
+        self.delays = delays
+
+    def rephrase_stream(self, query):
+        for piece, delay in zip(self.pieces, self.delays):
+            time.sleep(delay)
+            yield piece
+
+
+class FakeVectorDB:
+    def __init__(self, rephraser):
+        self.query_rephraser = rephraser
+
+    def search(self, query, k=30):
+        return CATALOG[:k]
+
+    def diversify(self, query, items):
+        return items
+
+
+class FakeLLMReranker:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def rerank_stream(self, query, candidates, n):
+        for item in reversed(candidates[-n:]):
+            time.sleep(self.delay)
+            yield item
+
+
+def make_pipeline(rephraser, llm_reranker, deadline, **kwargs):
+    recommender = SimpleNamespace(recommendations_object=FakeVectorDB(rephraser), reranker=None,
+                                  llm_reranker=llm_reranker, llm_candidates=10)
+    pipeline = RecommendationPipeline(recommender, deadline=deadline, **kwargs)
+    pipeline.llm_estimate.value = 0.05
+    return pipeline
+
+
+def run_stream(pipeline, query="black jumper", n=3, k=5):
+    started = time.perf_counter()
+    events = list(pipeline.stream(query, n=n, k=k))
+    return events, time.perf_counter() - started
+
+
+def test_stream_yields_intent_tokens_then_items_then_result():
+    pipeline = make_pipeline(FakeRephraser(["warm ", "black jumper"], [0.0, 0.0]), FakeLLMReranker(), deadline=5)
+    events, _ = run_stream(pipeline)
+
+    names = [name for name, _ in events]
+    assert names == ["intent_token", "intent_token", "intent", "item", "item", "item", "result"]
+    assert events[2][1] == "warm black jumper"
+    result = events[-1][1]
+    assert [item["id"] for item in result.recommendations["results"]] == ["4", "3", "2"]
+    assert "llm_rerank" in result.path
+
+
+def test_silent_rephrasing_is_abandoned_at_the_deadline():
+    rephraser = FakeRephraser(["warm ", "black jumper"], [0.0, 1.5])
+    pipeline = make_pipeline(rephraser, FakeLLMReranker(), deadline=0.8)
+    events, elapsed = run_stream(pipeline)
+
+    assert elapsed < 1.2
+    names = [name for name, _ in events]
+    assert names[:3] == ["intent_token", "intent_discarded", "intent"]
+    assert events[1][1] == "deadline"
+    assert events[2][1] == "black jumper"
+    assert "rephrase_skipped" in events[-1][1].path
+
+
+def test_slow_llm_rerank_is_filled_up_from_the_local_ranking():
+    pipeline = make_pipeline(FakeRephraser(["black jumper"], [0.0]), FakeLLMReranker(delay=1.5), deadline=0.8)
+    events, elapsed = run_stream(pipeline)
+
+    assert elapsed < 1.2
+    items = [value for name, value in events if name == "item"]
+    assert [item["id"] for item in items] == [0, 1, 2]
+    assert "llm_rerank_timeout" in events[-1][1].path
+
+
+def test_failed_rephrasing_falls_back_to_the_raw_query():
+    class FailingRephraser:
+        def rephrase_stream(self, query):
+            yield "warm "
+            raise RuntimeError("stream broke")
+
+    pipeline = make_pipeline(FailingRephraser(), FakeLLMReranker(), deadline=5)
+    events, _ = run_stream(pipeline)
+    assert ("intent_discarded", "error") in events
+    assert ("intent", "black jumper") in events
+
+
+def test_abandoned_llm_calls_make_later_requests_skip_the_stage():
+    pipeline = make_pipeline(FakeRephraser(["black jumper"], [0.0]), FakeLLMReranker(delay=1.5), deadline=0.5,
+                             llm_stage_slots=1)
+    first, _ = run_stream(pipeline)
+    assert "llm_rerank_timeout" in first[-1][1].path
+
+    # The first request's LLM call is still running and holds the only slot
+    second, elapsed = run_stream(pipeline)
+    assert elapsed < 0.5
+    assert "llm_rerank_skipped" in second[-1][1].path
+    assert [value["id"] for name, value in second if name == "item"] == [0, 1, 2]
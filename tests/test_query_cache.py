@@ -0,0 +1,109 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import query_cache
+from query_cache import CachedEmbeddings, LRUCache, SemanticCache, normalize_query
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A manual monotonic clock for TTL tests."""
+    now = [1000.0]
+    monkeypatch.setattr(query_cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_normalize_query():
+    assert normalize_query("  Black   Jumper\n") == "black jumper"
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_lru_overwrite_refreshes_entry():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("a", 10)
+    cache.set("c", 3)
+    assert cache.get("a") == 10
+    assert cache.get("b") is None
+
+
+def test_lru_ttl(clock):
+    cache = LRUCache(ttl=10)
+    cache.set("a", 1)
+    clock[0] += 9
+    assert cache.get("a") == 1
+    clock[0] += 2
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lru_stats():
+    cache = LRUCache()
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_semantic_cache_hits_similar_embeddings():
+    cache = SemanticCache(threshold=0.95)
+    cache.set([1.0, 0.0, 0.0], "jumpers")
+    assert cache.get([2.0, 0.1, 0.0]) == "jumpers"  # scale doesn't matter, only the angle
+    assert cache.get([0.7, 0.7, 0.0]) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_semantic_cache_returns_the_closest_entry():
+    cache = SemanticCache(threshold=0.9)
+    cache.set([1.0, 0.0], "first")
+    cache.set([0.98, 0.2], "second")
+    assert cache.get([0.97, 0.25]) == "second"
+
+
+def test_semantic_cache_drops_oldest_beyond_maxsize():
+    cache = SemanticCache(threshold=0.99, maxsize=2)
+    for i, vector in enumerate(np.eye(3)):
+        cache.set(vector, i)
+    assert len(cache) == 2
+    assert cache.get([1.0, 0.0, 0.0]) is None
+    assert cache.get([0.0, 0.0, 1.0]) == 2
+
+
+def test_semantic_cache_ttl(clock):
+    cache = SemanticCache(threshold=0.99, ttl=5)
+    cache.set([1.0, 0.0], "old")
+    clock[0] += 6
+    assert cache.get([1.0, 0.0]) is None
+
+
+def test_semantic_cache_rejects_bad_threshold():
+    with pytest.raises(ValueError):
+        SemanticCache(threshold=0.0)
+
+
+def test_cached_embeddings_reuses_cached_vectors(embeddings):
+    cached = CachedEmbeddings(embeddings)
+    first = cached.embed_query("black jumper")
+    assert cached.embed_query("black jumper") == first
+
+    vectors = cached.embed_queries(["black jumper", "red dress", "red dress"])
+    assert vectors[0] == first
+    assert vectors[1] == vectors[2]
+    # Only the uncached queries go to the model, in one batch
+    assert embeddings.embedded == ["red dress", "red dress"]
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter
+
+
+class FakeClock:
+    """monotonic() and sleep() for the limiter: sleeping advances the clock instead of blocking."""
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+def test_burst_is_served_immediately(clock):
+    limiter = RateLimiter(rate=2, burst=3)
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.slept == []
+
+
+def test_acquisitions_beyond_the_burst_are_paced(clock):
+    limiter = RateLimiter(rate=4)
+    started = clock.now
+    for _ in range(4 + 8):
+        limiter.acquire()
+    # The first 4 come from the bucket, the next 8 at 4 per second
+    assert clock.now - started == pytest.approx(2.0)
+
+
+def test_idle_time_refills_up_to_capacity(clock):
+    limiter = RateLimiter(rate=1, burst=2)
+    limiter.acquire()
+    limiter.acquire()
+    clock.now += 60
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.slept == []
+    limiter.acquire()
+    assert sum(clock.slept) == pytest.approx(1.0)
+
+
+def test_burst_defaults_to_one_second_of_requests():
+    assert RateLimiter(rate=5).capacity == 5
+    assert RateLimiter(rate=0.5).capacity == 1
+
+
+def test_rate_must_be_positive():
+    with pytest.raises(ValueError):
+        RateLimiter(rate=0)
+
+
+def test_threads_share_the_budget():
+    limiter = RateLimiter(rate=50, burst=1)
+    started = time.monotonic()
+    threads = [threading.Thread(target=lambda: [limiter.acquire() for _ in range(5)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 20 acquisitions, one from the bucket and 19 at 50 per second
+    assert time.monotonic() - started >= 19 / 50 * 0.9
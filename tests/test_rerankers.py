@@ -0,0 +1,116 @@
+from types import SimpleNamespace
+
+from conftest import write_mmap_store
+from diversity import Diversifier
+from mmap_store import MmapVectorStore
+from rerankers import BiEncoderReranker, IncrementalIdParser, LLMReranker
+
+
+def feed_all(pieces):
+    parser = IncrementalIdParser()
+    return [parser.feed(piece) for piece in pieces]
+
+
+def test_ids_in_one_piece():
+    assert feed_all(['{"results": [{"id": "12"}, {"id": "7"}]}']) == [["12", "7"]]
+
+
+def test_quoted_id_split_across_chunks():
+    pieces = ['{"results": [{"i', 'd": "1', '23"', '}, {"id":', ' "45"}]}']
+    assert feed_all(pieces) == [[], [], ["123"], [], ["45"]]
+
+
+def test_unquoted_id_waits_for_its_delimiter():
+    # "12" could still become "123" until a delimiter arrives
+    assert feed_all(['{"results": [{"id": 12', '3', '}, {"id": 4', "5}]}"]) == [[], [], ["123"], ["45"]]
+
+
+def test_ids_are_reported_once():
+    parser = IncrementalIdParser()
+    assert parser.feed('[{"id": "1"}, ') == ["1"]
+    assert parser.feed('{"id": "2"}') == ["2"]
+    assert parser.feed("]") == []
+
+
+def test_ignores_other_fields():
+    assert feed_all(['[{"reason": "matches \\"id\\"", "id": "9", "score": 3}]']) == [["9"]]
+
+
+class FakeStream:
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.closed = False
+
+    def __iter__(self):
+        for piece in self.pieces:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    def __init__(self, pieces):
+        self.stream = FakeStream(pieces)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        self.requests.append(request)
+        return self.stream
+
+
+CANDIDATES = [{"id": i, "content": f"item {i}"} for i in range(1, 6)]
+
+
+def test_rerank_stream_yields_known_ids_once_and_stops_at_n():
+    client = FakeClient(['{"results": [{"id": "3"}, {"id": "99"}, ', '{"id": "3"}, {"id": "1', '"}, {"id": "5"}]}'])
+    reranker = LLMReranker(client)
+    items = list(reranker.rerank_stream("query", CANDIDATES, n=2))
+
+    assert [item["id"] for item in items] == [3, 1]
+    assert [item["score"] for item in items] == [2.0, 1.0]
+    assert client.requests[0]["stream"] is True
+    assert client.stream.closed
+
+
+def test_rerank_stream_without_candidates_makes_no_call():
+    client = FakeClient([])
+    assert list(LLMReranker(client).rerank_stream("query", [], n=2)) == []
+    assert client.requests == []
+
+
+def bi_encoder(monkeypatch, embeddings, store=None, **kwargs):
+    reranker = BiEncoderReranker(embeddings, **kwargs)
+    monkeypatch.setattr(reranker, "_store", lambda: store)
+    return reranker
+
+
+def test_bi_encoder_reads_caption_vectors_from_the_store(monkeypatch, tmp_path, embeddings):
+    path = str(tmp_path / "vector_store")
+    write_mmap_store(path, [f"item {i}" for i in range(1, 6)], embeddings, image_indexes=range(1, 6))
+    store = Diversifier(MmapVectorStore(path, embeddings), embeddings, path)
+    reranker = bi_encoder(monkeypatch, embeddings, store)
+
+    candidates = CANDIDATES + [{"id": 42, "content": "not in the store"}]
+    assert len(reranker.rerank("item 3", candidates, n=3)) == 3
+    assert embeddings.embedded == ["not in the store"]
+
+
+def test_bi_encoder_embeds_an_updated_caption_again(monkeypatch, embeddings):
+    reranker = bi_encoder(monkeypatch, embeddings)
+    reranker.rerank("query", [{"id": 1, "content": "red dress"}], n=1)
+    reranker.rerank("query", [{"id": 1, "content": "red dress"}], n=1)
+    reranker.rerank("query", [{"id": 1, "content": "blue dress"}], n=1)
+    assert embeddings.embedded == ["red dress", "blue dress"]
+
+
+def test_bi_encoder_keeps_the_retrieval_order_on_ties(monkeypatch, embeddings):
+    candidates = [{"id": 1, "content": "black jumper"}, {"id": 2, "content": "white sneakers"}]
+    # Cosine ranks the second candidate first, retrieval the first: the fused scores tie
+    fused = bi_encoder(monkeypatch, embeddings).rerank("white sneakers", candidates, n=2)
+    assert [item["id"] for item in fused] == [1, 2]
+    assert fused[0]["score"] == fused[1]["score"]
+
+    cosine_only = bi_encoder(monkeypatch, embeddings, retrieval_weight=0.0).rerank("white sneakers", candidates, n=2)
+    assert [item["id"] for item in cosine_only] == [2, 1]
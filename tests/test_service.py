@@ -0,0 +1,157 @@
+import asyncio
+import sys
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import telemetry
+from disk_cache import DiskCache
+from service import MicroBatcher, RecommendationService, run_in_thread
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=2)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+class RecordingBatchFn:
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, items):
+        with self.lock:
+            self.batches.append(list(items))
+        return [item * 10 for item in items]
+
+
+def test_concurrent_submits_share_one_batch(executor):
+    batch_fn = RecordingBatchFn()
+
+    async def main():
+        batcher = MicroBatcher(batch_fn, executor, max_size=32, max_wait=0.05)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(5))), batcher.stats()
+
+    results, stats = asyncio.run(main())
+    assert results == [0, 10, 20, 30, 40]
+    assert batch_fn.batches == [[0, 1, 2, 3, 4]]
+    assert stats == {"batches": 1, "items": 5, "mean_batch_size": 5.0}
+
+
+def test_full_batch_is_flushed_without_waiting(executor):
+    batch_fn = RecordingBatchFn()
+
+    async def main():
+        batcher = MicroBatcher(batch_fn, executor, max_size=2, max_wait=10)
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(4))), timeout=2)
+
+    assert asyncio.run(main()) == [0, 10, 20, 30]
+    assert batch_fn.batches == [[0, 1], [2, 3]]
+
+
+def test_sequential_submits_are_not_delayed_past_max_wait(executor):
+    batch_fn = RecordingBatchFn()
+
+    async def main():
+        batcher = MicroBatcher(batch_fn, executor, max_size=32, max_wait=0.01)
+        return [await batcher.submit(1), await batcher.submit(2)]
+
+    assert asyncio.run(main()) == [10, 20]
+    assert batch_fn.batches == [[1], [2]]
+
+
+def test_batch_errors_reach_every_caller_and_the_batcher_recovers(executor):
+    calls = []
+
+    def batch_fn(items):
+        calls.append(items)
+        if len(calls) == 1:
+            raise RuntimeError("index unavailable")
+        return items
+
+    async def main():
+        batcher = MicroBatcher(batch_fn, executor, max_size=32, max_wait=0.02)
+        failed = await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+        return failed, await batcher.submit("c")
+
+    failed, recovered = asyncio.run(main())
+    assert [str(error) for error in failed] == ["index unavailable", "index unavailable"]
+    assert recovered == "c"
+
+
+def test_short_batch_results_fail_every_caller(executor):
+    async def main():
+        batcher = MicroBatcher(lambda items: items[:1], executor, max_size=32, max_wait=0.02)
+        return await asyncio.wait_for(asyncio.gather(batcher.submit("a"), batcher.submit("b"),
+                                                     return_exceptions=True), timeout=2)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_run_in_thread_keeps_the_trace(executor):
+    async def main():
+        with telemetry.trace("request") as trace:
+            seen = await run_in_thread(executor, telemetry.current_trace)
+        return trace, seen
+
+    trace, seen = asyncio.run(main())
+    assert seen is trace
+
+
+def test_report_error_off_the_script_thread_prints_and_counts(monkeypatch, capsys):
+    monkeypatch.setattr(telemetry, "METRICS", telemetry.Metrics())
+    telemetry.report_error("rephrase", "rephrasing failed")
+
+    assert "rephrasing failed" in capsys.readouterr().out
+    assert 'recommender_errors_reported_total{operation="rephrase"} 1' in telemetry.METRICS.render_prometheus()
+
+
+class UntouchableStreamlit(types.ModuleType):
+    """Stands in for streamlit and records any use of it."""
+    def __init__(self):
+        super().__init__("streamlit")
+        self.touched = []
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        self.touched.append(name)
+        raise RuntimeError(f"streamlit.{name} used off the script thread")
+
+
+@pytest.fixture
+def untouchable_streamlit(monkeypatch):
+    streamlit = UntouchableStreamlit()
+    monkeypatch.setitem(sys.modules, "streamlit", streamlit)
+    previous = sys.modules.pop("Get_Ai_Image_Description", None)
+    import Get_Ai_Image_Description
+    yield streamlit, Get_Ai_Image_Description
+    sys.modules.pop("Get_Ai_Image_Description", None)
+    if previous is not None:
+        sys.modules["Get_Ai_Image_Description"] = previous
+
+
+def test_describe_does_not_touch_streamlit(monkeypatch, tmp_path, executor, untouchable_streamlit):
+    streamlit, describe_module = untouchable_streamlit
+    response = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="A red dress"))])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **request: response)))
+    monkeypatch.setenv("GROQ_API_KEY", "test-key")
+    monkeypatch.setattr(describe_module, "get_registry", lambda: SimpleNamespace(groq_client=lambda api_key: client))
+    cache = DiskCache(str(tmp_path / "descriptions.sqlite"))
+    monkeypatch.setattr(describe_module, "get_description_cache", lambda: cache)
+
+    async def main():
+        service = RecommendationService.__new__(RecommendationService)
+        service.executor = executor
+        service.llm_slots = asyncio.Semaphore(1)
+        return await service.describe(image_url="https://example.com/dress.jpg")
+
+    assert asyncio.run(main()) == "A red dress"
+    assert streamlit.touched == []
+    cache._conn.close()
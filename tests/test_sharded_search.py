@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import ann_index
+import mmap_store
+from conftest import write_mmap_store
+from index_versions import VersionedStore
+from sharded_search import (MANIFEST_FILE, ShardedSearch, create_shard_app, decode_vectors, encode_vectors,
+                            partition_store)
+
+TEXTS = [f"catalog item {i}" for i in range(30)]
+
+
+@pytest.fixture
+def store(tmp_path, embeddings):
+    path = str(tmp_path / "vector_store")
+    write_mmap_store(path, TEXTS, embeddings, image_indexes=range(100, 130))
+    return path
+
+
+def item(item_id, distance):
+    return {"id": item_id, "content": f"item {item_id}", "distance": distance}
+
+
+def test_vectors_round_trip():
+    vectors = np.random.default_rng(0).standard_normal((3, 8)).astype("float32")
+    np.testing.assert_array_equal(decode_vectors(json.loads(json.dumps(encode_vectors(vectors)))), vectors)
+
+
+def test_partition_drops_tombstones_and_splits_round_robin(tmp_path, store, embeddings):
+    VersionedStore(store, embeddings).delete([103])
+    output = str(tmp_path / "partitions")
+    manifest = partition_store(store, output, num_shards=3)
+
+    assert manifest["vectors"] == 29
+    assert [shard["vectors"] for shard in manifest["shards"]] == [10, 10, 9]
+    with open(os.path.join(output, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        assert json.load(f) == manifest
+
+    ids = []
+    for shard in manifest["shards"]:
+        shard_store = mmap_store.MmapVectorStore(os.path.join(output, shard["path"]))
+        ids.extend(int(i) for i in shard_store.image_indexes)
+        assert len(shard_store) == shard["vectors"]
+    assert sorted(ids) == [i for i in range(100, 130) if i != 103]
+
+
+def test_partition_keeps_the_store_build_params(tmp_path, embeddings):
+    path = str(tmp_path / "ivf_store")
+    write_mmap_store(path, TEXTS * 4, embeddings, index_type="ivf_flat", nlist=2)
+    manifest = partition_store(path, str(tmp_path / "partitions"), num_shards=2)
+
+    shard_path = os.path.join(str(tmp_path / "partitions"), manifest["shards"][0]["path"])
+    params = ann_index.load_index_params(shard_path)
+    assert params["index_type"] == "ivf_flat"
+    assert params["build"] == {"nlist": 2}
+
+
+def test_merge_keeps_global_distance_order():
+    merged = ShardedSearch.merge([[item(1, 0.1), item(2, 0.5)], [item(3, 0.2), item(4, 0.3)], []], k=3)
+    assert [entry["id"] for entry in merged] == [1, 3, 4]
+
+
+def make_coordinator(monkeypatch, embeddings, shards, timeout=0.3):
+    """A coordinator whose shards are local functions instead of HTTP servers."""
+    search = ShardedSearch(list(shards), embeddings, timeout=timeout)
+
+    def query_shard(url, payload):
+        return shards[url](decode_vectors(payload))
+
+    monkeypatch.setattr(search, "_query_shard", query_shard)
+    return search
+
+
+def test_search_merges_answering_shards(monkeypatch, embeddings):
+    shards = {
+        "http://a": lambda vectors: [[item(1, 0.4), item(2, 0.9)] for _ in vectors],
+        "http://b": lambda vectors: [[item(3, 0.1), item(4, 0.5)] for _ in vectors],
+    }
+    search = make_coordinator(monkeypatch, embeddings, shards)
+    assert [entry["id"] for entry in search.search("query", k=3)] == [3, 1, 4]
+
+    batch = search.search_many(np.zeros((2, 16), dtype="float32"), k=2)
+    assert [[entry["id"] for entry in row] for row in batch] == [[3, 1], [3, 1]]
+
+
+def test_late_and_failing_shards_are_skipped(monkeypatch, embeddings):
+    def slow(vectors):
+        time.sleep(1.0)
+        return [[item(9, 0.0)] for _ in vectors]
+
+    def broken(vectors):
+        raise ConnectionError("shard down")
+
+    shards = {
+        "http://fast": lambda vectors: [[item(1, 0.4), item(2, 0.9)] for _ in vectors],
+        "http://slow": slow,
+        "http://broken": broken,
+    }
+    search = make_coordinator(monkeypatch, embeddings, shards, timeout=0.2)
+    started = time.perf_counter()
+    results = search.search("query", k=5)
+
+    assert time.perf_counter() - started < 0.8
+    assert [entry["id"] for entry in results] == [1, 2]
+
+
+def test_search_with_no_shard_answering_is_empty(monkeypatch, embeddings):
+    def broken(vectors):
+        raise ConnectionError("shard down")
+
+    search = make_coordinator(monkeypatch, embeddings, {"http://a": broken})
+    assert search.search("query", k=5) == []
+
+
+@pytest.fixture
+def shard_servers(tmp_path, store):
+    """Every shard of the store served over HTTP on an ephemeral port, from one event loop thread."""
+    from aiohttp import web
+
+    manifest = partition_store(store, str(tmp_path / "partitions"), num_shards=2)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def start(shard_path):
+        runner = web.AppRunner(create_shard_app(shard_path))
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return runner, f"http://127.0.0.1:{port}"
+
+    started = [asyncio.run_coroutine_threadsafe(start(os.path.join(str(tmp_path / "partitions"), shard["path"])),
+                                                loop).result(timeout=10)
+               for shard in manifest["shards"]]
+    yield [url for _, url in started]
+
+    for runner, _ in started:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(timeout=10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=10)
+
+
+def test_scatter_gather_matches_a_single_index(shard_servers, store, embeddings):
+    search = ShardedSearch(shard_servers, embeddings, timeout=5)
+    assert [entry["vectors"] for entry in search.health()] == [15, 15]
+
+    reference = mmap_store.MmapVectorStore(store, embeddings)
+    for query in ("catalog item 7", "catalog item 21"):
+        expected = [doc.metadata["image_index"] for doc in reference.similarity_search(query, k=5)]
+        assert [entry["id"] for entry in search.search(query, k=5)] == expected
@@ -0,0 +1,109 @@
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("streamlit")
+from bulid_vec_db import StreamingIndexBuilder  # noqa: E402
+
+ROWS = [f"caption {i}" for i in range(10)]
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def builder(tmp_path, embeddings):
+    manager = SimpleNamespace(embeddings=embeddings)
+    return StreamingIndexBuilder(manager, checkpoint_dir=str(tmp_path / "shards"), shard_size=4, batch_size=3)
+
+
+def stream_rows(monkeypatch, builder, rows, fail_after_chunks=None):
+    """Feed `rows` to the builder in place of the Hugging Face dataset, optionally dying mid-stream."""
+    skips = []
+
+    def iter_chunks(dataset_name, split, text_column, skip):
+        skips.append(skip)
+        remaining = rows[skip:]
+        for n, start in enumerate(range(0, len(remaining), builder.shard_size)):
+            if fail_after_chunks is not None and n == fail_after_chunks:
+                raise Interrupted()
+            yield remaining[start:start + builder.shard_size]
+
+    monkeypatch.setattr(builder, "_iter_chunks", iter_chunks)
+    return skips
+
+
+def test_build_writes_shards_and_manifest(monkeypatch, builder, embeddings):
+    stream_rows(monkeypatch, builder, ROWS)
+    manifest = builder.encode_dataset()
+
+    assert manifest["complete"]
+    assert manifest["rows"] == 10
+    assert [shard["count"] for shard in manifest["shards"]] == [4, 4, 2]
+    assert manifest["dimension"] == embeddings.dimension
+    assert embeddings.embedded == ROWS
+
+
+def test_interrupted_build_resumes_after_the_last_shard(monkeypatch, builder, embeddings):
+    stream_rows(monkeypatch, builder, ROWS, fail_after_chunks=2)
+    with pytest.raises(Interrupted):
+        builder.encode_dataset()
+
+    manifest = builder.load_manifest()
+    assert manifest["rows"] == 8
+    assert not manifest.get("complete")
+
+    embeddings.embedded.clear()
+    skips = stream_rows(monkeypatch, builder, ROWS)
+    manifest = builder.encode_dataset()
+
+    assert skips == [8]
+    assert embeddings.embedded == ROWS[8:]
+    assert manifest["complete"]
+    assert [shard["start"] for shard in manifest["shards"]] == [0, 4, 8]
+
+    texts, indexes, vectors = [], [], []
+    for shard_vectors, shard_texts, shard_indexes in builder.iter_shards():
+        vectors.append(shard_vectors)
+        texts.extend(shard_texts)
+        indexes.extend(shard_indexes)
+    assert texts == ROWS
+    assert indexes == list(range(10))
+    np.testing.assert_allclose(np.concatenate(vectors), [embeddings.vector(text) for text in ROWS], rtol=1e-6)
+
+
+def test_completed_build_is_not_encoded_again(monkeypatch, builder, embeddings):
+    stream_rows(monkeypatch, builder, ROWS)
+    builder.encode_dataset()
+    embeddings.embedded.clear()
+
+    skips = stream_rows(monkeypatch, builder, ROWS)
+    builder.encode_dataset()
+    assert skips == []
+    assert embeddings.embedded == []
+
+
+def test_half_written_shard_is_redone(monkeypatch, builder, embeddings):
+    stream_rows(monkeypatch, builder, ROWS, fail_after_chunks=1)
+    with pytest.raises(Interrupted):
+        builder.encode_dataset()
+    # A crash between the temp writes and the renames leaves only .tmp files, not in the manifest
+    leftover = os.path.join(builder.checkpoint_dir, "shard_00001.npy.tmp")
+    with open(leftover, "wb") as f:
+        f.write(b"partial")
+
+    stream_rows(monkeypatch, builder, ROWS)
+    manifest = builder.encode_dataset()
+    assert manifest["rows"] == 10
+    assert not os.path.exists(leftover)
+    with open(os.path.join(builder.checkpoint_dir, "shard_00001.jsonl"), "r", encoding="utf-8") as f:
+        assert [json.loads(line)["image_index"] for line in f] == [4, 5, 6, 7]
+
+
+def test_rejects_non_positive_sizes(embeddings):
+    with pytest.raises(ValueError):
+        StreamingIndexBuilder(SimpleNamespace(embeddings=embeddings), shard_size=0)
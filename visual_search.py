@@ -0,0 +1,173 @@
+"""
+Direct image-to-catalog search over CLIP embeddings of the catalog thumbnails.
+
+An uploaded image (or one from a URL) is embedded with a CPU image encoder
+and matched against the image index by vector search, so image queries no
+longer wait on the vision LLM and the rephrasing before retrieval starts.
+Any text the user typed (and the LLM description, once it arrives) is
+searched in the text index and fused with the visual ranking by reciprocal
+rank fusion.
+
+The image index is built offline from the packed catalog thumbnails (see
+catalog_store) and saved in the memory-mapped layout of mmap_store:
+
+    python visual_search.py --catalog-path catalog_store --save-path image_index
+"""
+from io import BytesIO
+from typing import Callable, Dict, List, Optional, Sequence
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+from PIL import Image
+
+import ann_index
+import mmap_store
+import telemetry
+from ranking import reciprocal_rank_fusion
+from resources import get_registry
+
+DEFAULT_IMAGE_INDEX_PATH = "image_index"
+# CLIP image encoder (sentence-transformers), small enough for CPU
+IMAGE_MODEL = os.getenv("IMAGE_MODEL", "clip-ViT-B-32")
+MODEL_FILE = "image_model.json"
+
+# Weight of the visual ranking vs. the text ranking when both are fused
+VISUAL_WEIGHT = 1.0
+TEXT_WEIGHT = 1.0
+
+
+def has_image_index(path: str = DEFAULT_IMAGE_INDEX_PATH) -> bool:
+    return mmap_store.is_mmap_store(path) and os.path.exists(os.path.join(path, MODEL_FILE))
+
+
+class ImageEncoder:
+    """L2-normalized CLIP image embeddings, computed on CPU."""
+    def __init__(self, model_name: str = IMAGE_MODEL, batch_size: int = 32):
+        self.model_name = model_name
+        self.batch_size = batch_size
+
+    @property
+    def model(self):
+        def factory():
+            from sentence_transformers import SentenceTransformer
+            return SentenceTransformer(self.model_name, device="cpu")
+
+        return get_registry().get(f"image_encoder:{self.model_name}", factory)
+
+    def encode(self, images: Sequence[Image.Image]) -> np.ndarray:
+        images = [image if image.mode == "RGB" else image.convert("RGB") for image in images]
+        vectors = self.model.encode(images, batch_size=self.batch_size, convert_to_numpy=True,
+                                    normalize_embeddings=True, show_progress_bar=False)
+        return np.asarray(vectors, dtype="float32")
+
+
+def build_image_index(save_path: str = DEFAULT_IMAGE_INDEX_PATH, catalog_path: str = "catalog_store",
+                      model_name: str = IMAGE_MODEL, batch_size: int = 64, index_type: str = "flat",
+                      **index_params) -> int:
+    """
+    Embed every catalog thumbnail and save the image index.
+
+    Returns:
+        int: Number of images indexed
+    """
+    from catalog_store import THUMBNAILS, CatalogStore
+
+    if not CatalogStore.is_built(catalog_path):
+        raise FileNotFoundError(f"No catalog store in {catalog_path}; build it with bulid_vec_db.py first")
+
+    thumbnails = mmap_store.PackedBlobs(catalog_path, THUMBNAILS)
+    captions = mmap_store.PackedBlobs(catalog_path, mmap_store.CAPTIONS)
+    image_indexes = np.load(os.path.join(catalog_path, mmap_store.IMAGE_INDEX_FILE))
+    encoder = ImageEncoder(model_name, batch_size=batch_size)
+    started = time.perf_counter()
+    try:
+        chunks = []
+        for start in range(0, len(thumbnails), batch_size):
+            end = min(start + batch_size, len(thumbnails))
+            chunks.append(encoder.encode([Image.open(BytesIO(thumbnails[i])) for i in range(start, end)]))
+            if len(chunks) % 20 == 0 or end == len(thumbnails):
+                print(f"{end} images embedded, {end / (time.perf_counter() - started):.1f} images/sec")
+        texts = [captions[i].decode("utf-8") for i in range(len(captions))]
+    finally:
+        thumbnails.close()
+        captions.close()
+
+    vectors = np.concatenate(chunks) if chunks else np.zeros((0, 0), dtype="float32")
+    os.makedirs(save_path, exist_ok=True)
+    faiss.write_index(ann_index.build_faiss_index(vectors, index_type=index_type, **index_params),
+                      os.path.join(save_path, mmap_store.INDEX_FILE))
+    mmap_store.write_metadata(save_path, texts, image_indexes)
+    ann_index.save_index_params(save_path, {"index_type": index_type, "nprobe": None, "ef_search": None,
+                                            "build": index_params})
+    with open(os.path.join(save_path, MODEL_FILE), "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "dimension": int(vectors.shape[1]), "vectors": len(vectors)}, f, indent=2)
+    print(f"Image index ({index_type}) with {len(vectors)} vectors saved to {save_path} "
+          f"in {time.perf_counter() - started:.1f}s")
+    return len(vectors)
+
+
+class VisualSearch:
+    """
+    Image queries against the image index, optionally fused with text search.
+
+    Args:
+        path (str): Directory of the image index
+        text_search (Callable): `search(query, k=...)` over the text index (e.g.
+            recommendations_based_on_vecdb.search), used for the query text and image description
+    """
+    def __init__(self, path: str = DEFAULT_IMAGE_INDEX_PATH, text_search: Optional[Callable[..., List[Dict]]] = None):
+        with open(os.path.join(path, MODEL_FILE), "r", encoding="utf-8") as f:
+            self.model_name = json.load(f)["model"]
+        self.store = mmap_store.MmapVectorStore(path)
+        self.encoder = ImageEncoder(self.model_name)
+        self.text_search = text_search
+
+    def search(self, image: Image.Image, k: int = 30) -> List[Dict]:
+        """Catalog items closest to `image`, as {'id', 'content', 'visual_score'} dicts (cosine similarity)."""
+        with telemetry.span("encode_image", model=self.model_name):
+            vector = self.encoder.encode([image])
+        with telemetry.span("visual_search", k=k):
+            distances, positions = ann_index.search(self.store.index, vector, k, mask=self.store.live_mask)
+        return [
+            {
+                "id": int(self.store.image_indexes[position]),
+                "content": self.store.caption_at(int(position)),
+                # Squared L2 between unit vectors: cosine = 1 - d / 2
+                "visual_score": float(1 - distance / 2),
+            }
+            for distance, position in zip(distances[0], positions[0]) if position != -1
+        ]
+
+    def search_fused(self, image: Image.Image, text: Optional[str] = None, k: int = 30,
+                     visual_weight: float = VISUAL_WEIGHT, text_weight: float = TEXT_WEIGHT) -> List[Dict]:
+        """
+        Visual results fused with text-index results for `text` by reciprocal rank fusion.
+
+        Without text (or a text search) this is just `search`.
+        """
+        visual_items = self.search(image, k=k)
+        if not text or self.text_search is None:
+            return visual_items
+        text_items = self.text_search(text, k=k)
+        return reciprocal_rank_fusion([visual_items, text_items], weights=[visual_weight, text_weight])[:k]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the image index over the catalog thumbnails.")
+    parser.add_argument("--catalog-path", default="catalog_store")
+    parser.add_argument("--save-path", default=DEFAULT_IMAGE_INDEX_PATH)
+    parser.add_argument("--model", default=IMAGE_MODEL, help="sentence-transformers image model")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--index-type", default="flat", choices=list(ann_index.INDEX_TYPES))
+    parser.add_argument("--query", default=None, help="Image file to search for once the index is built")
+    args = parser.parse_args()
+
+    build_image_index(args.save_path, args.catalog_path, model_name=args.model, batch_size=args.batch_size,
+                      index_type=args.index_type)
+    if args.query:
+        for item in VisualSearch(args.save_path).search(Image.open(args.query), k=5):
+            print(f"{item['id']:>8}  {item['visual_score']:.3f}  {item['content'][:80]}")